@@ -0,0 +1,573 @@
+# Acoustic drone detection
+# Runs next to the camera threads: audio blocks from a WAV file or a capture
+# device go into a ring buffer, every hop_size samples a window is cut out and
+# all windows of a block go through one batched FFT (channels are averaged in
+# the power spectrum). A rotor produces a blade-pass fundamental with a comb of
+# harmonics; every frame is scored for all candidate fundamentals at once by
+# looking up the harmonic bins of a precomputed index table in the whitened
+# spectrum. A detection that holds for a few frames becomes an event (start,
+# ongoing every event_interval seconds, end) with a timestamp, the fundamental
+# and the salience, which headless.py writes to the same output as detections.
+#
+# The windows are analysed once batch_hops of them are ready, so with the
+# default block of one hop the FFT batch spans several blocks. The cost per
+# block is bounded: at most max_frames_per_block windows are analysed, older
+# ones are skipped when the thread falls behind.
+#
+# Benchmark: python acoustic.py --benchmark (synthetic 48 kHz 4-channel recording)
+#            python acoustic.py --benchmark --source wav:recording.wav
+# Run:       python acoustic.py --source device:0 --channels 2
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+# One record per event: 1 = start, 2 = ongoing, 0 = end
+ACOUSTIC_DTYPE = np.dtype([
+    ('state', np.uint8), ('harmonics', np.uint8),
+    ('f0', np.float32), ('salience', np.float32), ('level', np.float32),
+])
+EVENT_END, EVENT_START, EVENT_ONGOING = 0, 1, 2
+
+
+class WavSource:
+    """Blocks of float32 samples (frames x channels) from a PCM WAV file"""
+    is_live = False
+
+    def __init__(self, path, block_size=1024, realtime=False, loop=False):
+        self.path = path
+        self.block_size = block_size
+        self.realtime = realtime
+        self.loop = loop
+        self.file = None
+        self.sample_rate = 0
+        self.channels = 0
+        self.position = 0  # Samples read so far
+        self._start_time = None
+
+    @property
+    def name(self):
+        return f"wav:{self.path}"
+
+    def open(self):
+        try:
+            self.file = wave.open(self.path, 'rb')
+        except (OSError, wave.Error) as e:
+            print(f"Cannot open {self.path}: {e}")
+            return False
+        self.sample_rate = self.file.getframerate()
+        self.channels = self.file.getnchannels()
+        self.sample_width = self.file.getsampwidth()
+        if self.sample_width not in (1, 2, 3, 4):
+            print(f"{self.path}: unsupported sample width {self.sample_width}")
+            return False
+        return True
+
+    def _decode(self, data):
+        if self.sample_width == 1:
+            samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+        elif self.sample_width == 2:
+            samples = np.frombuffer(data, '<i2').astype(np.float32) / 32768
+        elif self.sample_width == 3:
+            # 24 bit: pad every sample to 32 bit
+            raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+            padded = np.zeros((len(raw), 4), np.uint8)
+            padded[:, 1:] = raw
+            samples = padded.view('<i4').ravel().astype(np.float32) / 2 ** 31
+        else:
+            samples = np.frombuffer(data, '<i4').astype(np.float32) / 2 ** 31
+        return samples.reshape(-1, self.channels)
+
+    def read(self):
+        """Next block, None at the end of the file"""
+        data = self.file.readframes(self.block_size)
+        if not data and self.loop:
+            self.file.rewind()
+            data = self.file.readframes(self.block_size)
+        if not data:
+            return None
+        block = self._decode(data)
+        self.position += len(block)
+        if self.realtime:
+            now = time.perf_counter()
+            if self._start_time is None:
+                self._start_time = now
+            delay = self._start_time + self.position / self.sample_rate - now
+            if delay > 0:
+                time.sleep(delay)
+        return block
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class DeviceSource:
+    """Blocks from an audio capture device (needs the sounddevice package)"""
+    is_live = True
+
+    def __init__(self, device=None, sample_rate=48000, channels=1, block_size=1024):
+        self.device = device
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.stream = None
+        self.position = 0
+        self.overflows = 0
+
+    @property
+    def name(self):
+        return f"device:{self.device if self.device is not None else 'default'}"
+
+    def open(self):
+        try:
+            import sounddevice
+        except ImportError:
+            print("Audio capture needs the sounddevice package (pip install sounddevice)")
+            return False
+        try:
+            self.stream = sounddevice.InputStream(device=self.device, samplerate=self.sample_rate,
+                                                  channels=self.channels, blocksize=self.block_size,
+                                                  dtype='float32')
+            self.stream.start()
+        except Exception as e:
+            print(f"Cannot open audio device {self.device}: {e}")
+            return False
+        return True
+
+    def read(self):
+        block, overflowed = self.stream.read(self.block_size)
+        if overflowed:
+            self.overflows += 1
+        self.position += len(block)
+        return block
+
+    def release(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+def create_audio_source(spec, block_size=1024, sample_rate=48000, channels=1, realtime=False, loop=False):
+    """Audio source from a spec: "wav:FILE", "FILE.wav", "device" or "device:N" """
+    kind, _, arg = str(spec).partition(':')
+    if kind == 'device':
+        device = int(arg) if arg.isdigit() else (arg or None)
+        return DeviceSource(device, sample_rate, channels, block_size)
+    if kind == 'wav':
+        return WavSource(arg, block_size, realtime, loop)
+    if str(spec).lower().endswith('.wav'):
+        return WavSource(spec, block_size, realtime, loop)
+    raise ValueError(f"Unknown audio source: {spec}")
+
+
+class AudioRing:
+    """Multi-channel sample buffer that always hands out contiguous windows
+
+    The buffer is twice the capacity; when a write would run past the end, the
+    samples still needed are moved to the front, so windows never wrap.
+    """
+
+    def __init__(self, channels, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros((channels, 2 * capacity), np.float32)
+        self.start = 0  # First sample still needed
+        self.end = 0
+        self.offset = 0  # Stream position of buffer[:, 0]
+
+    def write(self, block):
+        """Append a (frames x channels) block"""
+        count = len(block)
+        if count > self.capacity:
+            block = block[-self.capacity:]
+            self.start = self.end = self.end + count - self.capacity
+            count = self.capacity
+        if self.end + count > self.buffer.shape[1]:
+            keep = self.end - self.start
+            self.buffer[:, :keep] = self.buffer[:, self.start:self.end]
+            self.offset += self.start
+            self.start, self.end = 0, keep
+        self.buffer[:, self.end:self.end + count] = block.T
+        self.end += count
+
+    def consume(self, position):
+        """Samples before stream position are no longer needed"""
+        self.start = max(self.start, min(position - self.offset, self.end))
+
+    def view(self, position, count):
+        """(channels x count) samples starting at stream position"""
+        index = position - self.offset
+        return self.buffer[:, index:index + count]
+
+    @property
+    def position(self):
+        """Stream position of the next sample to be written"""
+        return self.offset + self.end
+
+
+class AcousticDetector:
+    """Rotor-harmonic detector for a stream of audio blocks
+
+    fft_size/hop_size: analysis window and step in samples (overlap = fft - hop).
+    f0_range: Hz range of the blade-pass fundamental, harmonics: comb length.
+    threshold_db: mean harmonic level above the noise floor (minus the level
+    between the harmonics) for a frame to count; min_harmonics must stand out
+    by more than half of it. min_frames positive frames start a detection,
+    hold_frames negative frames end it.
+    batch_hops: windows collected before they are analysed in one batch; more
+    windows per FFT call for up to batch_hops - 1 hops of extra latency.
+    """
+
+    def __init__(self, sample_rate=48000, channels=1, fft_size=4096, hop_size=1024,
+                 f0_range=(60.0, 400.0), harmonics=8, threshold_db=8.0, min_harmonics=4,
+                 min_frames=5, hold_frames=25, event_interval=0.5, max_frames_per_block=8,
+                 batch_hops=4, start_time=0.0):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        self.threshold_db = threshold_db
+        self.min_harmonics = min_harmonics
+        self.min_frames = min_frames
+        self.hold_frames = hold_frames
+        self.event_interval = event_interval
+        self.max_frames_per_block = max_frames_per_block
+        self.batch_hops = max(1, min(batch_hops, max_frames_per_block))
+        self.start_time = start_time
+
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.bin_hz = sample_rate / fft_size
+        self.ring = AudioRing(channels, fft_size + hop_size * (max_frames_per_block + 1) + 8192)
+        self.next_frame = 0  # Stream position of the next analysis window
+
+        # Candidate fundamentals every half bin; bins of their harmonics and of
+        # the midpoints between them (where a true fundamental has no energy)
+        bins = fft_size // 2 + 1
+        self.candidates = np.arange(f0_range[0], f0_range[1], self.bin_hz / 2)
+        k = np.arange(1, harmonics + 1)
+        self.harmonic_bins = np.clip(np.rint(np.outer(self.candidates, k) / self.bin_hz), 0, bins - 1).astype(np.intp)
+        self.between_bins = np.clip(np.rint(np.outer(self.candidates, k - 0.5) / self.bin_hz), 0, bins - 1).astype(np.intp)
+        self.max_bin = int(self.harmonic_bins.max()) + 2
+
+        self.noise_floor = None
+        self.positive = 0
+        self.negative = 0
+        self.active = False
+        self.last_event_time = 0.0
+        self.stats = {'blocks': 0, 'frames': 0, 'skipped': 0, 'events': 0, 'block_ms': 0.0, 'max_block_ms': 0.0}
+        self.last_frame = None  # (f0, salience, harmonics, level) of the last analysed frame
+        self.last_hit = None    # Same for the last frame that counted as a detection
+
+    def spectra(self, frames):
+        """Log power spectra (frames x bins up to the highest harmonic) of a window batch"""
+        # (channels, frames, fft) in one FFT call, channels averaged in power
+        spectrum = np.fft.rfft(frames * self.window, axis=-1)[..., :self.max_bin]
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=0)
+        return 10 * np.log10(power + 1e-12)
+
+    def score(self, log_power):
+        """Best (f0, salience, harmonics) per frame"""
+        if self.noise_floor is None:
+            self.noise_floor = np.median(log_power, axis=0)
+        whitened = np.clip(log_power - self.noise_floor, 0, 30)
+        # Tolerate a bin of rounding / rotor speed change: local max over 3 bins
+        widened = whitened.copy()
+        np.maximum(widened[:, 1:], whitened[:, :-1], out=widened[:, 1:])
+        np.maximum(widened[:, :-1], whitened[:, 1:], out=widened[:, :-1])
+
+        at_harmonics = widened[:, self.harmonic_bins]  # frames x candidates x harmonics
+        salience = at_harmonics.mean(axis=2) - widened[:, self.between_bins].mean(axis=2)
+        best = salience.argmax(axis=1)
+        rows = np.arange(len(best))
+        present = (at_harmonics[rows, best] > self.threshold_db / 2).sum(axis=1)
+        return self.candidates[best], salience[rows, best], present
+
+    def _update_floor(self, log_power, detected):
+        # The floor follows the background slowly, and ten times slower during a detection
+        alpha = np.where(detected, 0.002, 0.02)[:, None]
+        for row, a in zip(log_power, alpha):
+            self.noise_floor += a * (row - self.noise_floor)
+
+    def process(self, block):
+        """Feed a (samples x channels) block, returns the events it completed"""
+        start = time.perf_counter()
+        self.ring.write(block)
+        available = (self.ring.position - self.fft_size - self.next_frame) // self.hop_size + 1
+        events = []
+        if available >= self.batch_hops:
+            if available > self.max_frames_per_block:
+                # Behind: keep the cost per block bounded, skip the oldest windows
+                skip = available - self.max_frames_per_block
+                self.next_frame += skip * self.hop_size
+                self.stats['skipped'] += skip
+                available = self.max_frames_per_block
+            span = self.ring.view(self.next_frame, self.fft_size + (available - 1) * self.hop_size)
+            frames = np.lib.stride_tricks.sliding_window_view(span, self.fft_size, axis=1)[:, ::self.hop_size]
+            log_power = self.spectra(frames)
+            f0, salience, present = self.score(log_power)
+            detected = (salience > self.threshold_db) & (present >= self.min_harmonics)
+            level = 10 * np.log10(np.mean(frames[..., -self.hop_size:] ** 2, axis=(0, 2)) + 1e-12)
+            for i in range(available):
+                end_position = self.next_frame + i * self.hop_size + self.fft_size
+                timestamp = self.start_time + end_position / self.sample_rate
+                self.last_frame = (float(f0[i]), float(salience[i]), int(present[i]), float(level[i]))
+                event = self._decide(bool(detected[i]), timestamp)
+                if event is not None:
+                    events.append((timestamp, event))
+            self._update_floor(log_power, detected)
+            self.next_frame += available * self.hop_size
+            self.ring.consume(self.next_frame)
+            self.stats['frames'] += available
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats['blocks'] += 1
+        self.stats['block_ms'] = 0.95 * self.stats['block_ms'] + 0.05 * elapsed
+        self.stats['max_block_ms'] = max(self.stats['max_block_ms'], elapsed)
+        self.stats['events'] += len(events)
+        return events
+
+    def _decide(self, detected, timestamp):
+        """Hysteresis over frames, returns an ACOUSTIC_DTYPE record or None"""
+        if detected:
+            self.positive += 1
+            self.negative = 0
+            self.last_hit = self.last_frame
+        else:
+            self.negative += 1
+            self.positive = 0
+        state = None
+        if not self.active and self.positive >= self.min_frames:
+            self.active = True
+            state = EVENT_START
+        elif self.active and self.negative >= self.hold_frames:
+            self.active = False
+            state = EVENT_END
+        elif self.active and detected and timestamp - self.last_event_time >= self.event_interval:
+            state = EVENT_ONGOING
+        if state is None:
+            return None
+        self.last_event_time = timestamp
+        record = np.zeros((), ACOUSTIC_DTYPE)
+        # An end event describes the last frame the rotor was still heard
+        f0, salience, present, level = self.last_hit if state == EVENT_END else self.last_frame
+        record['state'], record['f0'], record['salience'] = state, f0, salience
+        record['harmonics'], record['level'] = present, level
+        return record
+
+
+class AcousticThread(threading.Thread):
+    """Reads an audio source and hands (timestamp, event) to on_event"""
+
+    def __init__(self, source, index=0, on_event=None, detector_kwargs=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.index = index
+        self.on_event = on_event
+        self.detector_kwargs = detector_kwargs or {}
+        self.detector = None
+        self.running = False
+        self.finished = False
+
+    def run(self):
+        try:
+            if not self.source.open():
+                return
+            # Live sources: sample 0 was captured about now; files run on media time
+            start_time = time.time() if self.source.is_live else 0.0
+            self.detector = AcousticDetector(self.source.sample_rate, self.source.channels,
+                                             start_time=start_time, **self.detector_kwargs)
+            self.running = True
+            while self.running:
+                block = self.source.read()
+                if block is None:
+                    break
+                for timestamp, event in self.detector.process(block):
+                    if self.on_event:
+                        self.on_event(self.index, timestamp, event)
+            self.source.release()
+        except Exception as e:
+            print(f"Audio error on {self.source.name}: {e}")
+        finally:
+            self.finished = True
+
+    def stop(self):
+        self.running = False
+
+    def snapshot(self):
+        """Detector counters as a JSON-friendly dict"""
+        if self.detector is None:
+            return {'source': self.source.name, 'running': False}
+        stats = dict(self.detector.stats)
+        stats['source'] = self.source.name
+        stats['active'] = self.detector.active
+        return stats
+
+
+def write_test_recording(path, seconds=60.0, sample_rate=48000, channels=4, seed=0):
+    """Synthetic recording with drone passes; returns the (start, end) seconds of each pass
+
+    Background: wind-like low-frequency noise, white noise and a steady 1 kHz
+    tone (a single line, not a comb). A pass is a rotor comb whose fundamental
+    wanders around 120-250 Hz, fading in and out.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    t = np.arange(total) / sample_rate
+    wind = np.cumsum(rng.normal(0, 1, total)).astype(np.float32)
+    wind -= np.convolve(wind, np.ones(4801) / 4801, mode='same')  # Remove the drift
+    base = 0.002 * wind / (np.abs(wind).max() + 1e-9) * 20 + 0.05 * np.sin(2 * np.pi * 1000 * t)
+
+    passes = []
+    signal = np.zeros(total, np.float32)
+    start = 5.0
+    while start + 6 < seconds:
+        duration = rng.uniform(4, 8)
+        end = min(start + duration, seconds - 1)
+        f0 = rng.uniform(120, 250)
+        mask = (t >= start) & (t < end)
+        local = t[mask] - start
+        envelope = np.sin(np.pi * local / (end - start)) ** 0.5
+        frequency = f0 * (1 + 0.03 * np.sin(2 * np.pi * 0.3 * local))
+        phase = 2 * np.pi * np.cumsum(frequency) / sample_rate
+        comb = sum(np.sin(k * phase) / k for k in range(1, 9))
+        signal[mask] = 0.03 * envelope * comb
+        passes.append((start, end))
+        start = end + rng.uniform(4, 10)
+
+    data = np.empty((total, channels), np.float32)
+    for channel in range(channels):
+        # Every microphone: the same scene, a small delay and its own noise
+        delayed = np.roll(signal + base, channel * 7)
+        data[:, channel] = delayed + rng.normal(0, 0.01, total)
+    pcm = (np.clip(data, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return passes
+
+
+def run_benchmark(spec=None, block_size=1024, channels=4, seconds=60.0, batch_hops=4):
+    """Throughput of the detector on a recording, batched FFT against one FFT per window"""
+    passes = None
+    path = None
+    if spec is None:
+        path = os.path.join(tempfile.gettempdir(), 'acoustic_benchmark.wav')
+        passes = write_test_recording(path, seconds, channels=channels)
+        spec = f"wav:{path}"
+
+    source = create_audio_source(spec, block_size)
+    if not source.open():
+        return
+    blocks = []
+    while True:
+        block = source.read()
+        if block is None:
+            break
+        blocks.append(block)
+    source.release()
+    duration = sum(len(block) for block in blocks) / source.sample_rate
+    print(f"{spec}: {duration:.1f}s, {source.sample_rate}Hz, {source.channels} channels, "
+          f"blocks of {block_size} samples ({block_size / source.sample_rate * 1000:.1f}ms)")
+
+    budget = block_size / source.sample_rate * 1000
+
+    def per_window(detector):
+        """One FFT call per window and channel instead of the batched spectra"""
+        def spectra(frames):
+            power = np.zeros((frames.shape[1], detector.max_bin))
+            for i in range(frames.shape[1]):
+                for channel in range(frames.shape[0]):
+                    spectrum = np.fft.rfft(frames[channel, i] * detector.window)[:detector.max_bin]
+                    power[i] += np.abs(spectrum) ** 2
+            return 10 * np.log10(power / frames.shape[0] + 1e-12)
+        detector.spectra = spectra
+        return detector
+
+    # With blocks of one hop, batch_hops sets how many windows share an FFT call
+    variants = [
+        (f"batched, every {batch_hops} hops", lambda: AcousticDetector(source.sample_rate, source.channels,
+                                                                      batch_hops=batch_hops)),
+        ("batched, every hop", lambda: AcousticDetector(source.sample_rate, source.channels, batch_hops=1)),
+        ("per window, every hop", lambda: per_window(AcousticDetector(source.sample_rate, source.channels,
+                                                                      batch_hops=1))),
+    ]
+    # Best of three rounds, the variants take turns
+    best = {}
+    events = None
+    for _ in range(3):
+        for label, make in variants:
+            detector = make()
+            found = []
+            block_ms = []
+            for block in blocks:
+                start = time.perf_counter()
+                found.extend(detector.process(block))
+                block_ms.append((time.perf_counter() - start) * 1000)
+            block_ms = np.array(block_ms)
+            if label not in best or block_ms.mean() < best[label][0].mean():
+                best[label] = (block_ms, detector.stats['frames'])
+            if events is None:
+                events = found
+    for label, _ in variants:
+        block_ms, windows = best[label]
+        print(f"{label + ':':<27} {block_ms.mean():.3f}ms/block mean, p99 {np.percentile(block_ms, 99):.3f}ms, "
+              f"max {block_ms.max():.3f}ms of a {budget:.1f}ms budget; "
+              f"{duration / (block_ms.sum() / 1000):.0f}x realtime, {windows} windows")
+
+    starts = [timestamp for timestamp, event in events if event['state'] == EVENT_START]
+    print(f"{len(starts)} detections: " + ", ".join(f"{t:.1f}s" for t in starts))
+    if passes is not None:
+        found = sum(any(a - 0.5 <= t <= b for t in starts) for a, b in passes)
+        false = sum(not any(a - 0.5 <= t <= b for a, b in passes) for t in starts)
+        delays = [min(t for t in starts if a - 0.5 <= t <= b) - a for a, b in passes
+                  if any(a - 0.5 <= t <= b for t in starts)]
+        print(f"{found}/{len(passes)} drone passes detected, {false} false detections"
+              + (f", mean {np.mean(delays):.2f}s after the pass started" if delays else ""))
+    if path:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Acoustic drone detection")
+    parser.add_argument('--source', help="wav:FILE, FILE.wav, device or device:N")
+    parser.add_argument('--channels', type=int, default=1, help="Device channels (or channels of the test recording)")
+    parser.add_argument('--rate', type=int, default=48000)
+    parser.add_argument('--block', type=int, default=1024, help="Samples per block")
+    parser.add_argument('--batch-hops', type=int, default=4, help="Windows analysed per FFT batch")
+    parser.add_argument('--benchmark', action='store_true', help="Throughput on a recording")
+    parser.add_argument('--seconds', type=float, default=60.0, help="Length of the synthetic recording")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.source, args.block, max(args.channels, 4) if not args.source else args.channels,
+                      args.seconds, args.batch_hops)
+        return
+    if not args.source:
+        parser.error("--source is required without --benchmark")
+
+    def show(index, timestamp, event):
+        state = {EVENT_START: 'start', EVENT_ONGOING: 'ongoing', EVENT_END: 'end'}[int(event['state'])]
+        print(f"{timestamp:.2f}s {state}: f0 {float(event['f0']):.0f}Hz, "
+              f"{int(event['harmonics'])} harmonics, salience {float(event['salience']):.1f}dB")
+
+    source = create_audio_source(args.source, args.block, args.rate, args.channels, realtime=True)
+    thread = AcousticThread(source, on_event=show, detector_kwargs={'batch_hops': args.batch_hops})
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        thread.stop()
+    print(thread.snapshot())
+
+
+if __name__ == "__main__":
+    main()
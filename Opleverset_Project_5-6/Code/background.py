@@ -0,0 +1,233 @@
+# Background-model engines for the motion detector
+# Every engine has the apply(frame) -> mask interface of the OpenCV background
+# subtractors (mask 255 = foreground) and holds the state of one camera, so a
+# detector, worker or GUI creates one engine per camera. Which engine is used is
+# configuration (MotionDetector(background=...), --background on the command line).
+#
+#   mog2          MOG2 on the colour frame (the original model)
+#   mog2_gray     MOG2 on the grayscale frame, a third of the data
+#   running_avg   exponential running average of the grayscale frame (cv2.accumulateWeighted),
+#                 only background pixels are learned so targets leave no trail
+#   median        per-pixel median of a few grayscale frames sampled over the history (NumPy)
+#
+# Downsampled models are not a separate engine: every engine runs on the detection
+# level of the pyramid, so --detect-scale 0.5 / 0.25 applies to all of them.
+#
+# Comparison: python background.py --clip synthetic --clip video:drone.mp4
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+
+def to_gray(frame):
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+
+class GrayMOG2:
+    """MOG2 on the grayscale frame"""
+
+    def __init__(self, history=100, var_threshold=25):
+        self.model = cv2.createBackgroundSubtractorMOG2(
+            history=history, varThreshold=var_threshold, detectShadows=False)
+
+    def apply(self, frame):
+        return self.model.apply(to_gray(frame))
+
+
+class RunningAverage:
+    """Exponential running average of the grayscale frame
+
+    alpha defaults to 1 / history. Pixels that differ more than threshold grey
+    levels from the average are foreground and are learned ten times slower, so
+    targets leave no trail while a target that stops still fades into the model.
+    """
+
+    def __init__(self, history=100, threshold=20, alpha=None):
+        self.alpha = alpha or 1.0 / history
+        self.threshold = threshold
+        self.average = None
+        self.gray = None
+        self.diff = None
+        self.background_mask = None
+        self.history = history
+        self.frame_index = 0
+
+    def apply(self, frame):
+        gray = to_gray(frame)
+        if self.average is None or self.average.shape != gray.shape:
+            self.average = gray.astype(np.float32)
+            self.gray = np.empty(gray.shape, np.float32)
+            self.diff = np.empty(gray.shape, np.float32)
+            self.background_mask = np.empty(gray.shape, np.uint8)
+            self.frame_index = 0
+            return np.zeros(gray.shape, np.uint8)
+        np.copyto(self.gray, gray)
+        cv2.absdiff(self.gray, self.average, dst=self.diff)
+        mask = cv2.compare(self.diff, self.threshold, cv2.CMP_GT)
+        self.frame_index += 1
+        if self.frame_index < self.history:
+            # Bootstrap: plain mean of everything seen so far, so targets in the
+            # first frames do not stay behind as ghosts
+            cv2.accumulateWeighted(self.gray, self.average, max(self.alpha, 1.0 / (self.frame_index + 1)))
+        else:
+            cv2.bitwise_not(mask, dst=self.background_mask)
+            cv2.accumulateWeighted(self.gray, self.average, self.alpha, mask=self.background_mask)
+            cv2.accumulateWeighted(self.gray, self.average, self.alpha * 0.1, mask=mask)
+        return mask
+
+
+class TemporalMedian:
+    """Per-pixel median of num_samples grayscale frames spread over history frames
+
+    The median is only recomputed when a new sample is taken, so its cost is
+    spread over history / num_samples frames.
+    """
+
+    def __init__(self, history=100, threshold=20, num_samples=9):
+        self.threshold = threshold
+        self.num_samples = num_samples
+        self.sample_interval = max(1, history // num_samples)
+        self.samples = None
+        self.filled = 0
+        self.frame_index = 0
+        self.median = None
+
+    def apply(self, frame):
+        gray = to_gray(frame)
+        if self.samples is None or self.samples.shape[1:] != gray.shape:
+            self.samples = np.empty((self.num_samples,) + gray.shape, np.uint8)
+            self.filled = 0
+            self.frame_index = 0
+        if self.frame_index % self.sample_interval == 0 or self.filled < self.num_samples:
+            # Fill the model quickly at the start, then one sample per interval
+            self.samples[self.filled % self.num_samples] = gray
+            self.filled += 1
+            count = min(self.filled, self.num_samples)
+            self.median = np.median(self.samples[:count], axis=0).astype(np.uint8)
+        self.frame_index += 1
+        diff = cv2.absdiff(gray, self.median)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        return mask
+
+
+BACKGROUND_ENGINES = ('mog2', 'mog2_gray', 'running_avg', 'median')
+
+
+def create_background_model(engine='mog2', history=100, var_threshold=25, threshold=20):
+    """New background model for one camera
+
+    var_threshold is used by the MOG2 engines, threshold (grey levels) by the others.
+    """
+    if engine == 'mog2':
+        return cv2.createBackgroundSubtractorMOG2(
+            history=history,
+            varThreshold=var_threshold,
+            detectShadows=False  # Disable for speed
+        )
+    if engine == 'mog2_gray':
+        return GrayMOG2(history, var_threshold)
+    if engine == 'running_avg':
+        return RunningAverage(history, threshold)
+    if engine == 'median':
+        return TemporalMedian(history, threshold)
+    raise ValueError(f"Unknown background engine: {engine}")
+
+
+def _recall(ground_truth, detections):
+    """Ground-truth boxes whose centre lies inside a detection: (found, total)"""
+    found = 0
+    boxes = detections[['x', 'y', 'w', 'h']].tolist()
+    for gx, gy, gw, gh in ground_truth:
+        cx, cy = gx + gw / 2, gy + gh / 2
+        if any(x <= cx <= x + w and y <= cy <= y + h for x, y, w, h in boxes):
+            found += 1
+    return found, len(ground_truth)
+
+
+def compare_engines(clips, engines=BACKGROUND_ENGINES, max_frames=200, warmup=30, detection_scale=None):
+    """Throughput and recall of every engine on every clip
+
+    Recall is measured against the ground truth of synthetic clips; recorded
+    clips have none, there the detections of the 'mog2' engine are the reference.
+    """
+    from detection import MotionDetector
+    from frame_sources import create_source
+
+    rows = []
+    for clip in clips:
+        source = create_source(clip, realtime=False)
+        if not source.open():
+            continue
+        frames, truth = [], []
+        while len(frames) < max_frames + warmup:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frames.append(frame.copy())
+            truth.append(list(getattr(source, 'ground_truth', None) or []))
+        source.release()
+        has_truth = any(truth)
+
+        reference = None
+        if not has_truth:
+            # Reference run: boxes of the original model per frame
+            detector = MotionDetector(detection_scale=detection_scale)
+            reference = []
+            for frame in frames:
+                detector.process(frame)
+                boxes = detector.last_detections
+                reference.append(list(boxes[['x', 'y', 'w', 'h']].tolist()))
+
+        for engine in engines:
+            detector = MotionDetector(background=engine, detection_scale=detection_scale)
+            subtract_ms = total_ms = 0.0
+            found = expected = false_positives = 0
+            for i, frame in enumerate(frames):
+                start = time.perf_counter()
+                detector.process(frame)
+                elapsed = (time.perf_counter() - start) * 1000
+                if i < warmup:
+                    continue
+                total_ms += elapsed
+                subtract_ms += detector.last_stats['stages']['subtract']
+                targets = truth[i] if has_truth else reference[i]
+                hit, count = _recall(targets, detector.last_detections)
+                found += hit
+                expected += count
+                false_positives += max(0, len(detector.last_detections) - hit)
+            measured = max(1, len(frames) - warmup)
+            rows.append({
+                'clip': clip,
+                'engine': engine,
+                'fps': measured / (total_ms / 1000) if total_ms else 0.0,
+                'subtract_ms': subtract_ms / measured,
+                'recall': found / expected if expected else None,
+                'false_positives_per_frame': false_positives / measured,
+                'reference': 'ground truth' if has_truth else 'mog2',
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare background-model engines")
+    parser.add_argument('--clip', action='append', default=[],
+                        help="Frame source spec (default: synthetic clips with ground truth)")
+    parser.add_argument('--engine', action='append', choices=BACKGROUND_ENGINES)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--detect-scale', type=float)
+    args = parser.parse_args()
+
+    rows = compare_engines(args.clip or ['synthetic', 'synthetic:10'], args.engine or BACKGROUND_ENGINES,
+                           args.frames, detection_scale=args.detect_scale)
+    print(f"{'clip':<22} {'engine':<12} {'fps':>6} {'subtract':>9} {'recall':>7} {'FP/frame':>9}  reference")
+    for row in rows:
+        recall = f"{row['recall']:.2f}" if row['recall'] is not None else "-"
+        print(f"{row['clip']:<22} {row['engine']:<12} {row['fps']:>6.1f} {row['subtract_ms']:>7.2f}ms "
+              f"{recall:>7} {row['false_positives_per_frame']:>9.2f}  {row['reference']}")
+
+
+if __name__ == "__main__":
+    main()
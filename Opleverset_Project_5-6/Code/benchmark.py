@@ -0,0 +1,243 @@
+# Headless benchmark suite for the detection pipelines
+# Runs every pipeline (shit.py CPU/GPU, the MotionDetector of shit_optimized.py
+# and whatever is added to PIPELINES later) over the same recorded or synthetic
+# clips and reports frames/s, p50/p95/p99 latency, time per stage and peak
+# memory. Results are written as JSON; --compare flags regressions against an
+# earlier results file.
+#
+# Run with: python benchmark.py --clip synthetic --clip video:drone.mp4 --output bench.json
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from background import BACKGROUND_ENGINES
+from detection import create_detector
+from frame_sources import create_source
+from profiling import StageTimer
+
+DEFAULT_CLIPS = ['synthetic', 'synthetic:20']
+
+
+def _shit_pipeline(use_gpu):
+    """apply_filters_cpu / apply_filters_gpu from shit.py with its own subtractor"""
+    def factory():
+        # shit.py imports PyQt6 at module level (no window is created)
+        import shit
+        fgbg = cv2.createBackgroundSubtractorMOG2(history=80, varThreshold=100)
+        apply = shit.apply_filters_gpu if use_gpu else shit.apply_filters_cpu
+
+        def run(frame):
+            timer = StageTimer()
+            # shit.py draws into its input frame
+            frame = frame.copy()
+            timer.mark('copy')
+            apply(frame, fgbg, timer)
+            return timer.stages
+        return run
+    return factory
+
+
+def _optimized_pipeline(**detector_kwargs):
+    """MotionDetector.process (process_frame_optimized in camera_window.py)"""
+    def factory():
+        detector = create_detector(**detector_kwargs)
+
+        def run(frame):
+            detector.process(frame)
+            return detector.last_stats['stages']
+        return run
+    return factory
+
+
+# name -> factory returning run(frame) -> {stage: ms}; add future pipelines here
+PIPELINES = {
+    'shit_cpu': _shit_pipeline(use_gpu=False),
+    'shit_gpu': _shit_pipeline(use_gpu=True),
+    'optimized': _optimized_pipeline(),
+    'optimized_scale_0.5': _optimized_pipeline(detection_scale=0.5),
+    'optimized_scale_0.25': _optimized_pipeline(detection_scale=0.25),
+    'optimized_track': _optimized_pipeline(track=True),
+}
+PIPELINES.update({f'optimized_bg_{engine}': _optimized_pipeline(background=engine)
+                  for engine in BACKGROUND_ENGINES if engine != 'mog2'})
+
+
+def _percentiles(values):
+    values = np.asarray(values)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def run_case(pipeline, clip, max_frames=200, warmup=20):
+    """Run one pipeline over one clip, returns a result dict (or one with 'error')"""
+    result = {'pipeline': pipeline, 'clip': clip}
+    try:
+        run = PIPELINES[pipeline]()
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        return result
+
+    source = create_source(clip, realtime=False)
+    if not source.open():
+        result['error'] = f"cannot open {clip}"
+        return result
+
+    tracemalloc.start()
+    latencies = []
+    stage_totals = {}
+    frame_index = 0
+    while len(latencies) < max_frames:
+        ret, frame = source.read()
+        if not ret:
+            break
+        frame_index += 1
+
+        # Only the pipeline itself is timed, not decoding or generating the frame
+        start = time.perf_counter()
+        stages = run(frame)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        # The background model needs some frames before the numbers mean anything
+        if frame_index <= warmup:
+            continue
+        latencies.append(elapsed)
+        for stage, ms in stages.items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    source.release()
+
+    if not latencies:
+        result['error'] = "no frames measured"
+        return result
+
+    n = len(latencies)
+    result.update({
+        'frames': n,
+        'resolution': [source.width, source.height],
+        'fps': n / (sum(latencies) / 1000),
+        'latency_ms': _percentiles(latencies),
+        'stages_ms': {stage: total / n for stage, total in stage_totals.items()},
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_traced_mb': peak_traced / 1e6,
+    })
+    return result
+
+
+def run_isolated(pipeline, clip, max_frames, warmup):
+    """run_case in a fresh process so peak memory belongs to this case only"""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_case, (pipeline, clip, max_frames, warmup))
+
+
+def environment():
+    """Versions and machine info stored next to the results"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print regressions against a baseline results file, returns their number"""
+    old = {(r['pipeline'], r['clip']): r for r in baseline['results'] if 'error' not in r}
+    regressions = 0
+    for r in results:
+        base = old.get((r['pipeline'], r['clip']))
+        if base is None or 'error' in r:
+            continue
+        checks = [
+            ('fps', r['fps'], base['fps'], r['fps'] < base['fps'] * (1 - tolerance)),
+            ('p95', r['latency_ms']['p95'], base['latency_ms']['p95'],
+             r['latency_ms']['p95'] > base['latency_ms']['p95'] * (1 + tolerance)),
+        ]
+        for name, new_value, old_value, worse in checks:
+            if worse:
+                regressions += 1
+                print(f"REGRESSION {r['pipeline']} on {r['clip']}: {name} {old_value:.2f} -> {new_value:.2f}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'pipeline':<22} {'clip':<16} {'fps':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'rss MB':>7}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['pipeline']:<22} {r['clip']:<16} skipped: {r['error']}")
+            continue
+        lat = r['latency_ms']
+        print(f"{r['pipeline']:<22} {r['clip']:<16} {r['fps']:7.1f} {lat['p50']:7.2f} "
+              f"{lat['p95']:7.2f} {lat['p99']:7.2f} {r['peak_rss_mb']:7.0f}")
+        stages = ", ".join(f"{stage}={ms:.2f}" for stage, ms in r['stages_ms'].items())
+        print(f"    stages (ms): {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the detection pipelines")
+    parser.add_argument('--clip', action='append', default=[],
+                        help="Frame source spec (video:FILE, images:DIR, synthetic[:N]), repeatable")
+    parser.add_argument('--pipeline', action='append', choices=sorted(PIPELINES),
+                        help="Pipeline to run (default: all)")
+    parser.add_argument('--frames', type=int, default=200, help="Measured frames per clip")
+    parser.add_argument('--warmup', type=int, default=20, help="Unmeasured frames at the start")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Allowed relative slowdown before a result counts as a regression")
+    parser.add_argument('--in-process', action='store_true',
+                        help="Do not isolate cases in their own process (peak memory is then cumulative)")
+    args = parser.parse_args()
+
+    clips = args.clip or DEFAULT_CLIPS
+    pipelines = args.pipeline or list(PIPELINES)
+    runner = run_case if args.in_process else run_isolated
+
+    results = []
+    for clip in clips:
+        for pipeline in pipelines:
+            print(f"Running {pipeline} on {clip}...")
+            results.append(runner(pipeline, clip, args.frames, args.warmup))
+
+    print_results(results)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
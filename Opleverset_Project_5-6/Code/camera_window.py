@@ -0,0 +1,586 @@
+# Qt GUI of shit_optimized.py: capture threads, the processing thread and the
+# window that shows the annotated frames and motion masks per camera.
+# Only imported when the window is started, so --benchmark and the headless
+# service never load PyQt6.
+
+import cv2
+
+import time
+import collections
+import json
+import math
+import threading
+import numpy as np
+from frame_sources import create_source, detect_camera_ids, open_with_timeout
+from detection import create_detector
+from frame_ring import FrameRing
+from metrics import PipelineMetrics
+from scheduler import LoadScheduler
+from workers import CameraWorkerPool, make_result_ring, process_latest
+from PyQt6.QtWidgets import (QMainWindow, QLabel, QVBoxLayout, QHBoxLayout, QGridLayout,
+                             QWidget, QPushButton, QSizePolicy)
+from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap
+
+class CameraThread(QThread):
+    """Dedicated thread for camera capture"""
+    ringReady = pyqtSignal(int, object)
+    frameReady = pyqtSignal(int, int)
+    
+    def __init__(self, source, camera_index, num_slots=3, open_timeout=5.0):
+        super().__init__()
+        # Accepts a FrameSource, a source spec string or a plain camera id
+        self.source = create_source(source)
+        self.camera_index = camera_index
+        self.num_slots = num_slots
+        # Every camera opens in its own thread, a hanging one is given up after this
+        self.open_timeout = open_timeout
+        self.ring = None
+        self.running = False
+        
+    def run(self):
+        if not open_with_timeout(self.source, self.open_timeout):
+            return
+        
+        # The first frame decides the slot size of the shared-memory ring
+        ret, frame = self.source.read()
+        if not ret:
+            print(f"No frames from {self.source.name}")
+            self.source.release()
+            return
+        self.ring = FrameRing(self.num_slots, [('frame', frame.shape, frame.dtype)],
+                              frame_format=self.source.frame_format)
+        self.ringReady.emit(self.camera_index, self.ring)
+        slot = self.ring.begin_write()
+        np.copyto(self.ring.frame(slot), frame)
+        self.frameReady.emit(self.camera_index, self.ring.end_write(slot, time.time()))
+        
+        self.running = True
+        while self.running:
+            # Capture straight into a free slot, only the sequence number is emitted
+            slot = self.ring.begin_write()
+            if self.source.read_into(self.ring.frame(slot)):
+                seq = self.ring.end_write(slot, time.time())
+                self.frameReady.emit(self.camera_index, seq)
+            else:
+                self.ring.abort_write(slot)
+                if not self.source.is_live:
+                    print(f"End of source {self.source.name}")
+                    break
+            # No fixed sleep: live sources block in read() until the sensor has the
+            # next frame, load is shed on the processing side by the LoadScheduler
+        self.source.release()
+            
+    def stop(self):
+        self.running = False
+
+class ProcessingThread(QThread):
+    """Dedicated thread for frame processing"""
+    processedFrameReady = pyqtSignal(int, int, int)
+    
+    def __init__(self, num_cameras=2, workers=None, max_age=None, detector_kwargs=None,
+                 target_latency_ms=100.0, recorder=None, display_fps=30):
+        super().__init__()
+        self.running = False
+        self.metrics = PipelineMetrics(num_cameras)
+        
+        # One detector (and background subtractor) per camera; with workers every
+        # worker owns the detector of its camera and none are needed here
+        self.detector_kwargs = detector_kwargs or {}
+        self.detectors = [] if workers else [create_detector(**self.detector_kwargs) for _ in range(num_cameras)]
+        self.fgbg_list = [detector.fgbg for detector in self.detectors]
+        
+        # Skip ratio and detection scale per camera from the measured load. The scale
+        # is left alone for worker processes and when the detectors pick it themselves.
+        scale_control = not workers and not self.detector_kwargs.get('latency_budget_ms')
+        self.scheduler = LoadScheduler(num_cameras, target_latency_ms,
+                                       detectors=self.detectors if scale_control else None,
+                                       parallel=bool(workers))
+        self.metrics.sections['scheduler'] = self.scheduler.snapshot
+        # Frames older than this are dropped as stale (default: twice the target latency)
+        self.max_age = max_age if max_age is not None else self.scheduler.max_age
+        
+        # Shared-memory rings: camera frames in, annotated frames and masks out
+        self.frame_rings = [None] * num_cameras
+        self.result_rings = [None] * num_cameras
+        self.last_seqs = [-1] * num_cameras
+        self.new_frame = threading.Event()
+        
+        # Optional ClipRecorder that keeps a pre-roll and saves clips around detections
+        self.recorder = recorder
+        if recorder:
+            self.metrics.sections['recorder'] = recorder.stats
+        
+        # Results are only converted to BGR and annotated when they can reach the
+        # display (about display_fps per camera) or the recorder; the others only
+        # get their mask and are never shown
+        self.annotate_interval = 0.0 if recorder else 0.75 / display_fps
+        self.last_annotated = [0.0] * num_cameras
+        
+        # Optional per-camera workers ('process' or 'thread') instead of this thread
+        self.pool = None
+        if workers:
+            self.pool = CameraWorkerPool(num_cameras, mode=workers, max_age=self.max_age,
+                                         detector_kwargs=self.detector_kwargs, metrics=self.metrics,
+                                         scheduler=self.scheduler, annotate_interval=self.annotate_interval)
+            self.pool.start()
+        
+    def add_camera(self, camera_index, frame_ring):
+        """Register the frame ring of a camera and create its result ring"""
+        self.frame_rings[camera_index] = frame_ring
+        self.result_rings[camera_index] = make_result_ring(frame_ring)
+        if self.pool:
+            self.pool.attach(camera_index, frame_ring, self.result_rings[camera_index])
+        
+    def add_frame(self, camera_index, seq):
+        """A new frame was published in the ring of camera_index"""
+        if self.pool:
+            if self.scheduler.should_process(camera_index, seq):
+                self.pool.notify(camera_index)
+        else:
+            self.new_frame.set()
+    
+    def queue_size(self):
+        """Number of notifications waiting to be processed"""
+        if self.pool:
+            return self.pool.queue_size_total()
+        return int(self.new_frame.is_set())
+    
+    def run(self):
+        self.running = True
+        if self.pool:
+            self.run_workers()
+            return
+        while self.running:
+            if not self.new_frame.wait(timeout=0.1):
+                continue
+            self.new_frame.clear()
+            
+            # Latest frame wins: older frames in the ring are simply skipped.
+            # Cameras with active detections go first, the scheduler sheds the rest.
+            for camera_index in self.scheduler.order():
+                frames = self.frame_rings[camera_index]
+                if frames is None:
+                    continue
+                if not self.scheduler.should_process(camera_index, frames.latest()[1]):
+                    continue
+                annotate = time.time() - self.last_annotated[camera_index] >= self.annotate_interval
+                status, slot, seq, timestamp, started, finished, detections = process_latest(
+                    self.detectors[camera_index], frames, self.result_rings[camera_index],
+                    self.last_seqs[camera_index], self.max_age, annotate)
+                if status == 'none':
+                    continue
+                last = self.last_seqs[camera_index]
+                if last >= 0:
+                    shed, superseded = self.scheduler.split_gap(camera_index, seq - last - 1)
+                    self.metrics.drop(camera_index, 'shed', shed)
+                    self.metrics.drop(camera_index, 'superseded', superseded)
+                self.last_seqs[camera_index] = seq
+                if status == 'ok':
+                    self.frame_processed(camera_index, slot, seq, timestamp, started, finished, detections,
+                                         annotate)
+                else:
+                    self.metrics.drop(camera_index, status)
+    
+    def run_workers(self):
+        """Forward in-order results of the per-camera workers"""
+        while self.running:
+            result = self.pool.get_result(timeout=0.1)
+            if result is None:
+                continue
+            self.frame_processed(*result)
+        self.pool.stop()
+    
+    def frame_processed(self, camera_index, slot, seq, timestamp, started, finished, detections=0,
+                        annotated=True):
+        """Record latency and queue depth of a processed frame and hand annotated ones to the GUI"""
+        frames_behind = self.frame_rings[camera_index].latest()[1] - seq
+        self.metrics.processed_frame(camera_index, timestamp, started, finished, frames_behind)
+        self.scheduler.record(camera_index, seq, timestamp, started, finished, detections)
+        if self.recorder:
+            self.recorder.push(camera_index, self.result_rings[camera_index].plane(slot, 'frame'),
+                               timestamp, detections)
+        if not annotated:
+            # Only the mask was written, the frame plane of the slot is an older result
+            self.metrics.drop(camera_index, 'not_displayed')
+            return
+        self.last_annotated[camera_index] = started
+        self.processedFrameReady.emit(camera_index, slot, seq)
+                
+    def process_frame_optimized(self, frame, camera_index, frame_format='bgr'):
+        """Optimized frame processing with multi-scale approach"""
+        return self.detectors[camera_index].process(frame, frame_format=frame_format)
+    
+    def stop(self):
+        self.running = False
+    
+    def close_rings(self):
+        for ring in self.result_rings:
+            if ring is not None:
+                ring.close()
+        self.result_rings = [None] * len(self.result_rings)
+
+class DisplayScaler(QThread):
+    """Scales the latest result of every camera to its label size off the GUI thread
+
+    Results that are replaced before the scaler gets to them are never scaled.
+    The GUI only wraps the scaled BGR arrays in a QImage, no colour conversion.
+    """
+    
+    def __init__(self, result_rings):
+        super().__init__()
+        self.result_rings = result_rings
+        self.lock = threading.Lock()
+        self.pending = {}    # camera -> (slot, seq), latest wins
+        self.sizes = {}      # camera -> ((w, h) of the frame label, (w, h) of the mask label)
+        self.scaled = {}     # camera -> (seq, timestamp, frame, mask) ready to show
+        self.new_result = threading.Event()
+        self.running = False
+        
+    def set_label_sizes(self, camera_index, frame_size, mask_size):
+        """Update the target sizes, returns True if they changed"""
+        with self.lock:
+            changed = self.sizes.get(camera_index) != (frame_size, mask_size)
+            self.sizes[camera_index] = (frame_size, mask_size)
+        return changed
+        
+    def submit(self, camera_index, slot, seq):
+        with self.lock:
+            self.pending[camera_index] = (slot, seq)
+        self.new_result.set()
+        
+    def take(self, camera_index, shown_seq):
+        """Scaled (seq, timestamp, frame, mask) newer than shown_seq, or None"""
+        with self.lock:
+            item = self.scaled.get(camera_index)
+        if item is None or item[0] <= shown_seq:
+            return None
+        return item
+        
+    @staticmethod
+    def fit(image, size):
+        """Resize image to fit in size (w, h) keeping its aspect ratio"""
+        h, w = image.shape[:2]
+        scale = min(size[0] / w, size[1] / h)
+        if scale <= 0:
+            return None
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                          interpolation=interpolation)
+        
+    def run(self):
+        self.running = True
+        while self.running:
+            if not self.new_result.wait(timeout=0.1):
+                continue
+            self.new_result.clear()
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                sizes = dict(self.sizes)
+            
+            for camera_index, (slot, seq) in pending.items():
+                ring = self.result_rings[camera_index]
+                if ring is None or camera_index not in sizes:
+                    continue
+                frame_size, mask_size = sizes[camera_index]
+                ring.pin(slot)
+                try:
+                    if not ring.valid(slot, seq):
+                        continue
+                    frame = self.fit(ring.plane(slot, 'frame'), frame_size)
+                    mask = self.fit(ring.plane(slot, 'mask'), mask_size)
+                    timestamp = ring.timestamp(slot)
+                    valid = ring.valid(slot, seq)
+                finally:
+                    ring.unpin()
+                if valid and frame is not None and mask is not None:
+                    with self.lock:
+                        self.scaled[camera_index] = (seq, timestamp, frame, mask)
+                        
+    def stop(self):
+        self.running = False
+
+def detect_cameras(refresh=False):
+    """Detect available cameras (cached between runs, see frame_sources.detect_camera_ids)"""
+    return detect_camera_ids(refresh=refresh)
+
+class OptimizedCameraWindow(QMainWindow):
+    def __init__(self, sources=None, workers=None, detector_kwargs=None,
+                 metrics_file=None, metrics_port=None, target_latency_ms=100.0, display_fps=30,
+                 recorder=None, max_cameras=None, open_timeout=5.0, rescan_cameras=False, source_kwargs=None):
+        super().__init__()
+        self.setWindowTitle("High-Performance Camera Feeds - Multi-threaded")
+        self.setGeometry(100, 100, 1400, 900)
+        
+        # Frame source specs, None = detect live cameras. The number of cameras,
+        # the per-camera state and the grid all follow from this list.
+        self.cam_ids = sources if sources else detect_cameras(refresh=rescan_cameras)
+        self.open_timeout = open_timeout
+        # Capture format options for the sources built from specs (see create_source)
+        self.source_kwargs = source_kwargs or {}
+        if max_cameras:
+            self.cam_ids = self.cam_ids[:max_cameras]
+        print(f"Detected cameras: {self.cam_ids}")
+        self.num_cameras = max(1, len(self.cam_ids))
+        
+        # Initialize threads
+        self.camera_threads = []
+        self.processing_thread = ProcessingThread(num_cameras=self.num_cameras, workers=workers, detector_kwargs=detector_kwargs,
+                                                  target_latency_ms=target_latency_ms,
+                                                  recorder=recorder, display_fps=display_fps)
+        self.recorder = recorder
+        if recorder:
+            recorder.start()
+        
+        # Optional metrics export (periodic JSON file and/or local HTTP endpoint)
+        self.metrics_exporter = None
+        if metrics_file or metrics_port:
+            from metrics import MetricsExporter
+            self.metrics_exporter = MetricsExporter(self.processing_thread.metrics,
+                                                    path=metrics_file, port=metrics_port)
+            self.metrics_exporter.start()
+        
+        # Latest (result slot, seq) per camera, the pixels stay in the result rings
+        self.latest_frames = {}
+        # Sequence numbers of results not on screen yet, per camera
+        self.unshown = collections.defaultdict(collections.deque)
+        # Sequence number on screen per camera, labels are only redrawn when it changes
+        self.shown_seqs = {}
+        self.display_scaler = DisplayScaler(self.processing_thread.result_rings)
+        
+        # Performance monitoring
+        self.frame_counts = [0] * self.num_cameras
+        self.fps_values = [0.0] * self.num_cameras
+        self.last_fps_time = time.time()
+        
+        # Setup UI
+        self.setup_ui()
+        
+        # Setup cameras and threads
+        self.setup_cameras()
+        
+        # Setup display timer, the redraw rate is independent of the capture rate
+        self.display_timer = QTimer()
+        self.display_timer.timeout.connect(self.update_display)
+        self.display_timer.start(int(1000 / display_fps))
+        
+    def setup_ui(self):
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        
+        # Main layout
+        main_layout = QVBoxLayout()
+        central_widget.setLayout(main_layout)
+        
+        # Performance info
+        perf_layout = QHBoxLayout()
+        self.perf_label = QLabel("Performance: Initializing...")
+        self.perf_label.setStyleSheet("font-weight: bold; color: blue;")
+        perf_layout.addWidget(self.perf_label)
+        main_layout.addLayout(perf_layout)
+        
+        # Camera feeds: one cell (processed frame above its mask) per camera in a grid
+        camera_layout = QGridLayout()
+        columns = math.ceil(math.sqrt(self.num_cameras))
+        # Smaller minimum sizes when many cameras share the window
+        min_size = (600, 400) if self.num_cameras <= 2 else (320, 200)
+        self.title_labels = []
+        self.frame_labels = []
+        self.mask_labels = []
+        for i in range(self.num_cameras):
+            cam_layout = QVBoxLayout()
+            title_label = QLabel(f"Camera {i + 1} - Processed")
+            cam_layout.addWidget(title_label)
+            frame_label = self.make_view_label(f"Camera {i + 1}", "blue", min_size)
+            cam_layout.addWidget(frame_label)
+            
+            cam_layout.addWidget(QLabel(f"Camera {i + 1} - Motion Mask"))
+            mask_label = self.make_view_label(f"Mask {i + 1}", "red", min_size)
+            cam_layout.addWidget(mask_label)
+            
+            camera_layout.addLayout(cam_layout, i // columns, i % columns)
+            self.title_labels.append(title_label)
+            self.frame_labels.append(frame_label)
+            self.mask_labels.append(mask_label)
+        main_layout.addLayout(camera_layout)
+        
+        # Control buttons
+        control_layout = QHBoxLayout()
+        
+        self.stats_button = QPushButton("Show Detailed Stats")
+        self.stats_button.clicked.connect(self.show_stats)
+        control_layout.addWidget(self.stats_button)
+        
+        self.quit_button = QPushButton("Quit")
+        self.quit_button.clicked.connect(self.close)
+        control_layout.addWidget(self.quit_button)
+        
+        main_layout.addLayout(control_layout)
+        
+    @staticmethod
+    def make_view_label(text, border, min_size):
+        """Label that shows a camera image, scaled by the DisplayScaler"""
+        label = QLabel(text)
+        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        label.setMinimumSize(*min_size)
+        label.setSizePolicy(QSizePolicy.Policy.Ignored, QSizePolicy.Policy.Ignored)
+        label.setStyleSheet(f"border: 2px solid {border}")
+        return label
+        
+    def setup_cameras(self):
+        """Setup camera threads"""
+        # Start camera threads
+        for i, cam_id in enumerate(self.cam_ids):
+            camera_thread = CameraThread(create_source(cam_id, **self.source_kwargs), i,
+                                         open_timeout=self.open_timeout)
+            camera_thread.ringReady.connect(self.processing_thread.add_camera)
+            camera_thread.frameReady.connect(self.on_frame_ready)
+            camera_thread.start()
+            self.camera_threads.append(camera_thread)
+            
+        # Start processing thread
+        self.processing_thread.processedFrameReady.connect(self.on_processed_frame_ready)
+        self.processing_thread.start()
+        self.display_scaler.start()
+        
+    def on_frame_ready(self, camera_index, seq):
+        """Handle new frame from camera thread"""
+        self.processing_thread.add_frame(camera_index, seq)
+        
+        # Update FPS counter
+        self.frame_counts[camera_index] += 1
+        
+    def on_processed_frame_ready(self, camera_index, slot, seq):
+        """Handle processed frame from processing thread"""
+        self.latest_frames[camera_index] = (slot, seq)
+        self.unshown[camera_index].append(seq)
+        self.display_scaler.submit(camera_index, slot, seq)
+        
+    def update_display(self):
+        """Update the display with latest frames"""
+        current_time = time.time()
+        
+        # Update FPS calculations and the performance label once per second
+        if current_time - self.last_fps_time >= 1.0:
+            for i in range(self.num_cameras):
+                self.fps_values[i] = self.frame_counts[i] / (current_time - self.last_fps_time)
+                self.frame_counts[i] = 0
+                self.title_labels[i].setText(f"Camera {i + 1} - Processed ({self.fps_values[i]:.1f} FPS)")
+            self.last_fps_time = current_time
+            self.update_perf_label()
+        
+        # Redraw only the cameras with a new result
+        for i in range(self.num_cameras):
+            self.display_camera(i, self.frame_labels[i], self.mask_labels[i])
+    
+    def update_perf_label(self):
+        avg_fps = sum(self.fps_values) / len(self.fps_values) if self.fps_values else 0
+        queue_size = self.processing_thread.queue_size()
+        self.perf_label.setText(
+            f"FPS: {self.num_cameras} cameras, total={sum(self.fps_values):.1f}, "
+            f"Avg={avg_fps:.1f} | Queue: {queue_size} | Mode: {self.mode_name()}\n"
+            f"{self.processing_thread.metrics.summary_line()}\n"
+            f"{self.processing_thread.scheduler.summary_line()}"
+            + (f"\n{self.recorder.summary_line()}" if self.recorder else "")
+        )
+    
+    def display_camera(self, camera_index, frame_label, mask_label):
+        """Show the latest scaled result of a camera if it is newer than what is on screen"""
+        if camera_index not in self.latest_frames:
+            return
+        frame_size = frame_label.contentsRect().size()
+        mask_size = mask_label.contentsRect().size()
+        if self.display_scaler.set_label_sizes(camera_index, (frame_size.width(), frame_size.height()),
+                                               (mask_size.width(), mask_size.height())):
+            # Label resized: scale the current result again
+            self.display_scaler.submit(camera_index, *self.latest_frames[camera_index])
+            self.shown_seqs[camera_index] = -1
+        
+        item = self.display_scaler.take(camera_index, self.shown_seqs.get(camera_index, -1))
+        if item is None:
+            return
+        seq, timestamp, frame, mask = item
+        self.display_frame(frame, frame_label)
+        self.display_mask(mask, mask_label)
+        self.shown_seqs[camera_index] = seq
+        # Results that came before this one were replaced without ever being shown
+        unshown = self.unshown[camera_index]
+        skipped = 0
+        while unshown and unshown[0] < seq:
+            unshown.popleft()
+            skipped += 1
+        if unshown and unshown[0] == seq:
+            unshown.popleft()
+            self.processing_thread.metrics.displayed_frame(camera_index, timestamp)
+        self.processing_thread.metrics.drop(camera_index, 'not_displayed', skipped)
+    
+    def mode_name(self):
+        if self.processing_thread.pool:
+            return f"Per-camera workers ({self.processing_thread.pool.mode})"
+        return "Multi-threaded CPU Optimized"
+    
+    def display_frame(self, frame, label):
+        """Display an already scaled BGR frame in label"""
+        h, w, ch = frame.shape
+        bytes_per_line = ch * w
+        q_image = QImage(frame.data, w, h, bytes_per_line, QImage.Format.Format_BGR888)
+        label.setPixmap(QPixmap.fromImage(q_image))
+    
+    def display_mask(self, mask, label):
+        """Display an already scaled mask in label"""
+        h, w = mask.shape
+        bytes_per_line = w
+        q_image = QImage(mask.data, w, h, bytes_per_line, QImage.Format.Format_Grayscale8)
+        label.setPixmap(QPixmap.fromImage(q_image))
+    
+    def show_stats(self):
+        """Show detailed performance statistics"""
+        camera_fps = "\n".join(f"Camera {i + 1} FPS: {fps:.2f}" for i, fps in enumerate(self.fps_values))
+        stats = f"""
+Performance Statistics:
+======================
+{camera_fps}
+Average FPS: {sum(self.fps_values)/len(self.fps_values):.2f}
+Processing Queue Size: {self.processing_thread.queue_size()}
+Active Threads: {threading.active_count()}
+Latency and drops: {json.dumps(self.processing_thread.metrics.snapshot()['cameras'], indent=2)}
+Scheduler decisions: {json.dumps(self.processing_thread.scheduler.snapshot(), indent=2)}
+
+Optimizations Applied:
+- Multi-threaded camera capture
+- Dedicated processing thread
+- Frame scaling for faster processing
+- Optimized morphological operations
+- Shared-memory ring buffers (latest frame wins)
+- Load scheduler (per-camera skip ratio and detection scale)
+- Reduced buffer sizes for low latency
+"""
+        print(stats)
+        
+    def closeEvent(self, event):
+        """Clean up when closing"""
+        print("Shutting down threads...")
+        
+        # Stop processing and display threads
+        self.processing_thread.stop()
+        self.processing_thread.wait()
+        self.display_scaler.stop()
+        self.display_scaler.wait()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        if self.recorder:
+            self.recorder.stop()
+        
+        # Stop camera threads
+        for thread in self.camera_threads:
+            thread.stop()
+            thread.wait()
+        
+        # Release the shared-memory rings once nothing reads them anymore
+        self.processing_thread.close_rings()
+        for thread in self.camera_threads:
+            if thread.ring is not None:
+                thread.ring.close()
+            
+        cv2.destroyAllWindows()
+        event.accept()
@@ -0,0 +1,352 @@
+# Capture formats, JPEG decoding and Y-plane access
+# Detection only looks at brightness, yet every camera frame used to arrive as
+# 3-channel BGR: OpenCV decodes MJPG or converts YUYV inside cap.read, the
+# frame rings move 3 bytes per pixel and MOG2 models three channels. Here:
+#   - format negotiation: the camera is asked for MJPG, YUYV or NV12 (first
+#     one the driver accepts) and delivers the raw buffer (CAP_PROP_CONVERT_RGB
+#     off), so no conversion happens inside cap.read
+#   - MJPG frames are decoded by a shared JpegDecodePool, optionally straight
+#     to grayscale (libjpeg then skips the chroma upsampling and the colour
+#     conversion)
+#   - YUYV and NV12 frames stay in their own layout in the frame ring, the
+#     detector takes the Y plane (a view for NV12); BGR is only built for the
+#     annotated frames that are shown or recorded
+#
+# Frame formats (the layout of a frame in a FrameRing slot):
+#   bgr   (h, w, 3)          what OpenCV delivers by default
+#   gray  (h, w)             Y plane or grayscale-decoded JPEG
+#   yuyv  (h, w, 2)          packed 4:2:2, Y at every even byte
+#   nv12  (h * 3 / 2, w)     Y plane followed by interleaved UV at half resolution
+#   i420  (h * 3 / 2, w)     Y plane followed by the U and V planes (picamera2 YUV420)
+#
+# Benchmark: python capture_formats.py --benchmark
+#            python capture_formats.py --benchmark --mjpeg cam.mjpg --yuyv cam.yuv --size 1280x720
+
+import argparse
+import mmap
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FRAME_FORMATS = ('bgr', 'gray', 'yuyv', 'nv12', 'i420')
+CAPTURE_FORMATS = ('bgr', 'mjpg', 'yuyv', 'nv12')
+# Order tried for --capture-format auto: least USB bandwidth first
+CAPTURE_PREFERENCE = ('mjpg', 'nv12', 'yuyv')
+FOURCCS = {'mjpg': 'MJPG', 'yuyv': 'YUYV', 'nv12': 'NV12'}
+
+_TO_BGR = {
+    'gray': cv2.COLOR_GRAY2BGR,
+    'yuyv': cv2.COLOR_YUV2BGR_YUYV,
+    'nv12': cv2.COLOR_YUV2BGR_NV12,
+    'i420': cv2.COLOR_YUV2BGR_I420,
+}
+
+
+def parse_capture_formats(spec):
+    """Tuple of capture formats to try from 'auto', 'mjpg' or a list like 'mjpg,yuyv'"""
+    if spec in (None, '', 'bgr'):
+        return ('bgr',)
+    if spec == 'auto':
+        return CAPTURE_PREFERENCE + ('bgr',)
+    formats = tuple(name.strip().lower() for name in spec.split(','))
+    for name in formats:
+        if name not in CAPTURE_FORMATS:
+            raise ValueError(f"Unknown capture format: {name}")
+    return formats
+
+
+def fourcc_name(value):
+    """Four-character code of a CAP_PROP_FOURCC value"""
+    value = int(value)
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+
+def negotiate_format(cap, formats):
+    """Set the first of formats the driver accepts, returns its name
+
+    'bgr' (or nothing accepted) leaves the driver default with OpenCV's own
+    conversion to BGR. For the others cap.read returns the raw buffer.
+    """
+    for name in formats:
+        if name == 'bgr':
+            break
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*FOURCCS[name]))
+        if fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)) == FOURCCS[name]:
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            return name
+    return 'bgr'
+
+
+def frame_shape(fmt, width, height):
+    """Slot shape of a width x height frame in format fmt"""
+    if fmt == 'bgr':
+        return (height, width, 3)
+    if fmt == 'gray':
+        return (height, width)
+    if fmt == 'yuyv':
+        return (height, width, 2)
+    if fmt in ('nv12', 'i420'):
+        return (height * 3 // 2, width)
+    raise ValueError(f"Unknown frame format: {fmt}")
+
+
+def frame_size(frame, fmt):
+    """(width, height) of the image held by frame"""
+    if fmt in ('nv12', 'i420'):
+        return frame.shape[1], frame.shape[0] * 2 // 3
+    return frame.shape[1], frame.shape[0]
+
+
+def luma(frame, fmt, out=None):
+    """Y plane (grayscale) of a frame; a view without copying for gray, nv12 and i420"""
+    if fmt == 'gray':
+        return frame
+    if fmt in ('nv12', 'i420'):
+        return frame[:frame.shape[0] * 2 // 3]
+    if fmt == 'yuyv':
+        return cv2.cvtColor(frame, cv2.COLOR_YUV2GRAY_YUYV, dst=out)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+
+
+def to_bgr(frame, fmt, out=None):
+    """BGR image of a frame (frame itself, or copied into out, when it already is BGR)"""
+    if fmt == 'bgr':
+        if out is None:
+            return frame
+        np.copyto(out, frame)
+        return out
+    return cv2.cvtColor(frame, _TO_BGR[fmt], dst=out)
+
+
+def raw_frame(buffer, fmt, width, height):
+    """Reshape a raw capture buffer (cap.read with CONVERT_RGB off) to its slot shape, None if it does not fit"""
+    shape = frame_shape(fmt, width, height)
+    if buffer is None or buffer.size < int(np.prod(shape)):
+        return None
+    return buffer.reshape(-1)[:int(np.prod(shape))].reshape(shape)
+
+
+class JpegDecodePool:
+    """Thread pool that decodes JPEG buffers, shared by all MJPG sources
+
+    cv2.imdecode releases the GIL, so the decodes of several cameras run in
+    parallel, never more than workers at a time. gray decodes to grayscale.
+    """
+
+    def __init__(self, workers=None, gray=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.gray = gray
+        self.flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+        self.frame_format = 'gray' if gray else 'bgr'
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='jpeg')
+
+    def submit(self, data):
+        """Future of the decoded frame (None for a corrupt buffer)"""
+        return self.executor.submit(cv2.imdecode, data, self.flags)
+
+    def decode(self, data):
+        return self.submit(data).result()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def jpeg_offsets(data):
+    """(start, end) of every JPEG in a concatenated MJPEG stream"""
+    offsets = []
+    start = data.find(b'\xff\xd8')
+    while start >= 0:
+        end = data.find(b'\xff\xd9', start + 2)
+        if end < 0:
+            break
+        offsets.append((start, end + 2))
+        start = data.find(b'\xff\xd8', end + 2)
+    return offsets
+
+
+def write_test_clips(directory, num_frames=120, width=1280, height=720, quality=80):
+    """MJPEG, YUYV and NV12 files of a synthetic clip, returns {format: path}
+
+    The MJPEG file is a plain concatenation of JPEGs, like a UVC camera
+    delivers them (and like ffmpeg -f mjpeg writes).
+    """
+    from frame_sources import SyntheticSource
+
+    source = SyntheticSource(width, height, realtime=False)
+    source.open()
+    paths = {name: os.path.join(directory, f'capture_test.{name}') for name in ('mjpeg', 'yuyv', 'nv12')}
+    files = {name: open(path, 'wb') for name, path in paths.items()}
+    nv12 = np.empty(frame_shape('nv12', width, height), np.uint8)
+    try:
+        for _ in range(num_frames):
+            _, frame = source.read()
+            files['mjpeg'].write(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+            files['yuyv'].write(cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_YUYV).tobytes())
+            # OpenCV writes I420 only: interleave its U and V planes into NV12
+            i420 = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+            quarter = width * height // 4
+            nv12[:height] = i420[:height]
+            uv = nv12[height:].reshape(-1)
+            uv[0::2] = i420[height:].reshape(-1)[:quarter]
+            uv[1::2] = i420[height:].reshape(-1)[quarter:]
+            files['nv12'].write(nv12.tobytes())
+    finally:
+        for f in files.values():
+            f.close()
+    return paths
+
+
+def measure(source, max_frames, detector_kwargs=None, display_interval=3):
+    """Capture and detect the frames of an opened source like the capture thread and worker do
+
+    Returns per-frame wall time of capture (read + decode / conversion) and
+    detection, process CPU time per frame (all threads, including the decode
+    pool) and the BGR conversion cost for every display_interval-th frame
+    (what is shown at a 10Hz display from a 30 fps camera).
+    """
+    from detection import create_detector
+
+    ret, frame = source.read()
+    if not ret:
+        return None
+    fmt = source.frame_format
+    slot = np.empty_like(frame)
+    width, height = frame_size(frame, fmt)
+    bgr = np.empty((height, width, 3), np.uint8)
+    mask = np.empty((height, width), np.uint8)
+    detector = create_detector(**(detector_kwargs or {}))
+    capture_ms = detect_ms = display_ms = 0.0
+    frames = 0
+    cpu_start = time.process_time()
+    while frames < max_frames:
+        start = time.perf_counter()
+        if not source.read_into(slot):
+            break
+        captured = time.perf_counter()
+        detector.process(slot, out_mask=mask, frame_format=fmt, annotate=False)
+        detected = time.perf_counter()
+        if frames % display_interval == 0:
+            to_bgr(slot, fmt, bgr)
+        capture_ms += (captured - start) * 1000
+        detect_ms += (detected - captured) * 1000
+        display_ms += (time.perf_counter() - detected) * 1000
+        frames += 1
+    cpu_ms = (time.process_time() - cpu_start) * 1000
+    frames = max(1, frames)
+    return {
+        'frame_format': fmt,
+        'capture_ms': capture_ms / frames,
+        'detect_ms': detect_ms / frames,
+        'display_ms': display_ms / frames,
+        'cpu_ms': cpu_ms / frames,
+        'ring_bytes': slot.nbytes,
+    }
+
+
+class _BgrFromRaw:
+    """Raw YUV file converted to BGR on capture, as cap.read does with CONVERT_RGB on (benchmark baseline)"""
+
+    def __init__(self, path, fmt, width, height):
+        from frame_sources import RawYuvSource
+        self.raw = RawYuvSource(path, fmt, width, height, realtime=False, loop=True)
+        self.fmt = fmt
+        self.frame_format = 'bgr'
+
+    def open(self):
+        if not self.raw.open():
+            return False
+        self.buffer = np.empty(frame_shape(self.fmt, self.raw.width, self.raw.height), np.uint8)
+        return True
+
+    def read(self):
+        if not self.raw.read_into(self.buffer):
+            return False, None
+        return True, to_bgr(self.buffer, self.fmt)
+
+    def read_into(self, out):
+        if not self.raw.read_into(self.buffer):
+            return False
+        to_bgr(self.buffer, self.fmt, out)
+        return True
+
+    def release(self):
+        self.raw.release()
+
+
+def run_benchmark(paths, width, height, max_frames=100, fps=30, decode_threads=None, detector_kwargs=None):
+    """CPU and bandwidth per camera for every way of getting the frames to the detector"""
+    from frame_sources import MjpegFileSource, RawYuvSource
+
+    cases = []
+    if paths.get('mjpeg'):
+        pool = JpegDecodePool(decode_threads, gray=True)
+        size = os.path.getsize(paths['mjpeg'])
+        with open(paths['mjpeg'], 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            wire = size / max(1, len(jpeg_offsets(data)))
+        cases += [
+            ('mjpg -> bgr', lambda: MjpegFileSource(paths['mjpeg'], realtime=False, loop=True), wire),
+            ('mjpg -> gray', lambda: MjpegFileSource(paths['mjpeg'], realtime=False, loop=True, gray=True), wire),
+            (f'mjpg -> gray, pool x{pool.workers}',
+             lambda: MjpegFileSource(paths['mjpeg'], realtime=False, loop=True, decoder=pool), wire),
+        ]
+    for fmt in ('yuyv', 'nv12'):
+        if paths.get(fmt):
+            wire = int(np.prod(frame_shape(fmt, width, height)))
+            cases += [
+                (f'{fmt} -> bgr', lambda fmt=fmt: _BgrFromRaw(paths[fmt], fmt, width, height), wire),
+                (f'{fmt} Y plane', lambda fmt=fmt: RawYuvSource(paths[fmt], fmt, width, height,
+                                                                realtime=False, loop=True), wire),
+                (f'{fmt} -> gray', lambda fmt=fmt: RawYuvSource(paths[fmt], fmt, width, height,
+                                                                realtime=False, loop=True, gray=True), wire),
+            ]
+
+    print(f"{width}x{height}, {max_frames} frames per case, bandwidth per camera at {fps} fps")
+    print(f"{'case':<22} {'format':<6} {'capture':>8} {'detect':>8} {'to bgr':>7} {'CPU/frame':>9} "
+          f"{'camera MB/s':>11} {'ring MB/s':>9}")
+    rows = []
+    for name, make_source, wire in cases:
+        source = make_source()
+        if not source.open():
+            continue
+        result = measure(source, max_frames, detector_kwargs)
+        source.release()
+        if result is None:
+            continue
+        result.update({'case': name, 'camera_mb_s': wire * fps / 1e6, 'ring_mb_s': result['ring_bytes'] * fps / 1e6})
+        rows.append(result)
+        print(f"{name:<22} {result['frame_format']:<6} {result['capture_ms']:>6.2f}ms {result['detect_ms']:>6.2f}ms "
+              f"{result['display_ms']:>5.2f}ms {result['cpu_ms']:>7.2f}ms {result['camera_mb_s']:>11.1f} "
+              f"{result['ring_mb_s']:>9.1f}")
+    print("capture: read + decode/conversion; to bgr: display frames only (every 3rd); "
+          "CPU/frame includes the decode pool threads")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture-format decode/conversion cost and bandwidth per camera")
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--mjpeg', help="Concatenated-JPEG file (default: written from a synthetic clip)")
+    parser.add_argument('--yuyv', help="Raw YUYV file")
+    parser.add_argument('--nv12', help="Raw NV12 file")
+    parser.add_argument('--size', default='1280x720', help="Frame size of the raw files, WxH")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--fps', type=float, default=30, help="Camera frame rate for the bandwidth columns")
+    parser.add_argument('--decode-threads', type=int, help="JPEG decode pool size (default: CPU count)")
+    parser.add_argument('--detect-scale', type=float)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    paths = {'mjpeg': args.mjpeg, 'yuyv': args.yuyv, 'nv12': args.nv12}
+    if not any(paths.values()):
+        paths = write_test_clips(tempfile.gettempdir(), args.frames, width, height)
+        print("Test clips from a synthetic scene in " + tempfile.gettempdir())
+    run_benchmark(paths, width, height, args.frames, args.fps, args.decode_threads,
+                  {'detection_scale': args.detect_scale})
+
+
+if __name__ == "__main__":
+    main()
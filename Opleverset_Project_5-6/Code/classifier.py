@@ -0,0 +1,272 @@
+# Batched ROI classification of motion candidates (drone or clutter)
+# Optional CPU stage between detection and everything downstream: the
+# candidates of all cameras processed in one tick are cropped (with some
+# context around the box), resized to the network input and classified with
+# a single cv2.dnn forward call on one batch tensor (cv2.dnn.blobFromImages).
+# Birds, leaves and cloud edges that the network rejects are dropped before
+# they reach the output stream and the recorder.
+#
+# The batch follows the load: the measured cost per ROI sets how many ROIs fit
+# in the budget of a tick; candidates beyond that pass unclassified (a missed
+# drone costs more than a bird in the output).
+#
+# Any model cv2.dnn.readNet loads works (ONNX, Darknet, Caffe, TensorFlow) if
+# it ends in a softmax over classes; target_class is the index of 'drone'.
+# Benchmark: python classifier.py                        (random-weight test model)
+#            python classifier.py --model drone_cls.onnx
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from capture_formats import luma
+
+# Small fully convolutional test network: three conv/pool blocks and a global
+# average-pooled 2-class head, (in, out, kernel) per convolution
+TEST_MODEL_LAYERS = ((3, 16, 3), (16, 32, 3), (32, 64, 3), (64, 2, 1))
+
+
+def make_test_model(directory, input_size=64, seed=0):
+    """Write a Darknet cfg and random weights of the test network, returns (weights, cfg)
+
+    Only meant for throughput measurements, its answers are meaningless.
+    """
+    sections = [f"[net]\nbatch=1\nwidth={input_size}\nheight={input_size}\nchannels=3\n"]
+    for i, (_, filters, size) in enumerate(TEST_MODEL_LAYERS):
+        last = i == len(TEST_MODEL_LAYERS) - 1
+        sections.append(f"[convolutional]\nfilters={filters}\nsize={size}\nstride=1\n"
+                        f"pad={0 if last else 1}\nactivation={'linear' if last else 'leaky'}\n")
+        if not last:
+            sections.append("[maxpool]\nsize=2\nstride=2\n")
+    sections.append("[avgpool]\n")
+    sections.append("[softmax]\n")
+
+    rng = np.random.default_rng(seed)
+    # Header (major, minor, revision, images seen), then biases and weights per convolution
+    parts = [np.array([0, 2, 0], np.int32).tobytes(), np.array([0], np.int64).tobytes()]
+    for inputs, filters, size in TEST_MODEL_LAYERS:
+        parts.append(rng.normal(0, 0.1, filters).astype(np.float32).tobytes())
+        parts.append(rng.normal(0, np.sqrt(2.0 / (inputs * size * size)),
+                                filters * inputs * size * size).astype(np.float32).tobytes())
+
+    cfg = os.path.join(directory, 'roi_classifier_test.cfg')
+    weights = os.path.join(directory, 'roi_classifier_test.weights')
+    os.makedirs(directory, exist_ok=True)
+    with open(cfg, 'w') as f:
+        f.write("\n".join(sections))
+    with open(weights, 'wb') as f:
+        f.write(b"".join(parts))
+    return weights, cfg
+
+
+class RoiClassifier:
+    """cv2.dnn classifier for candidate boxes
+
+    padding: context added around a box on every side, as a fraction of its
+    larger side; crops are square so the aspect ratio survives the resize.
+    """
+
+    def __init__(self, model, config=None, input_size=64, target_class=1, threshold=0.5,
+                 scale=1 / 255.0, mean=(0, 0, 0), swap_rb=True, padding=0.25):
+        self.net = cv2.dnn.readNet(model, config or '')
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_size = input_size
+        self.target_class = target_class
+        self.threshold = threshold
+        self.scale = scale
+        self.mean = mean
+        self.swap_rb = swap_rb
+        self.padding = padding
+
+    def crop(self, frame, det):
+        """Square input-sized BGR crop around a detection (a new array)
+
+        Grayscale frames (the Y plane) are cropped as they are and only the
+        crop is expanded to three channels.
+        """
+        height, width = frame.shape[:2]
+        side = max(int(det['w']), int(det['h']))
+        side = int(side * (1 + 2 * self.padding))
+        cx, cy = int(det['x']) + int(det['w']) // 2, int(det['y']) + int(det['h']) // 2
+        x0, y0 = max(0, cx - side // 2), max(0, cy - side // 2)
+        x1, y1 = min(width, cx + side // 2 + 1), min(height, cy + side // 2 + 1)
+        crop = cv2.resize(frame[y0:y1, x0:x1], (self.input_size, self.input_size),
+                          interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR) if crop.ndim == 2 else crop
+
+    def _scores(self, output, count):
+        return output.reshape(count, -1)[:, self.target_class]
+
+    def scores(self, crops):
+        """Target-class probability of every crop, one forward call"""
+        if not len(crops):
+            return np.empty(0, np.float32)
+        blob = cv2.dnn.blobFromImages(crops, self.scale, (self.input_size, self.input_size),
+                                      self.mean, self.swap_rb, crop=False)
+        self.net.setInput(blob)
+        return self._scores(self.net.forward(), len(crops))
+
+    def scores_one_by_one(self, crops):
+        """Same result with one blob and one forward call per crop (for comparison)"""
+        scores = np.empty(len(crops), np.float32)
+        for i, crop in enumerate(crops):
+            blob = cv2.dnn.blobFromImage(crop, self.scale, (self.input_size, self.input_size),
+                                         self.mean, self.swap_rb, crop=False)
+            self.net.setInput(blob)
+            scores[i] = self._scores(self.net.forward(), 1)[0]
+        return scores
+
+
+class ClassifierStage:
+    """Collects the candidates of all cameras during a tick, classifies them in one batch
+
+    budget_ms: classification time per tick the batch size is chosen for,
+    between min_batch and max_batch ROIs.
+    """
+
+    def __init__(self, classifier, budget_ms=10.0, min_batch=4, max_batch=32):
+        self.classifier = classifier
+        self.budget_ms = budget_ms
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.batch_limit = max_batch
+        self.ms_per_roi = None
+        self.pending = {}  # camera -> list of crops, in detection order
+        self.counters = {'ticks': 0, 'rois': 0, 'classified': 0, 'rejected': 0, 'unclassified': 0}
+        self.last_ms = 0.0
+        self.last_batch = 0
+
+    def add(self, camera_index, frame, detections, frame_format='bgr'):
+        """Crop the candidates of one camera (copies, the frame may be reused afterwards)
+
+        Frames that are not BGR are cropped from their Y plane.
+        """
+        if frame_format != 'bgr':
+            frame = luma(frame, frame_format)
+        self.pending[camera_index] = [self.classifier.crop(frame, det) for det in detections]
+
+    def discard(self, camera_index):
+        """The frame changed while it was cropped: its candidates pass unclassified"""
+        self.pending[camera_index] = None
+
+    def run(self):
+        """Classify everything added since the last run: {camera: keep mask}
+
+        Discarded cameras get no mask, their candidates are kept as they are.
+        """
+        pending, self.pending = self.pending, {}
+        keep = {camera_index: np.ones(len(crops), bool) for camera_index, crops in pending.items()
+                if crops is not None}
+        # Round robin over the cameras, so a busy camera cannot use up the whole batch
+        queue = []
+        lists = [(camera_index, crops) for camera_index, crops in pending.items() if crops]
+        for i in range(max((len(crops) for _, crops in lists), default=0)):
+            queue.extend((camera_index, i) for camera_index, crops in lists if i < len(crops))
+        batch = queue[:self.batch_limit]
+        self.counters['ticks'] += 1
+        self.counters['rois'] += len(queue)
+        self.counters['unclassified'] += len(queue) - len(batch)
+        self.last_batch = len(batch)
+        if not batch:
+            self.last_ms = 0.0
+            return keep
+
+        start = time.perf_counter()
+        scores = self.classifier.scores([pending[camera_index][i] for camera_index, i in batch])
+        self.last_ms = (time.perf_counter() - start) * 1000
+        for (camera_index, i), score in zip(batch, scores.tolist()):
+            keep[camera_index][i] = score >= self.classifier.threshold
+        rejected = int((scores < self.classifier.threshold).sum())
+        self.counters['classified'] += len(batch)
+        self.counters['rejected'] += rejected
+
+        # Batch size follows the measured cost per ROI
+        sample = self.last_ms / len(batch)
+        self.ms_per_roi = sample if self.ms_per_roi is None else 0.8 * self.ms_per_roi + 0.2 * sample
+        self.batch_limit = int(np.clip(self.budget_ms / self.ms_per_roi, self.min_batch, self.max_batch))
+        return keep
+
+    def snapshot(self):
+        """Counters and the current batch limit as a JSON-friendly dict"""
+        stats = dict(self.counters)
+        stats.update({'batch_limit': self.batch_limit, 'last_batch': self.last_batch,
+                      'last_ms': self.last_ms, 'ms_per_roi': self.ms_per_roi})
+        return stats
+
+
+def mark_rejected(frame, detections, keep):
+    """Draw the rejected boxes in red over the green detection boxes"""
+    for x, y, w, h in detections[~keep][['x', 'y', 'w', 'h']].tolist():
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+
+
+def run_benchmark(model=None, config=None, input_size=64, batch_sizes=(1, 4, 8, 16, 32, 64), repeats=20):
+    """ROIs per second one by one and batched, on crops of synthetic detections"""
+    from detection import MotionDetector
+    from frame_sources import SyntheticSource
+
+    if model is None:
+        model, config = make_test_model(tempfile.gettempdir(), input_size)
+        print("Test model with random weights (throughput only)")
+    classifier = RoiClassifier(model, config, input_size)
+
+    # Real candidate crops: detections of a few synthetic cameras
+    crops = []
+    for seed in range(4):
+        source = SyntheticSource(realtime=False, seed=seed, blobs=8)
+        source.open()
+        detector = MotionDetector()
+        for _ in range(40):
+            ret, frame = source.read()
+            detector.process(frame)
+            crops.extend(classifier.crop(frame, det) for det in detector.last_detections)
+    if not crops:
+        print("No candidates to classify")
+        return
+    print(f"{len(crops)} candidate crops, input {input_size}x{input_size}")
+    # Warm up, the first forward call sets up the network
+    classifier.scores(crops[:1])
+
+    print(f"{'batch':>6} {'one-by-one':>14} {'batched':>14} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        batch = (crops * (batch_size // len(crops) + 1))[:batch_size]
+        classifier.scores(batch)
+        # Best of three rounds, the two variants take turns
+        single_s = batched_s = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                single = classifier.scores_one_by_one(batch)
+            single_s = min(single_s, (time.perf_counter() - start) / repeats)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                batched = classifier.scores(batch)
+            batched_s = min(batched_s, (time.perf_counter() - start) / repeats)
+        if not np.allclose(single, batched, atol=1e-4):
+            print(f"  batch {batch_size}: batched scores differ from one-by-one")
+        print(f"{batch_size:>6} {batch_size / single_s:>9.0f} ROI/s {batch_size / batched_s:>9.0f} ROI/s "
+              f"{single_s / batched_s:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched ROI classification benchmark")
+    parser.add_argument('--model', help="Model file for cv2.dnn.readNet (default: random-weight test model)")
+    parser.add_argument('--config', help="Network config for formats that need one (Darknet .cfg, ...)")
+    parser.add_argument('--size', type=int, default=64, help="Network input size")
+    parser.add_argument('--write-test-model', metavar='DIR', help="Write the test network to DIR and exit")
+    args = parser.parse_args()
+
+    if args.write_test_model:
+        model, config = make_test_model(args.write_test_model, args.size)
+        print(f"Wrote {model} and {config}")
+        return
+    run_benchmark(args.model, args.config, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# Motion detection pipeline without any Qt dependency
+# One MotionDetector per camera so every camera keeps its own background model;
+# the GUI, the worker processes and the benchmarks all share this code.
+#
+# Detection runs on a resolution pyramid: background subtraction and mask
+# cleanup work on a downscaled copy (detection_scale), every candidate blob is
+# then refined at full resolution inside its own bounding box.
+
+import cv2
+import numpy as np
+
+from background import create_background_model
+from capture_formats import luma, to_bgr
+from gating import TileGate
+from night import NightMode
+from profiling import StageTimer
+
+# Scales the automatic latency-budget mode chooses from (largest first)
+DETECTION_SCALES = (1.0, 0.5, 0.25)
+
+# Smallest blob (in detection-level pixels) that survives the 3x3 opening
+MIN_BLOB_PX = 3
+
+# One row per detection, boxes and areas in full-resolution pixels
+DETECTION_DTYPE = np.dtype([
+    ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+    ('area', np.float32), ('cx', np.float32), ('cy', np.float32),
+])
+
+# Aspect-ratio window (w / h) that avoids very thin detections
+MIN_ASPECT = 0.2
+MAX_ASPECT = 5.0
+
+
+def aspect_ok(w, h):
+    """Vectorized aspect-ratio filter on arrays of box widths and heights"""
+    w = w.astype(np.float32)
+    h = h.astype(np.float32)
+    return (w > MIN_ASPECT * h) & (w < MAX_ASPECT * h) & (h > 0)
+
+
+def extract_candidates(mask, scale, min_area, max_area):
+    """Detections in a binary mask as a DETECTION_DTYPE array
+
+    Uses the connected-component statistics of the mask, so the area, max-area
+    and aspect-ratio filters are array operations instead of a per-contour loop.
+    Unlike findContours its cost hardly grows with the number of blobs, which
+    matters in noisy scenes (trees, rain, clouds). Areas are pixel counts.
+    """
+    try:
+        # 16-bit labels halve the label-image traffic, fall back when they overflow
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(
+            mask, connectivity=8, ltype=cv2.CV_16U)
+    except cv2.error:
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # Label 0 is the background
+    stats = stats[1:]
+    centroids = centroids[1:]
+
+    inv = 1.0 / scale
+    area = stats[:, cv2.CC_STAT_AREA] * (inv * inv)
+    w = stats[:, cv2.CC_STAT_WIDTH]
+    h = stats[:, cv2.CC_STAT_HEIGHT]
+    keep = (area > min_area) & (area < max_area) & aspect_ok(w, h)
+
+    stats = stats[keep]
+    detections = np.empty(len(stats), DETECTION_DTYPE)
+    detections['x'] = stats[:, cv2.CC_STAT_LEFT] * inv
+    detections['y'] = stats[:, cv2.CC_STAT_TOP] * inv
+    detections['w'] = np.ceil(stats[:, cv2.CC_STAT_WIDTH] * inv)
+    detections['h'] = np.ceil(stats[:, cv2.CC_STAT_HEIGHT] * inv)
+    detections['area'] = area[keep]
+    detections['cx'] = centroids[keep, 0] * inv
+    detections['cy'] = centroids[keep, 1] * inv
+    return detections
+
+
+def detect_in_roi(frame, box, pad=0, min_contrast=12):
+    """Foreground box (x, y, w, h, area) inside box + pad at full resolution, or None
+
+    The local background level is taken from the border of the padded box (sky is
+    smooth at that size), pixels that differ from it form the foreground.
+    """
+    height, width = frame.shape[:2]
+    x, y, w, h = box
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+    roi = frame[y0:y1, x0:x1]
+    if roi.shape[0] < 2 or roi.shape[1] < 2:
+        return None
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]]).astype(np.float32)
+    level = float(np.median(border))
+    spread = 1.4826 * float(np.median(np.abs(border - level)))
+    diff = cv2.absdiff(gray, np.full_like(gray, int(round(level))))
+    _, fg = cv2.threshold(diff, max(min_contrast, 3 * spread), 255, cv2.THRESH_BINARY)
+
+    points = cv2.findNonZero(fg)
+    if points is None:
+        return None
+    rx, ry, rw, rh = cv2.boundingRect(points)
+    # Cluttered background: the whole ROI lights up, nothing to separate
+    if rw * rh > 0.9 * fg.shape[0] * fg.shape[1]:
+        return None
+    return (x0 + rx, y0 + ry, rw, rh, len(points))
+
+
+def refine_box(frame, box, scale, min_contrast=12):
+    """Refine a coarse (x, y, w, h) box at full resolution inside its bounding box
+
+    Returns (x, y, w, h, area) like detect_in_roi, or None to keep the coarse box.
+    """
+    pad = int(np.ceil(2 / scale))  # One detection-level pixel plus the blur margin
+    return detect_in_roi(frame, box, pad, min_contrast)
+
+
+def create_detector(track=False, full_scan_interval=10, **kwargs):
+    """MotionDetector, wrapped in a TrackGuidedDetector when track is set"""
+    detector = MotionDetector(**kwargs)
+    if not track:
+        return detector
+    from tracking import TrackGuidedDetector  # tracking imports this module
+    return TrackGuidedDetector(detector, full_scan_interval=full_scan_interval)
+
+
+class MotionDetector:
+    """Background subtraction and blob detection for a single camera
+
+    detection_scale: scale for background subtraction and mask cleanup (e.g. 0.5 or
+    0.25), None keeps the old behaviour of only downscaling frames wider than 1280.
+    latency_budget_ms: if set, the scale is chosen automatically from
+    DETECTION_SCALES so the measured cost stays within the budget.
+    background: background-model engine, see background.BACKGROUND_ENGINES.
+    night: None, or 'auto' / 'on' for the night-mode stage (night.NightMode)
+    in front of the background model.
+    tile_size: gate background subtraction and mask cleanup on tiles of this
+    size (detection-level pixels), only tiles with change run (gating.TileGate).
+    Areas (min_area) are in full-resolution pixels.
+    """
+
+    def __init__(self, history=100, var_threshold=25, min_area=500, max_area_ratio=0.3,
+                 detection_scale=None, refine=True, latency_budget_ms=None, background='mog2',
+                 night=None, tile_size=None):
+        # Background model of this camera
+        self.background = background
+        self.history = history
+        self.var_threshold = var_threshold
+        self.fgbg = create_background_model(background, history, var_threshold)
+        self.night = NightMode(night) if night else None
+        self.gate = None
+        self.min_area = min_area
+        self.max_area_ratio = max_area_ratio
+        self.detection_scale = detection_scale
+        self.refine = refine
+        self.latency_budget_ms = latency_budget_ms
+
+        # Pre-create morphological kernels
+        self.kernel_small = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.kernel_large = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        if tile_size:
+            # The gate keeps one background model per tile instead of self.fgbg
+            self.gate = TileGate(tile_size, background=background, history=history,
+                                 var_threshold=var_threshold, kernel_small=self.kernel_small,
+                                 kernel_large=self.kernel_large)
+
+        # Cost of the detection level per megapixel (EWMA), used by the budget mode
+        self.ms_per_mpix = None
+        self.frames_since_rescale = 0
+        self.last_detections = np.empty(0, DETECTION_DTYPE)
+        self.last_stats = {}
+
+    def scale_for(self, width):
+        """Detection scale for a frame of the given width"""
+        if self.detection_scale is None:
+            return 1280 / width if width > 1280 else 1.0
+        return min(1.0, self.detection_scale)
+
+    def min_target_size(self, scale):
+        """Smallest detectable target side in full-resolution pixels at scale"""
+        return max(np.sqrt(self.min_area), MIN_BLOB_PX / scale)
+
+    def tradeoff(self, width, height):
+        """Estimated cost and smallest target per scale: [(scale, est_ms, min_target_px)]"""
+        rows = []
+        for scale in DETECTION_SCALES:
+            mpix = width * height * scale * scale / 1e6
+            est_ms = self.ms_per_mpix * mpix if self.ms_per_mpix else None
+            rows.append((scale, est_ms, self.min_target_size(scale)))
+        return rows
+
+    def _apply_budget(self, width, height):
+        """Pick the finest scale whose estimated cost fits the latency budget"""
+        # Changing the scale resets the background model, so only re-evaluate now and then
+        self.frames_since_rescale += 1
+        if not self.ms_per_mpix or self.frames_since_rescale < 60:
+            return
+        chosen = DETECTION_SCALES[-1]
+        for scale, est_ms, _ in self.tradeoff(width, height):
+            if est_ms <= self.latency_budget_ms:
+                chosen = scale
+                break
+        if chosen != self.detection_scale:
+            self.detection_scale = chosen
+            self.frames_since_rescale = 0
+
+    def process(self, frame, out=None, out_mask=None, frame_format='bgr', annotate=True):
+        """Optimized frame processing with multi-scale approach
+
+        out / out_mask: optional preallocated arrays (e.g. ring buffer slots) that
+        receive the annotated frame and the motion mask instead of new arrays.
+        frame_format: layout of frame (capture_formats.FRAME_FORMATS); anything
+        but 'bgr' is detected on its Y plane and only converted to BGR for the
+        annotated frame. annotate=False skips the annotated frame (returned as None).
+        """
+        timer = StageTimer()
+        source = frame
+        if frame_format != 'bgr':
+            frame = luma(frame, frame_format)
+        height, width = frame.shape[:2]
+        if self.latency_budget_ms and self.detection_scale is None:
+            self.detection_scale = 1.0
+
+        # Coarse level: resize for faster background subtraction
+        scale = self.scale_for(width)
+        if scale != 1.0:
+            small_frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            small_frame = frame
+        timer.mark('resize')
+
+        # Low light: denoise and lift the frame before the background model sees it
+        if self.night is not None:
+            small_frame = self.night.apply(small_frame)
+            if self.night.switched:
+                # Day and night frames differ too much for one model, start over
+                self.fgbg = create_background_model(self.background, self.history, self.var_threshold)
+                if self.gate is not None:
+                    self.gate.shape = None
+        timer.mark('night')
+
+        if self.gate is not None:
+            # Same stages, but only on the tiles where something changed
+            mask_clean = self.gate.process(small_frame, timer)
+            if scale == 1.0 and out_mask is None:
+                mask_clean = mask_clean.copy()  # The gate reuses its buffer next frame
+        else:
+            # Apply background subtraction
+            mask = self.fgbg.apply(small_frame)
+            timer.mark('subtract')
+
+            # Optimized noise reduction
+            mask = cv2.medianBlur(mask, 3)
+            timer.mark('blur')
+
+            # Threshold to binary
+            _, mask_binary = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+            timer.mark('threshold')
+
+            # Morphological operations for noise reduction
+            mask_clean = cv2.morphologyEx(mask_binary, cv2.MORPH_OPEN, self.kernel_small)
+            mask_clean = cv2.morphologyEx(mask_clean, cv2.MORPH_CLOSE, self.kernel_large)
+            timer.mark('morphology')
+
+        # Candidate blobs straight from the connected-component statistics
+        min_area = self.min_area  # Minimum area for detection
+        max_area = width * height * self.max_area_ratio  # Maximum area (30% of frame)
+        candidates = extract_candidates(mask_clean, scale, min_area, max_area)
+        timer.mark('candidates')
+        detect_ms = timer.total()
+
+        # Fine level: refine each candidate at full resolution inside its box
+        if self.refine and scale < 1.0 and len(candidates):
+            for det in candidates:
+                found = refine_box(frame, (int(det['x']), int(det['y']), int(det['w']), int(det['h'])), scale)
+                if found is None:
+                    continue
+                # Size and centre follow the refined box, like the tracker's ROI search
+                det['x'], det['y'], det['w'], det['h'], det['area'] = found
+                det['cx'] = det['x'] + det['w'] / 2
+                det['cy'] = det['y'] + det['h'] / 2
+            detections = candidates[aspect_ok(candidates['w'], candidates['h'])]
+        else:
+            detections = candidates
+        timer.mark('refine')
+
+        # Use original frame for drawing
+        if not annotate:
+            result_frame = None
+        elif frame_format != 'bgr':
+            result_frame = to_bgr(source, frame_format, out)
+        elif out is not None:
+            np.copyto(out, frame)
+            result_frame = out
+        else:
+            result_frame = frame.copy()
+
+        if result_frame is not None:
+            for x, y, w, h, area in detections[['x', 'y', 'w', 'h', 'area']].tolist():
+                # Draw bounding box
+                cv2.rectangle(result_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+                # Draw area text
+                cv2.putText(result_frame, f'Area: {int(area)}',
+                            (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        timer.mark('drawing')
+
+        # Scale mask back if needed
+        if scale != 1.0:
+            mask_clean = cv2.resize(mask_clean, (width, height), dst=out_mask,
+                                    interpolation=cv2.INTER_NEAREST)
+        elif out_mask is not None:
+            np.copyto(out_mask, mask_clean)
+            mask_clean = out_mask
+        timer.mark('mask')
+        processing_time = timer.total()
+
+        # Cost per level, the detection level also feeds the latency-budget estimate
+        stages = timer.stages
+        mpix = width * height * scale * scale / 1e6
+        sample = detect_ms / mpix
+        self.ms_per_mpix = sample if self.ms_per_mpix is None else 0.9 * self.ms_per_mpix + 0.1 * sample
+        self.last_detections = detections
+        self.last_stats = {
+            'scale': scale,
+            'resize_ms': stages['resize'],
+            'detect_ms': sum(stages.get(name, 0.0) for name in ('gate', 'subtract', 'blur', 'threshold', 'morphology')),
+            'candidates_ms': stages['candidates'],
+            'refine_ms': stages['refine'],
+            'total_ms': processing_time,
+            'stages': stages,
+            'candidates': len(candidates),
+            'detections': len(detections),
+            'min_target_px': self.min_target_size(scale),
+        }
+        if self.night is not None:
+            self.last_stats['night'] = self.night.stats()
+        if self.gate is not None:
+            self.last_stats['gating'] = self.gate.last_stats
+        if self.latency_budget_ms:
+            self._apply_budget(width, height)
+
+        # Add performance info to frame
+        if result_frame is not None:
+            cv2.putText(result_frame, f'Processing: {processing_time:.1f}ms (scale {scale:g})',
+                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+
+        return result_frame, mask_clean
@@ -0,0 +1,168 @@
+# Shared-memory ring buffer of frame slots
+# Capture writes straight into a preallocated slot, processing and display read
+# the slot in place. Only slot indices and sequence numbers have to cross thread
+# or process boundaries. Readers always take the newest frame (latest-frame-wins);
+# a per-slot sequence number works as a seqlock so a reader can detect that the
+# writer lapped it while it was reading.
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Header fields (int64)
+_LATEST_SEQ = 0
+_LATEST_SLOT = 1
+_PINNED_SLOT = 2
+_HEADER_FIELDS = 4
+
+_ALIGN = 64
+
+
+def _aligned(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class FrameRing:
+    """Preallocated ring of frame slots in shared memory
+
+    layout is a list of (plane_name, shape, dtype); every slot holds one array per
+    plane, e.g. [('frame', (720, 1280, 3), np.uint8), ('mask', (720, 1280), np.uint8)].
+    There is one writer and one (pinning) reader per ring.
+    frame_format: layout of the first plane (see capture_formats), 'bgr' by default.
+    """
+
+    def __init__(self, num_slots, layout, name=None, create=True, frame_format='bgr'):
+        self.num_slots = num_slots
+        self.frame_format = frame_format
+        self.layout = [(plane, tuple(shape), np.dtype(dtype).str) for plane, shape, dtype in layout]
+
+        # Memory map: header | seqs | timestamps | planes per slot
+        header_size = _aligned(8 * (_HEADER_FIELDS + num_slots))
+        ts_size = _aligned(8 * num_slots)
+        plane_sizes = [_aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                       for _, shape, dtype in self.layout]
+        slot_size = sum(plane_sizes)
+        total = header_size + ts_size + slot_size * num_slots
+
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+        else:
+            # Workers are spawned by the creator and share its resource tracker,
+            # so attaching does not hand ownership of the block to this process
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = create
+
+        buf = self.shm.buf
+        self._header = np.ndarray(_HEADER_FIELDS + num_slots, np.int64, buf, 0)
+        self._seqs = self._header[_HEADER_FIELDS:]
+        self._timestamps = np.ndarray(num_slots, np.float64, buf, header_size)
+
+        self._planes = {}
+        offset = header_size + ts_size
+        for (plane, shape, dtype), size in zip(self.layout, plane_sizes):
+            self._planes[plane] = [
+                np.ndarray(shape, dtype, buf, offset + slot * slot_size)
+                for slot in range(num_slots)
+            ]
+            offset += size
+        self._first_plane = self.layout[0][0]
+
+        if create:
+            self._header[:] = 0
+            self._header[_LATEST_SLOT] = -1
+            self._header[_PINNED_SLOT] = -1
+            self._seqs[:] = -1
+
+        self._next_slot = 0
+
+    @classmethod
+    def attach(cls, spec):
+        """Open an existing ring from FrameRing.spec() (e.g. inside a worker process)"""
+        name, num_slots, layout, frame_format = spec
+        return cls(num_slots, layout, name=name, create=False, frame_format=frame_format)
+
+    def spec(self):
+        """Picklable description to attach to this ring from another process"""
+        return (self.shm.name, self.num_slots, self.layout, self.frame_format)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # Writer side
+
+    def begin_write(self):
+        """Pick a free slot to write into, skipping the newest and the pinned slot"""
+        latest = self._header[_LATEST_SLOT]
+        pinned = self._header[_PINNED_SLOT]
+        for _ in range(self.num_slots):
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.num_slots
+            if slot != latest and slot != pinned:
+                break
+        # Mark as being written so readers of an older sequence see it changed
+        self._seqs[slot] = -1
+        return slot
+
+    def end_write(self, slot, timestamp, seq=None):
+        """Publish a written slot, returns its sequence number"""
+        if seq is None:
+            seq = int(self._header[_LATEST_SEQ]) + 1
+        self._timestamps[slot] = timestamp
+        self._seqs[slot] = seq
+        self._header[_LATEST_SEQ] = seq
+        self._header[_LATEST_SLOT] = slot
+        return seq
+
+    def abort_write(self, slot):
+        self._seqs[slot] = -1
+
+    # Reader side
+
+    def latest(self):
+        """(slot, seq) of the newest published frame, (-1, -1) if there is none"""
+        slot = int(self._header[_LATEST_SLOT])
+        if slot < 0:
+            return -1, -1
+        return slot, int(self._seqs[slot])
+
+    def find(self, seq):
+        """Slot that holds frame seq, -1 if it was overwritten already"""
+        slots = np.flatnonzero(self._seqs == seq)
+        return int(slots[0]) if seq >= 0 and len(slots) else -1
+
+    def pin(self, slot):
+        """Ask the writer not to reuse slot while it is being read"""
+        self._header[_PINNED_SLOT] = slot
+
+    def unpin(self):
+        self._header[_PINNED_SLOT] = -1
+
+    def valid(self, slot, seq):
+        """True if slot still holds frame seq (call after reading to detect a lap)"""
+        return seq >= 0 and self._seqs[slot] == seq
+
+    def plane(self, slot, plane):
+        return self._planes[plane][slot]
+
+    def frame(self, slot):
+        return self._planes[self._first_plane][slot]
+
+    def timestamp(self, slot):
+        return float(self._timestamps[slot])
+
+    def close(self):
+        # Drop our numpy views first, SharedMemory refuses to close while exported
+        self._planes = {}
+        self._header = self._seqs = self._timestamps = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with the process
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
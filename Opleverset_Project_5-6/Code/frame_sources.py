@@ -0,0 +1,781 @@
+# Frame sources for the camera pipeline
+# Live cameras, recorded clips, image folders and synthetic scenes all share the
+# same small interface (open/read/release) so the processing code can run and be
+# measured without the real hardware attached.
+
+import collections
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from capture_formats import (frame_shape, jpeg_offsets, luma, negotiate_format, parse_capture_formats,
+                             raw_frame)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.mjpg', '.mjpeg', '.h264')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# Camera enumeration results are kept here between runs
+CAMERA_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'drone_detection', 'cameras.json')
+
+
+def load_timestamps(path):
+    """Per-frame timestamps in seconds from a text file, one per line
+
+    Plain files hold seconds; files starting with "# timecode format v2" (as
+    written by picamera2/libcamera --save-pts and mkvextract) hold milliseconds.
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    scale = 0.001 if lines and lines[0].startswith('# timecode format v2') else 1.0
+    return [float(line) * scale for line in lines if line and not line.startswith('#')]
+
+
+class FrameSource:
+    """Base class for everything that produces frames"""
+    is_live = False
+    # Layout of the frames read() returns, see capture_formats.FRAME_FORMATS
+    frame_format = 'bgr'
+
+    def __init__(self, width=1280, height=720, fps=30, realtime=True):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # File sources: True = paced at the recorded rate, False = as fast as possible
+        self.realtime = realtime
+        # Sensor/media time of the last frame in seconds
+        self.timestamp = 0.0
+        # Recorded per-frame timestamps of file sources (None = derive from fps)
+        self.timestamps = None
+        self.frame_index = 0
+        self._start_time = None
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def __repr__(self):
+        return self.name
+
+    def open(self):
+        """Open the source, returns True on success"""
+        return True
+
+    def read(self, out=None):
+        """Read the next frame, returns (ret, frame) like cv2.VideoCapture.read
+
+        out is an optional preallocated array the source may decode into.
+        """
+        return False, None
+
+    def read_into(self, out):
+        """Read the next frame straight into out (e.g. a ring buffer slot)"""
+        ret, frame = self.read(out)
+        if not ret:
+            return False
+        if frame is not out:
+            if frame.shape != out.shape:
+                print(f"{self.name}: frame size {frame.shape} does not fit slot {out.shape}")
+                return False
+            np.copyto(out, frame)
+        return True
+
+    def release(self):
+        pass
+
+    def _media_time(self):
+        """Timestamp of the current frame: from the timestamp file, else index / fps"""
+        if self.timestamps:
+            # Looping clips continue after the last recorded timestamp
+            loops, index = divmod(self.frame_index, len(self.timestamps))
+            period = self.timestamps[-1] - self.timestamps[0] + 1.0 / self.fps
+            return self.timestamps[index] + loops * period
+        return self.frame_index / self.fps
+
+    def _pace(self, media_time):
+        """Sleep until media_time has passed since the first frame (realtime mode)"""
+        if not self.realtime:
+            return
+        now = time.perf_counter()
+        if self._start_time is None:
+            self._start_time = now - media_time
+            return
+        delay = self._start_time + media_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class V4L2Source(FrameSource):
+    """Live USB/V4L2 camera through cv2.VideoCapture
+
+    capture_format: 'bgr' (driver default, converted by OpenCV), 'mjpg',
+    'yuyv', 'nv12', a list like 'mjpg,yuyv' (first one the driver accepts) or
+    'auto'. MJPG frames are decoded on decoder (a shared JpegDecodePool) when
+    given; YUYV and NV12 frames are passed on as they are. gray: deliver
+    only the Y plane / a grayscale decode.
+    """
+    is_live = True
+
+    def __init__(self, camera_id, width=1280, height=720, fps=30, capture_format='bgr', gray=False,
+                 decoder=None, **kwargs):
+        super().__init__(width, height, fps, realtime=True)
+        self.camera_id = camera_id
+        self.capture_formats = parse_capture_formats(capture_format)
+        self.gray = gray
+        self.decoder = decoder
+        self.format = 'bgr'  # Negotiated capture format
+        self.cap = None
+
+    @property
+    def name(self):
+        return f"v4l2:{self.camera_id}"
+
+    @property
+    def frame_format(self):
+        if self.gray:
+            return 'gray'
+        if self.format == 'mjpg':
+            return self.decoder.frame_format if self.decoder else 'bgr'
+        return self.format
+
+    def open(self):
+        api = cv2.CAP_V4L2 if sys.platform.startswith('linux') else cv2.CAP_ANY
+        # Pass the settings with the open call: the driver negotiates the format
+        # once instead of once per cap.set
+        params = [cv2.CAP_PROP_FRAME_WIDTH, self.width, cv2.CAP_PROP_FRAME_HEIGHT, self.height,
+                  cv2.CAP_PROP_FPS, self.fps, cv2.CAP_PROP_BUFFERSIZE, 1]
+        self.cap = cv2.VideoCapture(self.camera_id, api, params)
+        if not self.cap.isOpened():
+            # Backends that reject one of the open parameters
+            self.cap = cv2.VideoCapture(self.camera_id, api)
+            if not self.cap.isOpened():
+                print(f"Failed to open camera {self.camera_id}")
+                return False
+
+            # Optimize camera settings
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce latency
+
+        self.format = negotiate_format(self.cap, self.capture_formats)
+        # The driver may have picked another size for this format
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or self.width
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or self.height
+        if self.format == 'mjpg' and self.decoder is None:
+            self.decode_flags = cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR
+        return True
+
+    def read(self, out=None):
+        if self.format == 'bgr' and not self.gray:
+            ret, frame = self.cap.read(out)
+        else:
+            ret, frame = self.cap.read()
+            if ret:
+                frame = self._convert(frame, out)
+                ret = frame is not None
+        if ret:
+            self.timestamp = time.time()
+            self.frame_index += 1
+        return ret, frame
+
+    def _convert(self, buffer, out):
+        """Frame in frame_format from a raw capture buffer, None if it is unusable"""
+        if self.format == 'mjpg':
+            data = buffer.reshape(-1)
+            frame = self.decoder.decode(data) if self.decoder else cv2.imdecode(data, self.decode_flags)
+            if frame is None:
+                print(f"{self.name}: corrupt JPEG frame ({data.size} bytes)")
+                return None
+            return luma(frame, 'bgr', out) if self.gray and frame.ndim == 3 else frame
+        if self.format == 'bgr':
+            return luma(buffer, 'bgr', out)
+        frame = raw_frame(buffer, self.format, self.width, self.height)
+        if frame is None:
+            print(f"{self.name}: short {self.format} buffer ({buffer.size} bytes)")
+            return None
+        return luma(frame, self.format, out) if self.gray else frame
+
+    def release(self):
+        if self.cap:
+            self.cap.release()
+
+
+class PicameraSource(FrameSource):
+    """Live Raspberry Pi camera through picamera2
+
+    capture_format 'yuv420' takes the ISP's YUV420 output as is ('i420'
+    frames) instead of RGB888; gray keeps only its Y plane.
+    """
+    is_live = True
+
+    def __init__(self, camera_index, width=1280, height=720, fps=30, capture_format='bgr', gray=False,
+                 **kwargs):
+        super().__init__(width, height, fps, realtime=True)
+        self.camera_index = camera_index
+        self.capture_format = capture_format
+        self.gray = gray
+        self.picam = None
+
+    @property
+    def name(self):
+        return f"picam:{self.camera_index}"
+
+    @property
+    def frame_format(self):
+        if self.gray:
+            return 'gray'
+        return 'i420' if self.capture_format == 'yuv420' else 'bgr'
+
+    def open(self):
+        try:
+            # Imported here so USB-only machines do not need picamera2
+            from picamera2 import Picamera2
+            self.picam = Picamera2(self.camera_index)
+            pixel_format = "YUV420" if self.capture_format == 'yuv420' else "RGB888"
+            config = self.picam.create_preview_configuration(
+                main={"format": pixel_format, "size": (self.width, self.height)}
+            )
+            self.picam.configure(config)
+            self.picam.start()
+            return True
+        except Exception as e:
+            print(f"Failed to open picamera {self.camera_index}: {e}")
+            return False
+
+    def read(self, out=None):
+        request = self.picam.capture_request()
+        try:
+            frame = request.make_array("main")
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        # SensorTimestamp is in nanoseconds, fall back to wall-clock time
+        sensor_ts = metadata.get("SensorTimestamp")
+        self.timestamp = sensor_ts / 1e9 if sensor_ts else time.time()
+        self.frame_index += 1
+        if self.capture_format == 'yuv420':
+            return True, luma(frame, 'i420') if self.gray else frame
+        if self.gray:
+            return True, cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=out)
+        return True, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=out)
+
+    def release(self):
+        if self.picam:
+            self.picam.stop()
+
+
+class VideoFileSource(FrameSource):
+    """Recorded clip, paced at its own frame rate or read as fast as possible"""
+
+    def __init__(self, path, realtime=True, loop=False, timestamps=None, **kwargs):
+        super().__init__(realtime=realtime)
+        self.path = path
+        self.loop = loop
+        self.cap = None
+        # Timestamp file, by default <clip>.timestamps.txt next to the clip if it exists
+        self.timestamps_path = timestamps or os.path.splitext(path)[0] + '.timestamps.txt'
+        self.timestamps = None
+
+    @property
+    def name(self):
+        return f"video:{self.path}"
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            print(f"Failed to open video {self.path}")
+            return False
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        if os.path.exists(self.timestamps_path):
+            self.timestamps = load_timestamps(self.timestamps_path)
+        return True
+
+    def read(self, out=None):
+        ret, frame = self.cap.read(out)
+        if not ret and self.loop and self.frame_index > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(out)
+        if not ret:
+            return False, None
+        self.timestamp = self._media_time()
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+    def release(self):
+        if self.cap:
+            self.cap.release()
+
+
+class ImageDirSource(FrameSource):
+    """Folder of still images played back as a clip (sorted by file name)"""
+
+    def __init__(self, path, fps=30, realtime=True, loop=False, timestamps=None, **kwargs):
+        super().__init__(fps=fps, realtime=realtime)
+        self.path = path
+        self.loop = loop
+        self.files = []
+        self._pos = 0
+        # Timestamp file, by default timestamps.txt inside the folder if it exists
+        self.timestamps_path = timestamps or os.path.join(path, 'timestamps.txt')
+        self.timestamps = None
+
+    @property
+    def name(self):
+        return f"images:{self.path}"
+
+    def open(self):
+        if not os.path.isdir(self.path):
+            print(f"Image folder not found: {self.path}")
+            return False
+        self.files = sorted(
+            os.path.join(self.path, f) for f in os.listdir(self.path)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            print(f"No images in {self.path}")
+            return False
+        if os.path.exists(self.timestamps_path):
+            self.timestamps = load_timestamps(self.timestamps_path)
+        return True
+
+    def read(self, out=None):
+        if self._pos >= len(self.files):
+            if not self.loop:
+                return False, None
+            self._pos = 0
+        frame = cv2.imread(self.files[self._pos])
+        self._pos += 1
+        if frame is None:
+            return False, None
+        self.height, self.width = frame.shape[:2]
+        self.timestamp = self._media_time()
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+
+class MjpegFileSource(FrameSource):
+    """Concatenated JPEGs from a file, decoded like the frames of a MJPG camera
+
+    decoder: shared JpegDecodePool; the next frames are decoded ahead on it
+    (up to prefetch), otherwise every frame is decoded in read(). gray: decode
+    to grayscale (without a decoder, the decoder's own setting otherwise).
+    """
+
+    def __init__(self, path, fps=30, realtime=True, loop=False, gray=False, decoder=None, prefetch=2,
+                 timestamps=None, **kwargs):
+        super().__init__(fps=fps, realtime=realtime)
+        self.path = path
+        self.loop = loop
+        self.gray = gray
+        self.decoder = decoder
+        self.prefetch = prefetch
+        self.pending = collections.deque()
+        self.file = self.data = None
+        self.offsets = []
+        self._pos = 0
+        # Timestamp file, by default <clip>.timestamps.txt next to the clip if it exists
+        self.timestamps_path = timestamps or os.path.splitext(path)[0] + '.timestamps.txt'
+        self.timestamps = None
+
+    @property
+    def name(self):
+        return f"mjpeg:{self.path}"
+
+    @property
+    def frame_format(self):
+        if self.decoder:
+            return self.decoder.frame_format
+        return 'gray' if self.gray else 'bgr'
+
+    def open(self):
+        try:
+            self.file = open(self.path, 'rb')
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"Failed to open MJPEG file {self.path}: {e}")
+            return False
+        self.offsets = jpeg_offsets(self.data)
+        if not self.offsets:
+            print(f"No JPEG frames in {self.path}")
+            return False
+        if os.path.exists(self.timestamps_path):
+            self.timestamps = load_timestamps(self.timestamps_path)
+        self.flags = cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR
+        return True
+
+    def _next_data(self):
+        """Bytes of the next JPEG, None at the end"""
+        if self._pos >= len(self.offsets):
+            if not self.loop:
+                return None
+            self._pos = 0
+        start, end = self.offsets[self._pos]
+        self._pos += 1
+        return np.frombuffer(self.data[start:end], np.uint8)
+
+    def read(self, out=None):
+        if self.decoder:
+            while len(self.pending) <= self.prefetch:
+                data = self._next_data()
+                if data is None:
+                    break
+                self.pending.append(self.decoder.submit(data))
+            if not self.pending:
+                return False, None
+            frame = self.pending.popleft().result()
+        else:
+            data = self._next_data()
+            if data is None:
+                return False, None
+            frame = cv2.imdecode(data, self.flags)
+        if frame is None:
+            print(f"{self.name}: corrupt JPEG frame")
+            return False, None
+        self.height, self.width = frame.shape[:2]
+        self.timestamp = self._media_time()
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+    def release(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = None
+
+
+class RawYuvSource(FrameSource):
+    """Raw YUYV or NV12 frames from a file, as a camera delivers them with conversion off
+
+    Frames are read straight into the given slot; gray keeps only the Y plane.
+    """
+
+    def __init__(self, path, fmt, width=1280, height=720, fps=30, realtime=True, loop=False, gray=False,
+                 timestamps=None, **kwargs):
+        super().__init__(width, height, fps, realtime)
+        self.path = path
+        self.format = fmt
+        self.gray = gray
+        self.loop = loop
+        self.file = None
+        self.timestamps_path = timestamps or os.path.splitext(path)[0] + '.timestamps.txt'
+        self.timestamps = None
+
+    @property
+    def name(self):
+        return f"{self.format}:{self.path}"
+
+    @property
+    def frame_format(self):
+        return 'gray' if self.gray else self.format
+
+    def open(self):
+        self.buffer = np.empty(frame_shape(self.format, self.width, self.height), np.uint8)
+        try:
+            self.file = open(self.path, 'rb')
+        except OSError as e:
+            print(f"Failed to open {self.format} file {self.path}: {e}")
+            return False
+        if os.fstat(self.file.fileno()).st_size < self.buffer.nbytes:
+            print(f"{self.path} is smaller than one {self.width}x{self.height} {self.format} frame")
+            return False
+        if os.path.exists(self.timestamps_path):
+            self.timestamps = load_timestamps(self.timestamps_path)
+        return True
+
+    def _read_raw(self, target):
+        view = memoryview(target).cast('B')
+        if self.file.readinto(view) == len(view):
+            return True
+        if not self.loop or self.frame_index == 0:
+            return False
+        self.file.seek(0)
+        return self.file.readinto(view) == len(view)
+
+    def read(self, out=None):
+        # Without out every frame gets its own array, callers may keep them
+        if self.gray:
+            if not self._read_raw(self.buffer):
+                return False, None
+            frame = luma(self.buffer, self.format, out)
+            if out is None and frame.base is self.buffer:
+                frame = frame.copy()
+        else:
+            frame = out if out is not None else np.empty_like(self.buffer)
+            if not self._read_raw(frame):
+                return False, None
+        self.timestamp = self._media_time()
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+    def release(self):
+        if self.file:
+            self.file.close()
+
+
+class SyntheticSource(FrameSource):
+    """Generated sky scene with small moving blobs ("drones") and sensor noise
+
+    brightness scales the scene (night clips); grain > 1 makes the noise
+    spatially correlated over grain x grain pixels, like low-light sensor
+    noise after demosaicing and compression; flicker (grey levels) shifts
+    every frame by a random offset, like auto gain hunting in the dark.
+    """
+
+    def __init__(self, width=1280, height=720, fps=30, realtime=True, blobs=3,
+                 blob_size=20, noise=4.0, seed=0, num_frames=None, brightness=1.0,
+                 grain=1, flicker=0.0, **kwargs):
+        super().__init__(width, height, fps, realtime)
+        self.num_blobs = blobs
+        self.brightness = brightness
+        self.grain = grain
+        self.flicker = flicker
+        self.blob_size = blob_size
+        self.noise = noise
+        self.seed = seed
+        self.num_frames = num_frames
+        # Bounding boxes (x, y, w, h) of the blobs in the last frame
+        self.ground_truth = []
+
+    @property
+    def name(self):
+        return f"synthetic:{self.num_blobs}"
+
+    def open(self):
+        self.rng = np.random.default_rng(self.seed)
+        cv2.setRNGSeed(self.seed)
+        # Vertical sky gradient as static background
+        column = np.linspace(200, 140, self.height, dtype=np.float32) * self.brightness
+        sky = np.empty((self.height, self.width, 3), np.uint8)
+        sky[:, :, 0] = column[:, None]
+        sky[:, :, 1] = (column * 0.85)[:, None]
+        sky[:, :, 2] = (column * 0.6)[:, None]
+        self.background = sky
+        self.positions = self.rng.uniform(
+            [0, 0], [self.width, self.height], size=(self.num_blobs, 2))
+        self.velocities = self.rng.uniform(-6, 6, size=(self.num_blobs, 2))
+        self._noise = np.empty((self.height, self.width, 3), np.int16)
+        if self.grain > 1:
+            self._grain = np.empty((self.height // self.grain, self.width // self.grain, 3), np.int16)
+        self.blob_color = (40 * self.brightness,) * 3
+        return True
+
+    def read(self, out=None):
+        if self.num_frames is not None and self.frame_index >= self.num_frames:
+            return False, None
+
+        if self.noise > 0:
+            if self.grain > 1:
+                cv2.randn(self._grain, 0, self.noise)
+                cv2.resize(self._grain, (self.width, self.height), dst=self._noise,
+                           interpolation=cv2.INTER_LINEAR)
+            else:
+                cv2.randn(self._noise, 0, self.noise)
+            if self.flicker:
+                self._noise += np.int16(self.rng.normal(0, self.flicker))
+            frame = cv2.add(self.background, self._noise, dst=out, dtype=cv2.CV_8U)
+        elif out is not None:
+            np.copyto(out, self.background)
+            frame = out
+        else:
+            frame = self.background.copy()
+
+        # Move blobs and bounce off the edges
+        self.positions += self.velocities
+        for axis, limit in ((0, self.width), (1, self.height)):
+            outside = (self.positions[:, axis] < 0) | (self.positions[:, axis] >= limit)
+            self.velocities[outside, axis] *= -1
+            np.clip(self.positions[:, axis], 0, limit - 1, out=self.positions[:, axis])
+
+        self.ground_truth = []
+        r = self.blob_size
+        for x, y in self.positions.astype(np.int32):
+            cv2.ellipse(frame, (int(x), int(y)), (r, r // 2), 0, 0, 360, self.blob_color, -1)
+            self.ground_truth.append((int(x) - r, int(y) - r // 2, 2 * r, r))
+
+        self.timestamp = self.frame_index / self.fps
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+
+class MemorySource(FrameSource):
+    """Frames preloaded from another source, replayed from memory
+
+    Reading costs only a copy, like a camera that DMAs into memory, so many of
+    them can feed a benchmark without the source itself using the CPU.
+    offset: first frame to play, so copies of one clip do not show the same frame.
+    """
+
+    def __init__(self, frames, fps=30, realtime=True, loop=True, offset=0, name='memory'):
+        height, width = frames[0].shape[:2]
+        super().__init__(width, height, fps, realtime)
+        self.frames = frames
+        self.loop = loop
+        self.offset = offset
+        self._name = name
+
+    @classmethod
+    def preload(cls, spec, num_frames=60, **kwargs):
+        """Read num_frames frames of a source spec into memory"""
+        source = create_source(spec, realtime=False)
+        frames = []
+        if source.open():
+            while len(frames) < num_frames:
+                ret, frame = source.read()
+                if not ret:
+                    break
+                frames.append(frame.copy())
+            source.release()
+        if not frames:
+            raise ValueError(f"No frames from {spec}")
+        return cls(frames, fps=source.fps, name=f"memory:{source.name}", **kwargs)
+
+    @property
+    def name(self):
+        return self._name
+
+    def read(self, out=None):
+        if not self.loop and self.frame_index >= len(self.frames):
+            return False, None
+        frame = self.frames[(self.frame_index + self.offset) % len(self.frames)]
+        if out is not None:
+            np.copyto(out, frame)
+            frame = out
+        self.timestamp = self._media_time()
+        self._pace(self.timestamp)
+        self.frame_index += 1
+        return True, frame
+
+
+def open_with_timeout(source, timeout=5.0):
+    """Open a source, giving up after timeout seconds
+
+    A camera that hangs in open() (a USB device that is re-enumerating, a
+    picamera that is still held by a crashed process) must not keep the
+    pipeline blind. The open continues in the background and is released if it
+    finishes after all.
+    """
+    if not timeout:
+        return source.open()
+    lock = threading.Lock()
+    state = {'ok': None, 'abandoned': False}
+    done = threading.Event()
+
+    def worker():
+        ok = source.open()
+        with lock:
+            if not state['abandoned']:
+                state['ok'] = ok
+                done.set()
+                return
+        if ok:
+            source.release()
+
+    threading.Thread(target=worker, daemon=True).start()
+    done.wait(timeout)
+    with lock:
+        if state['ok'] is not None:
+            return state['ok']
+        state['abandoned'] = True
+    print(f"Opening {source.name} timed out after {timeout:g}s")
+    return False
+
+
+def _video_devices():
+    """Cheap fingerprint of the attached cameras (Linux: /dev/video* nodes)"""
+    if not os.path.isdir('/dev'):
+        return None
+    return sorted(name for name in os.listdir('/dev') if name.startswith('video'))
+
+
+def detect_camera_ids(cache_path=CAMERA_CACHE, refresh=False):
+    """Camera ids from cv2_enumerate_cameras, cached between runs
+
+    The cache is used as long as the /dev/video* nodes are unchanged, so a
+    restart skips the enumeration (which opens every device node).
+    """
+    devices = _video_devices()
+    if not refresh and devices is not None and cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get('devices') == devices:
+                return cached['ids']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Imported here: only needed when the cameras are not given or cached
+    from cv2_enumerate_cameras import enumerate_cameras
+    ids = []
+    for camera_info in enumerate_cameras():
+        index = int(str(camera_info.index)[-1])
+        if index not in ids:
+            ids.append(index)
+
+    if cache_path and devices is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, 'w') as f:
+                json.dump({'devices': devices, 'ids': ids, 'time': time.time()}, f)
+        except OSError as e:
+            print(f"Cannot write camera cache {cache_path}: {e}")
+    return ids
+
+
+def create_source(spec, realtime=True, width=1280, height=720, fps=30, loop=False, capture_format='bgr',
+                  gray=False, decoder=None):
+    """Build a frame source from a spec string
+
+    Examples: "0", "v4l2:0", "picam:1", "video:clip.mp4", "clip.mp4",
+    "images:folder/", "synthetic", "synthetic:5" (five blobs), "night" (dark, noisy synthetic scene),
+    "mjpeg:cam.mjpg" (concatenated JPEGs), "yuyv:cam.yuv" / "nv12:cam.yuv" (raw frames of width x height)
+
+    capture_format, gray and decoder (a JpegDecodePool) apply to cameras and
+    to the MJPEG and raw YUV files; the other sources deliver BGR.
+    """
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, int):
+        return V4L2Source(spec, width, height, fps, capture_format, gray, decoder)
+
+    kind, _, arg = str(spec).partition(':')
+    if not arg:
+        kind, arg = '', kind
+    kind = kind.lower()
+
+    if kind == 'v4l2' or (not kind and arg.isdigit()):
+        return V4L2Source(int(arg), width, height, fps, capture_format, gray, decoder)
+    if kind == 'picam':
+        picam_format = 'bgr' if parse_capture_formats(capture_format) == ('bgr',) else 'yuv420'
+        return PicameraSource(int(arg or 0), width, height, fps, picam_format, gray)
+    if kind == 'mjpeg':
+        return MjpegFileSource(arg, fps, realtime, loop, gray, decoder)
+    if kind in ('yuyv', 'nv12'):
+        return RawYuvSource(arg, kind, width, height, fps, realtime, loop, gray)
+    if kind == 'synthetic' or arg == 'synthetic':
+        blobs = int(arg) if arg.isdigit() else 3
+        return SyntheticSource(width, height, fps, realtime, blobs=blobs)
+    if kind == 'night' or arg == 'night':
+        blobs = int(arg) if arg.isdigit() else 3
+        return SyntheticSource(width, height, fps, realtime, blobs=blobs, brightness=0.15, noise=10.0,
+                               grain=3, flicker=3.0)
+    if kind == 'images' or (not kind and os.path.isdir(arg)):
+        return ImageDirSource(arg, fps, realtime, loop)
+    if kind == 'video' or (not kind and arg.lower().endswith(VIDEO_EXTENSIONS)):
+        return VideoFileSource(arg, realtime, loop)
+    raise ValueError(f"Unknown frame source: {spec}")
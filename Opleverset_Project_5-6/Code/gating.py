@@ -0,0 +1,243 @@
+# Tile-level change gating for the motion detector
+# Most of a frame is empty sky or static foreground, yet background
+# subtraction, the median blur, the threshold and both morphology passes touch
+# every pixel of every frame. The gate splits the detection level into tiles:
+#   - a cheap check marks tiles as active: the frame downsampled 4x (bilinear,
+#     which averages 2x2 pixels and so most of the sensor noise) is differenced
+#     against the previous one and a tile is active when any of its pixels changed
+#   - active tiles stay active for hold frames and get a halo of neighbouring
+#     tiles, so a target entering a tile is already being modelled there
+#   - only active tiles go through the background model (one model per tile,
+#     so quiet tiles are simply not updated) and the mask cleanup, with a few
+#     pixels of overlap so the morphology sees across tile borders
+#   - every quiet tile is still processed once every refresh_interval frames
+#     (staggered over the tiles), which is its slower background update
+# Quiet tiles keep their previous mask, so a target that stopped moving stays
+# visible until its tile is refreshed.
+#
+# Benchmark: python gating.py --clip synthetic --clip video:drone.mp4
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from background import create_background_model
+from profiling import NULL_TIMER
+
+# Pixels of overlap for the 3x3 median, 3x3 opening and 5x5 closing
+MORPHOLOGY_MARGIN = 4
+
+
+class TileGate:
+    """Gated background subtraction and mask cleanup on a tile grid
+
+    tile_size is in detection-level pixels (a multiple of 4). A tile is active
+    when a pixel of the 4x downsampled grey frame changed by more than
+    threshold grey levels since the previous frame.
+    """
+
+    def __init__(self, tile_size=128, threshold=10, halo=1, hold=15, refresh_interval=10,
+                 background='mog2', history=100, var_threshold=25, kernel_small=None, kernel_large=None):
+        if tile_size % 4:
+            raise ValueError("tile_size must be a multiple of 4")
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.halo = halo
+        self.hold = hold
+        self.refresh_interval = refresh_interval
+        self.background = background
+        self.history = history
+        self.var_threshold = var_threshold
+        self.kernel_small = kernel_small if kernel_small is not None else \
+            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.kernel_large = kernel_large if kernel_large is not None else \
+            cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        self.shape = None
+        self.last_stats = {}
+
+    def _setup(self, frame):
+        """Grid, per-tile models and buffers for a new frame size"""
+        height, width = frame.shape[:2]
+        self.shape = frame.shape
+        self.rows = -(-height // self.tile_size)
+        self.cols = -(-width // self.tile_size)
+        self.models = [[create_background_model(self.background, self.history, self.var_threshold)
+                        for _ in range(self.cols)] for _ in range(self.rows)]
+        self.raw = np.zeros((height, width), np.uint8)
+        self.clean = np.zeros((height, width), np.uint8)
+        # Downsampled grey frames, padded to whole tiles
+        small = self.tile_size // 4
+        self.small_size = (width // 4, height // 4)
+        self.previous = None
+        self.changed = np.zeros((self.rows * small, self.cols * small), np.uint8)
+        self.last_active = np.full((self.rows, self.cols), -10 ** 9, np.int64)
+        # Staggered refresh: tile i is due when (frame_index + i) % refresh_interval == 0
+        self.phase = np.arange(self.rows * self.cols).reshape(self.rows, self.cols) % self.refresh_interval
+        self.frame_index = 0
+
+    def active_tiles(self, frame):
+        """Boolean (rows x cols) grid of the tiles to process this frame"""
+        small = cv2.resize(frame, self.small_size, interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.previous is None:
+            self.previous = small
+            return np.ones((self.rows, self.cols), bool)
+        diff = cv2.absdiff(small, self.previous)
+        self.previous = small
+        height, width = diff.shape
+        cv2.threshold(diff, self.threshold, 1, cv2.THRESH_BINARY, dst=self.changed[:height, :width])
+        t = self.tile_size // 4
+        changed = self.changed.reshape(self.rows, t, self.cols, t).max(axis=(1, 3)).astype(bool)
+
+        self.last_active[changed] = self.frame_index
+        active = (self.frame_index - self.last_active) <= self.hold
+        if self.halo:
+            size = 2 * self.halo + 1
+            active = cv2.dilate(active.astype(np.uint8), np.ones((size, size), np.uint8)).astype(bool)
+        return active | ((self.frame_index + self.phase) % self.refresh_interval == 0)
+
+    def _cleanup(self, y0, y1, x0, x1, timer):
+        """Median, threshold and morphology of one region, written into clean"""
+        height, width = self.raw.shape
+        m = MORPHOLOGY_MARGIN
+        top, bottom, left, right = max(0, y0 - m), min(height, y1 + m), max(0, x0 - m), min(width, x1 + m)
+        region = cv2.medianBlur(self.raw[top:bottom, left:right], 3)
+        timer.mark('blur')
+        _, region = cv2.threshold(region, 200, 255, cv2.THRESH_BINARY)
+        timer.mark('threshold')
+        region = cv2.morphologyEx(region, cv2.MORPH_OPEN, self.kernel_small)
+        region = cv2.morphologyEx(region, cv2.MORPH_CLOSE, self.kernel_large)
+        self.clean[y0:y1, x0:x1] = region[y0 - top:y1 - top, x0 - left:x1 - left]
+        timer.mark('morphology')
+
+    def process(self, frame, timer=NULL_TIMER):
+        """Cleaned motion mask of the frame (a buffer owned by the gate)"""
+        if self.shape != frame.shape:
+            self._setup(frame)
+        active = self.active_tiles(frame)
+        self.frame_index += 1
+        timer.mark('gate')
+
+        t = self.tile_size
+        rows, cols = np.nonzero(active)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            y0, x0 = row * t, col * t
+            self.raw[y0:y0 + t, x0:x0 + t] = self.models[row][col].apply(frame[y0:y0 + t, x0:x0 + t])
+        timer.mark('subtract')
+
+        # Cleanup per horizontal run of active tiles, so neighbours share one call
+        for row in range(self.rows):
+            col = 0
+            while col < self.cols:
+                if not active[row, col]:
+                    col += 1
+                    continue
+                start = col
+                while col < self.cols and active[row, col]:
+                    col += 1
+                self._cleanup(row * t, (row + 1) * t, start * t, col * t, timer)
+
+        self.last_stats = {'tiles': self.rows * self.cols, 'active_tiles': len(rows),
+                           'active_fraction': len(rows) / float(self.rows * self.cols)}
+        return self.clean
+
+
+def compare(clips, tile_sizes=(64, 128), max_frames=200, warmup=30, detection_scale=None):
+    """CPU time and detections with and without gating
+
+    Missed detections are counted against the ungated detector (a gated box is
+    a match when its centre is inside an ungated box or vice versa), recall
+    against the ground truth of synthetic clips.
+    """
+    from background import _recall
+    from detection import MotionDetector
+    from frame_sources import create_source
+
+    rows = []
+    for clip in clips:
+        source = create_source(clip, realtime=False)
+        if not source.open():
+            continue
+        frames, truth = [], []
+        while len(frames) < max_frames + warmup:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frames.append(frame.copy())
+            truth.append(list(getattr(source, 'ground_truth', None) or []))
+        source.release()
+        has_truth = any(truth)
+
+        reference = None
+        for tile_size in (None,) + tuple(tile_sizes):
+            detector = MotionDetector(detection_scale=detection_scale, tile_size=tile_size)
+            stage_ms = total_ms = active = 0.0
+            found = expected = missed = extra = 0
+            boxes = []
+            for i, frame in enumerate(frames):
+                start = time.perf_counter()
+                detector.process(frame)
+                elapsed = (time.perf_counter() - start) * 1000
+                detections = detector.last_detections
+                boxes.append(detections)
+                if i < warmup:
+                    continue
+                stats = detector.last_stats
+                total_ms += elapsed
+                stage_ms += sum(stats['stages'].get(name, 0.0)
+                                for name in ('gate', 'subtract', 'blur', 'threshold', 'morphology'))
+                active += stats.get('gating', {}).get('active_fraction', 1.0)
+                if has_truth:
+                    hit, count = _recall(truth[i], detections)
+                    found += hit
+                    expected += count
+                if reference is not None:
+                    ungated = reference[i][['x', 'y', 'w', 'h']].tolist()
+                    hit, count = _recall(ungated, detections)
+                    missed += count - hit
+                    extra += len(detections) - _recall(detections[['x', 'y', 'w', 'h']].tolist(),
+                                                       reference[i])[0]
+            if tile_size is None:
+                reference = boxes
+            measured = max(1, len(frames) - warmup)
+            rows.append({
+                'clip': clip,
+                'tile_size': tile_size,
+                'ms': total_ms / measured,
+                'stage_ms': stage_ms / measured,
+                'active_fraction': active / measured,
+                'recall': found / expected if expected else None,
+                'missed_per_frame': missed / measured,
+                'extra_per_frame': extra / measured,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection cost and misses with tile-level change gating")
+    parser.add_argument('--clip', action='append', default=[],
+                        help="Frame source spec (default: synthetic clips with ground truth)")
+    parser.add_argument('--tile', type=int, action='append', help="Tile size(s) to compare (default 64 and 128)")
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--detect-scale', type=float)
+    args = parser.parse_args()
+
+    rows = compare(args.clip or ['synthetic', 'synthetic:20'], args.tile or (64, 128), args.frames,
+                   detection_scale=args.detect_scale)
+    print(f"{'clip':<14} {'tiles':>6} {'ms/frame':>8} {'stages':>8} {'active':>7} {'recall':>7} "
+          f"{'missed':>7} {'extra':>6}")
+    for row in rows:
+        recall = f"{row['recall']:.2f}" if row['recall'] is not None else "-"
+        tiles = row['tile_size'] or 'off'
+        print(f"{row['clip']:<14} {tiles:>6} {row['ms']:>8.2f} {row['stage_ms']:>8.2f} "
+              f"{row['active_fraction'] * 100:>6.0f}% {recall:>7} {row['missed_per_frame']:>7.2f} "
+              f"{row['extra_per_frame']:>6.2f}")
+    print("stages: gate + subtract + blur + threshold + morphology; missed/extra per frame against "
+          "the ungated detector")
+
+
+if __name__ == "__main__":
+    main()
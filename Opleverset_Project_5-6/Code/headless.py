@@ -0,0 +1,608 @@
+# Headless detection service without Qt
+# Same capture -> FrameRing -> MotionDetector pipeline as shit_optimized.py, but
+# with plain threads and no window, so it starts faster, uses less memory and
+# runs on masts without a display server. Detections are streamed as NDJSON
+# (one JSON object per frame) or as a compact binary stream to stdout, a file
+# or a local socket that clients connect to.
+#
+# Run:     python headless.py --source picam:0 --source picam:1 --output tcp:127.0.0.1:9000
+# Compare: python headless.py --compare-startup
+# Scaling: python headless.py --camera-scaling 1,2,4,8
+#
+# Binary stream: per frame a FRAME_HEADER (magic b'DT', camera, seq, timestamp,
+# number of detections) followed by that many DETECTION_DTYPE records
+# (little endian); read_binary_stream() decodes it. Acoustic events (--audio)
+# use the same header with magic b'AE', the audio source index as camera and
+# one ACOUSTIC_DTYPE record.
+
+import argparse
+import json
+import os
+import resource
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from background import BACKGROUND_ENGINES
+from detection import DETECTION_DTYPE, create_detector
+from frame_ring import FrameRing
+from frame_sources import MemorySource, create_source, detect_camera_ids, open_with_timeout
+from metrics import MetricsExporter, PipelineMetrics
+from night import NIGHT_MODES
+from scheduler import LoadScheduler
+from workers import make_result_ring, process_latest
+
+# magic, camera, seq, capture timestamp (s), number of detections
+FRAME_HEADER = struct.Struct('<2sHIdH')
+FRAME_MAGIC = b'DT'
+AUDIO_MAGIC = b'AE'
+DETECTION_LE = DETECTION_DTYPE.newbyteorder('<')
+AUDIO_STATES = ('end', 'start', 'ongoing')
+
+
+def acoustic_dtype():
+    """Little-endian ACOUSTIC_DTYPE (acoustic.py is only imported once audio is used)"""
+    from acoustic import ACOUSTIC_DTYPE
+    return ACOUSTIC_DTYPE.newbyteorder('<')
+
+
+class SocketBroadcaster:
+    """Listening TCP or Unix socket that sends every record to all connected clients"""
+
+    def __init__(self, address):
+        kind, _, rest = address.partition(':')
+        if kind == 'unix':
+            if os.path.exists(rest):
+                os.unlink(rest)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(rest)
+            self.path = rest
+        else:
+            host, _, port = rest.rpartition(':')
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((host or '127.0.0.1', int(port)))
+            self.path = None
+        self.server.listen()
+        self.clients = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+        print(f"Streaming detections on {address}", file=sys.stderr)
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return  # Server socket closed
+            # A client that stops reading must not stall the pipeline
+            client.settimeout(0.05)
+            with self.lock:
+                self.clients.append(client)
+
+    def write(self, data):
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(data)
+                except OSError:
+                    client.close()
+                    self.clients.remove(client)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class DetectionWriter:
+    """Writes detections per frame as NDJSON or binary records
+
+    target: '-' (stdout), a file path, 'tcp:HOST:PORT' or 'unix:PATH'.
+    """
+
+    def __init__(self, target='-', fmt='ndjson'):
+        if fmt not in ('ndjson', 'binary'):
+            raise ValueError(f"Unknown output format: {fmt}")
+        self.fmt = fmt
+        self.records = 0
+        self.audio_events = 0
+        # Detections and acoustic events come from different threads
+        self.lock = threading.Lock()
+        if target == '-':
+            self.stream = sys.stdout.buffer
+        elif target.startswith(('tcp:', 'unix:')):
+            self.stream = SocketBroadcaster(target)
+        else:
+            self.stream = open(target, 'wb')
+
+    def write(self, camera_index, seq, timestamp, detections):
+        if self.fmt == 'ndjson':
+            boxes = detections[['x', 'y', 'w', 'h']].tolist()
+            record = {'cam': camera_index, 'seq': seq, 'ts': round(timestamp, 6),
+                      'det': [[x, y, w, h, round(float(area), 1)]
+                              for (x, y, w, h), area in zip(boxes, detections['area'].tolist())]}
+            data = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        else:
+            data = FRAME_HEADER.pack(FRAME_MAGIC, camera_index, seq, timestamp, len(detections)) + \
+                detections.astype(DETECTION_LE, copy=False).tobytes()
+        with self.lock:
+            self.stream.write(data)
+            self.stream.flush()
+            self.records += 1
+
+    def write_event(self, audio_index, timestamp, event):
+        """One acoustic event (an ACOUSTIC_DTYPE record)"""
+        if self.fmt == 'ndjson':
+            record = {'audio': audio_index, 'seq': self.audio_events, 'ts': round(timestamp, 6),
+                      'state': AUDIO_STATES[int(event['state'])], 'f0': round(float(event['f0']), 1),
+                      'salience': round(float(event['salience']), 1), 'harmonics': int(event['harmonics']),
+                      'level': round(float(event['level']), 1)}
+            data = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        else:
+            data = FRAME_HEADER.pack(AUDIO_MAGIC, audio_index, self.audio_events, timestamp, 1) + \
+                np.asarray(event, acoustic_dtype()).tobytes()
+        with self.lock:
+            self.stream.write(data)
+            self.stream.flush()
+            self.audio_events += 1
+
+    def close(self):
+        if self.stream is not sys.stdout.buffer:
+            self.stream.close()
+
+
+def read_binary_stream(stream, include_audio=False):
+    """Yield (camera, seq, timestamp, detections) from a binary detection stream
+
+    Acoustic events are skipped unless include_audio, then they come as
+    (audio index, seq, timestamp, ACOUSTIC_DTYPE array).
+    """
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        magic, index, seq, timestamp, count = FRAME_HEADER.unpack(header)
+        if magic == FRAME_MAGIC:
+            dtype = DETECTION_LE
+        elif magic == AUDIO_MAGIC:
+            dtype = acoustic_dtype()
+        else:
+            raise ValueError("Not a detection stream (bad frame magic)")
+        payload = stream.read(count * dtype.itemsize)
+        if magic == FRAME_MAGIC or include_audio:
+            yield index, seq, timestamp, np.frombuffer(payload, dtype)
+
+
+class CaptureThread(threading.Thread):
+    """Qt-free counterpart of CameraThread: captures a source into a FrameRing"""
+
+    def __init__(self, source, camera_index, on_frame, num_slots=3, open_timeout=5.0):
+        super().__init__(daemon=True)
+        self.source = create_source(source)
+        self.camera_index = camera_index
+        self.on_frame = on_frame
+        self.num_slots = num_slots
+        self.open_timeout = open_timeout
+        self.ring = None
+        self.ready = threading.Event()
+        self.finished = False
+        self.running = False
+
+    def run(self):
+        try:
+            if not open_with_timeout(self.source, self.open_timeout):
+                return
+            ret, frame = self.source.read()
+            if not ret:
+                print(f"No frames from {self.source.name}", file=sys.stderr)
+                return
+            self.ring = FrameRing(self.num_slots, [('frame', frame.shape, frame.dtype)],
+                                  frame_format=self.source.frame_format)
+            slot = self.ring.begin_write()
+            np.copyto(self.ring.frame(slot), frame)
+            seq = self.ring.end_write(slot, time.time())
+            self.ready.set()
+            self.on_frame(self.camera_index, seq)
+
+            self.running = True
+            while self.running:
+                slot = self.ring.begin_write()
+                if self.source.read_into(self.ring.frame(slot)):
+                    self.on_frame(self.camera_index, self.ring.end_write(slot, time.time()))
+                else:
+                    self.ring.abort_write(slot)
+                    if not self.source.is_live:
+                        break
+            self.source.release()
+        finally:
+            self.finished = True
+            self.ready.set()
+            self.on_frame(self.camera_index, -1)
+
+    def stop(self):
+        self.running = False
+
+
+class HeadlessService:
+    """Capture threads plus one processing loop that streams detections"""
+
+    def __init__(self, sources, writer, detector_kwargs=None, target_latency_ms=100.0,
+                 all_frames=False, max_frames=None, metrics_file=None, metrics_port=None,
+                 recorder=None, open_timeout=5.0, audio_sources=None, audio_kwargs=None,
+                 classifier=None):
+        self.writer = writer
+        self.all_frames = all_frames
+        self.max_frames = max_frames
+        self.new_frame = threading.Event()
+        self.running = False
+        num_cameras = len(sources)
+        # Every source opens in its own capture thread, so they open in parallel
+        self.captures = [CaptureThread(source, i, self._on_frame, open_timeout=open_timeout)
+                         for i, source in enumerate(sources)]
+        self.detectors = [create_detector(**(detector_kwargs or {})) for _ in range(num_cameras)]
+        self.metrics = PipelineMetrics(num_cameras)
+        scale_control = not (detector_kwargs or {}).get('latency_budget_ms')
+        self.scheduler = LoadScheduler(num_cameras, target_latency_ms,
+                                       detectors=self.detectors if scale_control else None)
+        self.metrics.sections['scheduler'] = self.scheduler.snapshot
+        self.recorder = recorder
+        if recorder:
+            self.metrics.sections['recorder'] = recorder.stats
+        # Optional ClassifierStage, one batch over the candidates of all cameras per tick
+        self.classifier = classifier
+        if classifier:
+            self.metrics.sections['classifier'] = classifier.snapshot
+        # Acoustic detectors run in their own threads and write events as they happen
+        self.audio = []
+        if audio_sources:
+            from acoustic import AcousticThread
+            self.audio = [AcousticThread(source, i, writer.write_event, audio_kwargs)
+                          for i, source in enumerate(audio_sources)]
+        if self.audio:
+            self.metrics.sections['audio'] = lambda: [thread.snapshot() for thread in self.audio]
+        self.exporter = MetricsExporter(self.metrics, path=metrics_file, port=metrics_port)
+        self.result_rings = [None] * num_cameras
+        self.last_seqs = [-1] * num_cameras
+        self.processed = 0
+        # time.time() of the first captured frame and the first result (startup benchmark)
+        self.first_frame_time = None
+        self.first_result_time = None
+
+    def _on_frame(self, camera_index, seq):
+        if seq >= 0 and self.first_frame_time is None:
+            self.first_frame_time = time.time()
+        self.new_frame.set()
+
+    def stop(self):
+        self.running = False
+        self.new_frame.set()
+
+    def run(self):
+        """Process until all sources ended, max_frames were processed or stop() was called"""
+        self.exporter.start()
+        if self.recorder:
+            self.recorder.start()
+        for capture in self.captures:
+            capture.start()
+        for thread in self.audio:
+            thread.start()
+        self.running = True
+        try:
+            self._loop()
+        finally:
+            for capture in self.captures:
+                capture.stop()
+            for thread in self.audio:
+                thread.stop()
+            for thread in self.audio:
+                thread.join(timeout=2.0)
+            for capture in self.captures:
+                capture.join(timeout=2.0)
+            self.exporter.stop()
+            if self.recorder:
+                self.recorder.stop()
+            for ring in self.result_rings:
+                if ring is not None:
+                    ring.close()
+            for capture in self.captures:
+                if capture.ring is not None:
+                    capture.ring.close()
+
+    def _loop(self):
+        while self.running:
+            if all(capture.finished for capture in self.captures):
+                # Process what is still in the rings before stopping
+                self.running = False
+            elif not self.new_frame.wait(timeout=0.1):
+                continue
+            self.new_frame.clear()
+
+            done = []  # Frames processed this tick, published together after the classifier
+            for camera_index in self.scheduler.order():
+                frames = self.captures[camera_index].ring
+                if frames is None:
+                    continue
+                if self.result_rings[camera_index] is None:
+                    self.result_rings[camera_index] = make_result_ring(frames, num_slots=2)
+                if not self.scheduler.should_process(camera_index, frames.latest()[1]):
+                    continue
+                # The annotated BGR frame is only needed for the recorder
+                status, slot, seq, timestamp, started, finished, count = process_latest(
+                    self.detectors[camera_index], frames, self.result_rings[camera_index],
+                    self.last_seqs[camera_index], self.scheduler.max_age, annotate=self.recorder is not None)
+                if status == 'none':
+                    continue
+                last = self.last_seqs[camera_index]
+                if last >= 0:
+                    shed, superseded = self.scheduler.split_gap(camera_index, seq - last - 1)
+                    self.metrics.drop(camera_index, 'shed', shed)
+                    self.metrics.drop(camera_index, 'superseded', superseded)
+                self.last_seqs[camera_index] = seq
+                if status != 'ok':
+                    self.metrics.drop(camera_index, status)
+                    continue
+
+                self.metrics.processed_frame(camera_index, timestamp, started, finished,
+                                             frames.latest()[1] - seq)
+                self.scheduler.record(camera_index, seq, timestamp, started, finished, count)
+                detections = self.detectors[camera_index].last_detections
+                if self.classifier and count:
+                    # Crop from the captured frame, unless capture reused its slot meanwhile
+                    frame_slot = frames.find(seq)
+                    if frame_slot >= 0:
+                        self.classifier.add(camera_index, frames.frame(frame_slot), detections,
+                                            frames.frame_format)
+                    if frame_slot < 0 or not frames.valid(frame_slot, seq):
+                        self.classifier.discard(camera_index)
+                done.append((camera_index, slot, seq, timestamp, finished, detections))
+            if done and not self._publish(done):
+                return
+
+    def _publish(self, done):
+        """Classify the candidates of the tick, then record and write; False once max_frames is reached"""
+        keep = self.classifier.run() if self.classifier else {}
+        for camera_index, slot, seq, timestamp, finished, candidates in done:
+            detections = candidates[keep[camera_index]] if camera_index in keep else candidates
+            if self.recorder:
+                frame = self.result_rings[camera_index].plane(slot, 'frame')
+                if camera_index in keep:
+                    from classifier import mark_rejected
+                    mark_rejected(frame, candidates, keep[camera_index])
+                self.recorder.push(camera_index, frame, timestamp, len(detections))
+            if len(detections) or self.all_frames:
+                self.writer.write(camera_index, seq, timestamp, detections)
+            self.processed += 1
+            if self.first_result_time is None:
+                self.first_result_time = finished
+            if self.max_frames and self.processed >= self.max_frames:
+                self.running = False
+                return False
+        return True
+
+
+def _child_startup(kind, source):
+    """Runs in a fresh interpreter: startup phases since the parent spawned it"""
+    spawned = float(os.environ.get('STARTUP_T0', time.time()))
+    phases = {}
+    if kind == 'gui':
+        import camera_window
+        from PyQt6.QtCore import QTimer
+        from PyQt6.QtWidgets import QApplication
+        phases['imports_s'] = time.time() - spawned
+        app = QApplication([])
+        window = camera_window.OptimizedCameraWindow([source], detector_kwargs={})
+        for thread in window.camera_threads:
+            thread.ringReady.connect(lambda *args: phases.setdefault('first_frame_s', time.time() - spawned))
+        window.processing_thread.processedFrameReady.connect(lambda *args: app.quit())
+        QTimer.singleShot(30000, app.quit)
+        app.exec()
+        phases['first_result_s'] = time.time() - spawned
+    else:
+        phases['imports_s'] = time.time() - spawned
+        service = HeadlessService([source], DetectionWriter(os.devnull), max_frames=1)
+        service.run()
+        phases['first_frame_s'] = (service.first_frame_time or time.time()) - spawned
+        phases['first_result_s'] = (service.first_result_time or time.time()) - spawned
+    # ru_maxrss is in KiB on Linux
+    phases['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(phases), flush=True)
+    if kind == 'gui':
+        window.close()
+
+
+def compare_startup(source='synthetic', runs=3):
+    """Time to first processed frame and peak RSS of fresh GUI and headless processes
+
+    Phases are measured from the moment the process is spawned: imports done,
+    first captured frame, first processed frame.
+    """
+    env = dict(os.environ)
+    if not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    results = {}
+    print(f"{'':<9} {'imports':>8} {'1st frame':>10} {'1st result':>11} {'peak RSS':>9}", file=sys.stderr)
+    for kind in ('gui', 'headless'):
+        samples = []
+        for _ in range(runs):
+            env['STARTUP_T0'] = repr(time.time())
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child-startup', kind, '--source', source],
+                capture_output=True, text=True, env=env).stdout
+            lines = [line for line in output.splitlines() if line.startswith('{')]
+            if not lines:
+                print(f"{kind}: no result", file=sys.stderr)
+                break
+            samples.append(json.loads(lines[-1]))
+        if samples:
+            result = {key: float(np.median([s[key] for s in samples])) for key in samples[0]}
+            results[kind] = result
+            print(f"{kind:<9} {result['imports_s'] * 1000:>6.0f}ms {result['first_frame_s'] * 1000:>8.0f}ms "
+                  f"{result['first_result_s'] * 1000:>9.0f}ms {result['rss_mb']:>7.0f}MB", file=sys.stderr)
+    return results
+
+
+def camera_scaling(counts=(1, 2, 4, 8), duration=5.0, source='synthetic', target_latency_ms=100.0,
+                   detector_kwargs=None):
+    """Per-camera FPS and latency with 1..N cameras at their real frame rate"""
+    print(f"{'cameras':>7} {'fps/cam':>8} {'min fps':>8} {'total':>7} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'shed':>6} {'superseded':>10}", file=sys.stderr)
+    # Replayed from memory: generating or decoding 8 streams would measure the sources
+    clip = MemorySource.preload(source)
+    results = []
+    for count in counts:
+        sources = [MemorySource(clip.frames, clip.fps, offset=i * 7) for i in range(count)]
+        service = HeadlessService(sources, DetectionWriter(os.devnull), detector_kwargs, target_latency_ms)
+        timer = threading.Timer(duration, service.stop)
+        timer.start()
+        service.run()
+        cameras = service.metrics.snapshot()['cameras']
+        fps = [camera['processed'] / duration for camera in cameras]
+        latency = [camera['latency_ms']['capture_to_result'] for camera in cameras]
+        result = {
+            'cameras': count,
+            'fps_per_camera': fps,
+            'p50_ms': float(np.mean([lat['p50'] for lat in latency])),
+            'p95_ms': float(np.max([lat['p95'] for lat in latency])),
+            'shed': sum(camera['drops']['shed'] for camera in cameras),
+            'superseded': sum(camera['drops']['superseded'] for camera in cameras),
+        }
+        results.append(result)
+        print(f"{count:>7} {np.mean(fps):>8.1f} {min(fps):>8.1f} {sum(fps):>7.1f} {result['p50_ms']:>7.0f} "
+              f"{result['p95_ms']:>7.0f} {result['shed']:>6} {result['superseded']:>10}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless drone detection service (no Qt)")
+    parser.add_argument('--source', action='append', default=[],
+                        help="Frame source: camera id, v4l2:N, picam:N, video:FILE, images:DIR, mjpeg:FILE, "
+                             "yuyv:FILE, nv12:FILE or synthetic[:N]")
+    parser.add_argument('--output', default='-',
+                        help="'-' for stdout, a file, tcp:HOST:PORT or unix:PATH (default stdout)")
+    parser.add_argument('--format', choices=['ndjson', 'binary'], default='ndjson')
+    parser.add_argument('--all-frames', action='store_true', help="Also write frames without detections")
+    parser.add_argument('--frames', type=int, help="Stop after this many processed frames")
+    parser.add_argument('--fast', action='store_true',
+                        help="Read file sources as fast as possible instead of at their recorded rate")
+    parser.add_argument('--loop', action='store_true', help="Loop file sources")
+    parser.add_argument('--capture-format', default='bgr', metavar='FMT',
+                        help="Camera format: bgr, mjpg, yuyv, nv12, a list like mjpg,yuyv or auto")
+    parser.add_argument('--gray', action='store_true',
+                        help="Capture only the Y plane / decode JPEGs to grayscale (detection needs no colour)")
+    parser.add_argument('--decode-threads', type=int, metavar='N', help="JPEG decode threads (default: CPU count)")
+    parser.add_argument('--detect-scale', type=float)
+    parser.add_argument('--latency-budget', type=float, metavar='MS')
+    parser.add_argument('--track', action='store_true')
+    parser.add_argument('--background', choices=BACKGROUND_ENGINES, default='mog2')
+    parser.add_argument('--night', choices=NIGHT_MODES, help="Low-light stage ('auto' switches on brightness)")
+    parser.add_argument('--tile-size', type=int, metavar='PX', help="Change-gated tiles of this size (e.g. 64)")
+    parser.add_argument('--target-latency', type=float, default=100.0, metavar='MS')
+    parser.add_argument('--open-timeout', type=float, default=5.0, metavar='S',
+                        help="Give up on a source that does not open within S seconds")
+    parser.add_argument('--record', metavar='DIR', help="Save clips around detections into this folder")
+    parser.add_argument('--pre-roll', type=float, default=3.0, metavar='S')
+    parser.add_argument('--post-roll', type=float, default=3.0, metavar='S')
+    parser.add_argument('--record-memory', type=float, default=64, metavar='MB')
+    parser.add_argument('--audio', action='append', default=[], metavar='SPEC',
+                        help="Acoustic detection on wav:FILE, device or device:N (events go to --output)")
+    parser.add_argument('--audio-channels', type=int, default=1)
+    parser.add_argument('--audio-rate', type=int, default=48000)
+    parser.add_argument('--classifier', metavar='MODEL',
+                        help="Reject candidates with this cv2.dnn model (drone vs clutter, softmax output)")
+    parser.add_argument('--classifier-config', metavar='PATH', help="Network config, e.g. a Darknet .cfg")
+    parser.add_argument('--classifier-size', type=int, default=64, help="Network input size (default 64)")
+    parser.add_argument('--classifier-class', type=int, default=1, help="Output index of the drone class")
+    parser.add_argument('--classifier-threshold', type=float, default=0.5)
+    parser.add_argument('--classifier-budget', type=float, default=10.0, metavar='MS',
+                        help="Classification time per tick the batch size is chosen for")
+    parser.add_argument('--metrics-file', metavar='PATH')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT')
+    parser.add_argument('--compare-startup', action='store_true',
+                        help="Measure cold start and RSS of the GUI and the headless build")
+    parser.add_argument('--camera-scaling', metavar='N,N,...',
+                        help="Per-camera FPS and latency with this many copies of the (first) source")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds per --camera-scaling step")
+    parser.add_argument('--child-startup', choices=['gui', 'headless'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_startup:
+        _child_startup(args.child_startup, args.source[0] if args.source else 'synthetic')
+        return
+    if args.compare_startup:
+        compare_startup(args.source[0] if args.source else 'synthetic')
+        return
+    if args.camera_scaling:
+        counts = [int(n) for n in args.camera_scaling.split(',')]
+        camera_scaling(counts, args.duration, args.source[0] if args.source else 'synthetic',
+                       args.target_latency, {'detection_scale': args.detect_scale, 'track': args.track,
+                        'background': args.background})
+        return
+
+    writer = DetectionWriter(args.output, args.format)
+    if args.output == '-':
+        # The stream owns stdout, everything else that prints goes to stderr
+        sys.stdout = sys.stderr
+    specs = args.source or detect_camera_ids()
+    # The optional stages are only imported when they are asked for
+    decoder = None
+    if (args.decode_threads or args.capture_format == 'auto' or 'mjpg' in args.capture_format.split(',')
+            or any(str(spec).startswith('mjpeg:') for spec in specs)):
+        from capture_formats import JpegDecodePool
+        decoder = JpegDecodePool(args.decode_threads, gray=args.gray)
+    sources = [create_source(spec, realtime=not args.fast, loop=args.loop, capture_format=args.capture_format,
+                             gray=args.gray, decoder=decoder) for spec in specs]
+    detector_kwargs = {
+        'detection_scale': args.detect_scale,
+        'latency_budget_ms': args.latency_budget,
+        'track': args.track,
+        'background': args.background,
+        'night': args.night,
+        'tile_size': args.tile_size,
+    }
+    recorder = None
+    if args.record:
+        from recorder import ClipRecorder
+        recorder = ClipRecorder(args.record, args.pre_roll, args.post_roll, args.record_memory)
+    classifier = None
+    if args.classifier:
+        from classifier import ClassifierStage, RoiClassifier
+        classifier = ClassifierStage(RoiClassifier(args.classifier, args.classifier_config, args.classifier_size,
+                                                   args.classifier_class, args.classifier_threshold),
+                                     args.classifier_budget)
+    audio_sources = []
+    if args.audio:
+        from acoustic import create_audio_source
+        audio_sources = [create_audio_source(spec, sample_rate=args.audio_rate, channels=args.audio_channels,
+                                             realtime=not args.fast, loop=args.loop) for spec in args.audio]
+    service = HeadlessService(sources, writer, detector_kwargs, args.target_latency,
+                              all_frames=args.all_frames, max_frames=args.frames,
+                              metrics_file=args.metrics_file, metrics_port=args.metrics_port,
+                              recorder=recorder, open_timeout=args.open_timeout,
+                              audio_sources=audio_sources,
+                              classifier=classifier)
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        service.stop()
+    finally:
+        writer.close()
+    print(f"Processed {service.processed} frames, wrote {writer.records} records"
+          + (f" and {writer.audio_events} acoustic events" if args.audio else ""), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# End-to-end latency metrics for the capture -> process -> display pipeline
+# Every frame carries its capture timestamp; processing start/end and display
+# time are added along the way and feed fixed-bucket histograms per camera.
+# Dropped frames are counted per reason, frames-behind is kept as queue depth.
+# The numbers can be written to a JSON file periodically and/or served on a
+# local HTTP endpoint (Prometheus text at /metrics, JSON at /metrics.json).
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Histogram bucket upper bounds in ms (log spaced, 0.1 ms .. 10 s)
+BUCKETS_MS = np.geomspace(0.1, 10000, 51)
+
+# Latencies measured per frame
+LATENCIES = (
+    'queue_wait',       # capture -> processing start
+    'processing',       # processing start -> end
+    'capture_to_result',
+    'glass_to_glass',   # capture -> first time on screen
+)
+
+# Reasons a frame never made it to the screen
+DROP_REASONS = (
+    'superseded',       # a newer frame was captured before processing got to it
+    'stale',            # older than the max-age check when processing started
+    'torn',             # overwritten in the ring while being read
+    'not_displayed',    # processed, but replaced before the display redrew
+    'shed',             # skipped on purpose by the load scheduler
+)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (ms) with count, sum and max"""
+
+    def __init__(self):
+        self.counts = np.zeros(len(BUCKETS_MS) + 1, np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[np.searchsorted(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """Upper bucket bound below which p percent of the observations fall"""
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * p / 100.0))
+        if index >= len(BUCKETS_MS):
+            return self.max
+        return float(min(BUCKETS_MS[index], self.max))
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class PipelineMetrics:
+    """Per-camera latency histograms, drop counters and queue depth (thread safe)"""
+
+    def __init__(self, num_cameras):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.num_cameras = num_cameras
+        self.histograms = [{name: LatencyHistogram() for name in LATENCIES} for _ in range(num_cameras)]
+        self.drops = [dict.fromkeys(DROP_REASONS, 0) for _ in range(num_cameras)]
+        self.processed = [0] * num_cameras
+        self.displayed = [0] * num_cameras
+        self.queue_depth = [0] * num_cameras
+        # Extra snapshot sections: name -> function returning JSON-friendly data
+        self.sections = {}
+
+    def processed_frame(self, camera_index, captured, started, finished, frames_behind=0):
+        """A frame was processed; times are time.time() values"""
+        with self.lock:
+            hist = self.histograms[camera_index]
+            hist['queue_wait'].observe((started - captured) * 1000)
+            hist['processing'].observe((finished - started) * 1000)
+            hist['capture_to_result'].observe((finished - captured) * 1000)
+            self.processed[camera_index] += 1
+            self.queue_depth[camera_index] = frames_behind
+
+    def displayed_frame(self, camera_index, captured, shown=None):
+        with self.lock:
+            shown = shown or time.time()
+            self.histograms[camera_index]['glass_to_glass'].observe((shown - captured) * 1000)
+            self.displayed[camera_index] += 1
+
+    def drop(self, camera_index, reason, count=1):
+        if count <= 0:
+            return
+        with self.lock:
+            self.drops[camera_index][reason] += count
+
+    def snapshot(self):
+        """All metrics as a JSON-friendly dict"""
+        with self.lock:
+            cameras = []
+            for i in range(self.num_cameras):
+                cameras.append({
+                    'camera': i,
+                    'processed': self.processed[i],
+                    'displayed': self.displayed[i],
+                    'queue_depth': self.queue_depth[i],
+                    'drops': dict(self.drops[i]),
+                    'latency_ms': {name: h.summary() for name, h in self.histograms[i].items()},
+                })
+        snapshot = {'time': time.time(), 'uptime_s': time.time() - self.start_time, 'cameras': cameras}
+        for name, section in self.sections.items():
+            snapshot[name] = section()
+        return snapshot
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines.append('# TYPE drone_frames_processed_total counter')
+            for i in range(self.num_cameras):
+                lines.append(f'drone_frames_processed_total{{camera="{i}"}} {self.processed[i]}')
+            lines.append('# TYPE drone_frames_dropped_total counter')
+            for i in range(self.num_cameras):
+                for reason, count in self.drops[i].items():
+                    lines.append(f'drone_frames_dropped_total{{camera="{i}",reason="{reason}"}} {count}')
+            lines.append('# TYPE drone_queue_depth gauge')
+            for i in range(self.num_cameras):
+                lines.append(f'drone_queue_depth{{camera="{i}"}} {self.queue_depth[i]}')
+            for name in LATENCIES:
+                metric = f'drone_{name}_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                for i in range(self.num_cameras):
+                    hist = self.histograms[i][name]
+                    cumulative = np.cumsum(hist.counts)
+                    for bound, count in zip(BUCKETS_MS, cumulative):
+                        lines.append(f'{metric}_bucket{{camera="{i}",le="{bound / 1000:.6g}"}} {count}')
+                    lines.append(f'{metric}_bucket{{camera="{i}",le="+Inf"}} {hist.count}')
+                    lines.append(f'{metric}_sum{{camera="{i}"}} {hist.total / 1000:.6f}')
+                    lines.append(f'{metric}_count{{camera="{i}"}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary_line(self):
+        """Short text for the GUI performance label"""
+        parts = []
+        with self.lock:
+            for i in range(self.num_cameras):
+                g2g = self.histograms[i]['glass_to_glass']
+                dropped = sum(self.drops[i].values())
+                parts.append(f"Cam{i + 1} g2g p50={g2g.percentile(50):.0f}ms "
+                             f"p95={g2g.percentile(95):.0f}ms drops={dropped}")
+        return " | ".join(parts)
+
+
+class MetricsExporter:
+    """Writes metrics to a JSON file every interval and/or serves them over HTTP"""
+
+    def __init__(self, metrics, path=None, port=None, interval=1.0, host='127.0.0.1'):
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.path:
+            self.thread = threading.Thread(target=self._write_loop, daemon=True)
+            self.thread.start()
+        if self.port:
+            # Imported here: http.server pulls in the email package and is only
+            # needed when metrics are served, which is a noticeable part of startup
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == '/metrics':
+                        body = metrics.prometheus().encode()
+                        content_type = 'text/plain; version=0.0.4'
+                    elif self.path == '/metrics.json':
+                        body = json.dumps(metrics.snapshot()).encode()
+                        content_type = 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # Keep the console quiet
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Metrics on http://{self.host}:{self.port}/metrics")
+
+    def write(self):
+        # Write next to the target and rename, readers never see a half file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.path:
+            self.write()
+        if self.server:
+            self.server.shutdown()
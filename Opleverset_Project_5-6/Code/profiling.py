@@ -0,0 +1,36 @@
+# Lightweight per-stage timing for the processing pipelines
+# A StageTimer is started at the beginning of a frame and marked after every
+# stage; NULL_TIMER lets pipeline code call mark() unconditionally.
+
+import time
+
+
+class StageTimer:
+    """Collects the duration of each pipeline stage of one frame in ms"""
+
+    def __init__(self):
+        self.stages = {}
+        self.start_time = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """End the current stage; time since the previous mark is booked on stage"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def total(self):
+        return (self._last - self.start_time) * 1000
+
+
+class _NullTimer:
+    """Timer that records nothing"""
+    stages = {}
+
+    def mark(self, stage):
+        pass
+
+    def total(self):
+        return 0.0
+
+
+NULL_TIMER = _NullTimer()
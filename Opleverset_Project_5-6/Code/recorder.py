@@ -0,0 +1,286 @@
+# Event-triggered clip recording
+# Every processed (annotated) frame is JPEG-compressed into a per-camera ring
+# that holds the last few seconds (the pre-roll). When a frame has detections
+# the pre-roll and everything up to post_roll seconds after the last detection
+# is written to disk as a clip folder with numbered JPEGs and a timestamps.txt,
+# which plays back with --source images:<clip folder>.
+#
+# The processing loop only copies the frame into a free buffer (or drops it when
+# none is free); encoding and disk writes run on background threads. The frame
+# buffers, the compressed rings and the pending writes together are capped at
+# max_memory_mb.
+#
+# Test: python recorder.py --frames 300
+
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class Clip:
+    """One clip folder being written"""
+
+    def __init__(self, path, camera_index):
+        self.path = path
+        self.camera_index = camera_index
+        self.frames = 0
+        self.timestamps = None  # Opened by the writer thread
+
+
+class ClipRecorder:
+    """Per-camera compressed pre-roll rings and background clip writing
+
+    pre_roll/post_roll: seconds kept before the first and after the last detection.
+    max_memory_mb: cap on everything the recorder holds in memory: the raw frame
+    buffers for the encoder, the compressed rings and the writes that did not
+    reach the disk yet. The oldest pre-roll frames go first; a frame that
+    would need a new buffer beyond the cap is dropped.
+    max_pending: frames waiting for the encoder, more are dropped.
+    """
+
+    def __init__(self, output_dir='clips', pre_roll=3.0, post_roll=3.0, max_memory_mb=64,
+                 jpeg_quality=80, max_pending=8):
+        self.output_dir = output_dir
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.max_pending = max_pending
+
+        # Frame buffers shared with the encoder: free ones and ones waiting to be encoded
+        self.free_buffers = []
+        self.buffers = 0
+        self.buffer_bytes = 0
+        self.encode_queue = queue.Queue()
+        self.write_queue = queue.Queue()
+        self.lock = threading.Lock()
+
+        # Encoder thread state
+        self.rings = {}           # camera -> deque of (timestamp, jpeg bytes)
+        self.clips = {}           # camera -> open Clip
+        self.record_until = {}    # camera -> timestamp the open clip ends
+        self.ring_bytes = 0
+        self.pending_write_bytes = 0
+
+        self.counters = {'pushed': 0, 'dropped': 0, 'evicted': 0, 'clips': 0, 'frames_written': 0}
+        self.encode_ms = 0.0
+        self.threads = []
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.threads = [threading.Thread(target=self._encode_loop, daemon=True),
+                        threading.Thread(target=self._write_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def push(self, camera_index, frame, timestamp, detections=0):
+        """Hand a processed frame to the recorder, never blocks
+
+        Returns False if the frame was dropped because the encoder is behind.
+        """
+        with self.lock:
+            buffer = None
+            for i, candidate in enumerate(self.free_buffers):
+                if candidate.shape == frame.shape:
+                    buffer = self.free_buffers.pop(i)
+                    break
+            while buffer is None and self.free_buffers and (
+                    self.buffers >= self.max_pending or self.buffer_bytes + frame.nbytes > self.max_bytes):
+                # Make room by releasing an idle buffer of another frame size
+                unused = self.free_buffers.pop(0)
+                self.buffers -= 1
+                self.buffer_bytes -= unused.nbytes
+            if (buffer is None and self.buffers < self.max_pending
+                    and self.buffer_bytes + frame.nbytes <= self.max_bytes):
+                self.buffers += 1
+                self.buffer_bytes += frame.nbytes
+                buffer = np.empty_like(frame)
+            if buffer is None:
+                self.counters['dropped'] += 1
+                return False
+            self.counters['pushed'] += 1
+        np.copyto(buffer, frame)
+        self.encode_queue.put((camera_index, buffer, timestamp, detections))
+        return True
+
+    def _encode_loop(self):
+        while True:
+            item = self.encode_queue.get()
+            if item is None:
+                break
+            camera_index, buffer, timestamp, detections = item
+            start = time.perf_counter()
+            ok, data = cv2.imencode('.jpg', buffer, self.encode_params)
+            self.encode_ms = 0.9 * self.encode_ms + 0.1 * (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.free_buffers.append(buffer)
+            if ok:
+                self._add_frame(camera_index, timestamp, data.tobytes(), detections)
+        # Close what is still open, the writer stops after these
+        for camera_index in list(self.clips):
+            self._close_clip(camera_index)
+        self.write_queue.put(None)
+
+    def _add_frame(self, camera_index, timestamp, data, detections):
+        ring = self.rings.setdefault(camera_index, deque())
+        clip = self.clips.get(camera_index)
+
+        if clip is not None and timestamp > self.record_until[camera_index]:
+            self._close_clip(camera_index)
+            clip = None
+        if detections:
+            if clip is None:
+                clip = self._open_clip(camera_index, timestamp)
+                # Pre-roll: everything still in the ring goes into the clip first
+                for old_timestamp, old_data in ring:
+                    self._queue_write(clip, old_timestamp, old_data)
+            self.record_until[camera_index] = timestamp + self.post_roll
+        if clip is not None:
+            self._queue_write(clip, timestamp, data)
+
+        ring.append((timestamp, data))
+        with self.lock:
+            self.ring_bytes += len(data)
+        while ring and timestamp - ring[0][0] > self.pre_roll:
+            self._evict(ring)
+        self._enforce_memory_cap()
+
+    def _evict(self, ring):
+        _, data = ring.popleft()
+        with self.lock:
+            self.ring_bytes -= len(data)
+
+    def _enforce_memory_cap(self):
+        """Drop the oldest pre-roll frames of the largest ring until under the cap"""
+        while self.buffer_bytes + self.ring_bytes + self.pending_write_bytes > self.max_bytes:
+            ring = max(self.rings.values(), key=len)
+            if not ring:
+                break  # Only writes in flight, they are released as the disk catches up
+            self._evict(ring)
+            self.counters['evicted'] += 1
+
+    def _open_clip(self, camera_index, timestamp):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        path = os.path.join(self.output_dir, f"cam{camera_index + 1}_{stamp}_{int(timestamp * 1000) % 1000:03d}")
+        clip = Clip(path, camera_index)
+        with self.lock:
+            self.clips[camera_index] = clip
+        self.write_queue.put(('open', clip, None, None))
+        return clip
+
+    def _close_clip(self, camera_index):
+        with self.lock:
+            clip = self.clips.pop(camera_index)
+        self.record_until.pop(camera_index, None)
+        self.write_queue.put(('close', clip, None, None))
+
+    def _queue_write(self, clip, timestamp, data):
+        with self.lock:
+            self.pending_write_bytes += len(data)
+        self.write_queue.put(('frame', clip, timestamp, data))
+
+    def _write_loop(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            action, clip, timestamp, data = item
+            try:
+                if action == 'open':
+                    os.makedirs(clip.path, exist_ok=True)
+                    clip.timestamps = open(os.path.join(clip.path, 'timestamps.txt'), 'w')
+                    print(f"Recording clip {clip.path}")
+                elif clip.timestamps is None:
+                    pass  # The clip could not be opened, its frames are dropped
+                elif action == 'frame':
+                    with open(os.path.join(clip.path, f"frame_{clip.frames:06d}.jpg"), 'wb') as f:
+                        f.write(data)
+                    clip.timestamps.write(f"{timestamp:.6f}\n")
+                    clip.frames += 1
+                    self.counters['frames_written'] += 1
+                else:
+                    clip.timestamps.close()
+                    self.counters['clips'] += 1
+                    print(f"Saved clip {clip.path} ({clip.frames} frames)")
+            except Exception as e:
+                # Keep the writer alive, otherwise the pending writes never drain
+                print(f"Clip write failed: {e}")
+            finally:
+                if data is not None:
+                    with self.lock:
+                        self.pending_write_bytes -= len(data)
+
+    def memory_mb(self):
+        return (self.buffer_bytes + self.ring_bytes + self.pending_write_bytes) / (1024 * 1024)
+
+    def stats(self):
+        """Counters and memory use as a JSON-friendly dict"""
+        with self.lock:
+            stats = dict(self.counters)
+            recording = sorted(camera_index + 1 for camera_index in self.clips)
+        stats['memory_mb'] = self.memory_mb()
+        stats['max_memory_mb'] = self.max_bytes / (1024 * 1024)
+        stats['encode_ms'] = self.encode_ms
+        stats['recording'] = recording
+        return stats
+
+    def summary_line(self):
+        """Short text for the GUI performance label"""
+        stats = self.stats()
+        recording = ", REC cam " + ",".join(map(str, stats['recording'])) if stats['recording'] else ""
+        return (f"Recorder: {stats['memory_mb']:.1f}/{stats['max_memory_mb']:.0f}MB, "
+                f"{stats['clips']} clips, dropped {stats['dropped']}, evicted {stats['evicted']}{recording}")
+
+    def stop(self):
+        """Finish pending frames and close open clips"""
+        if not self.threads:
+            return
+        self.encode_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+def main():
+    from detection import create_detector
+    from frame_sources import SyntheticSource
+
+    parser = argparse.ArgumentParser(description="Record detection clips from a synthetic scene")
+    parser.add_argument('--output', default='clips')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--pre-roll', type=float, default=2.0)
+    parser.add_argument('--post-roll', type=float, default=2.0)
+    parser.add_argument('--memory', type=float, default=64, metavar='MB')
+    args = parser.parse_args()
+
+    source = SyntheticSource(realtime=False)
+    source.open()
+    detector = create_detector()
+    recorder = ClipRecorder(args.output, args.pre_roll, args.post_roll, args.memory)
+    recorder.start()
+    push_ms = []
+    for i in range(args.frames):
+        ret, frame = source.read()
+        if not ret:
+            break
+        annotated = detector.process(frame)[0]
+        # The synthetic drones never leave, so only every other 3 s window counts as an event
+        detections = len(detector.last_detections) if (i // 90) % 2 else 0
+        # Media time, so the clips span the same time as at 30 fps
+        start = time.perf_counter()
+        recorder.push(0, annotated, source.timestamp, detections)
+        push_ms.append((time.perf_counter() - start) * 1000)
+    recorder.stop()
+    print(recorder.summary_line())
+    print(f"push: mean {np.mean(push_ms):.3f}ms, max {np.max(push_ms):.3f}ms; "
+          f"encode {recorder.encode_ms:.2f}ms per frame in the background")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# Adaptive load shedding for the processing stage
+# Instead of throwing away every frame older than a fixed age, the scheduler
+# measures what each camera costs (processing time per frame and frame rate)
+# and decides, per camera, how many frames to skip (stride) and at which
+# detection scale to run, so the capture-to-result latency stays within a
+# target. Cameras with active detections are served first: idle cameras are
+# shed (and downscaled) before a camera that currently sees a target.
+
+import threading
+import time
+
+from detection import DETECTION_SCALES
+
+# Cameras count as active for this long after their last detection
+ACTIVE_HOLD_S = 2.0
+
+# Smallest time between two scale changes of one camera (a new scale restarts
+# the background model, so flipping back and forth would hurt detection)
+SCALE_DWELL_S = 5.0
+
+
+class CameraLoad:
+    """Measured load and current decision for one camera"""
+
+    def __init__(self):
+        self.cost_ms = None           # EWMA processing time per frame
+        self.interval_s = None        # EWMA time between captured frames
+        self.latency_ms = 0.0         # EWMA capture-to-result latency
+        self.stride = 1               # Process every stride-th frame
+        self.scale_index = 0          # Index into DETECTION_SCALES
+        self.last_seq = -1
+        self.last_timestamp = None
+        self.last_active = 0.0
+        self.last_scale_change = 0.0
+        self.shed = 0
+        self.reason = 'warming up'
+
+    def active(self, now):
+        return now - self.last_active < ACTIVE_HOLD_S
+
+    def utilization(self):
+        """Fraction of one core this camera needs at its current stride"""
+        if self.cost_ms is None or not self.interval_s:
+            return 0.0
+        return self.cost_ms / 1000 / (self.interval_s * self.stride)
+
+
+class LoadScheduler:
+    """Per-camera skip ratio and detection scale to meet a latency target
+
+    parallel: every camera has its own worker (CameraWorkerPool), so the
+    limits apply per camera instead of to the sum over all cameras.
+    detectors: detectors whose detection_scale the scheduler may change
+    (None = only skip frames, e.g. when the detectors live in worker processes).
+    """
+
+    def __init__(self, num_cameras, target_latency_ms=50.0, detectors=None, parallel=False,
+                 max_utilization=0.85, max_stride=8, rebalance_interval=0.5):
+        self.target_latency_ms = target_latency_ms
+        self.detectors = detectors
+        self.parallel = parallel
+        self.max_utilization = max_utilization
+        self.max_stride = max_stride
+        self.rebalance_interval = rebalance_interval
+        self.cameras = [CameraLoad() for _ in range(num_cameras)]
+        self.lock = threading.Lock()
+        self.last_rebalance = time.time()
+        if detectors:
+            for load, detector in zip(self.cameras, detectors):
+                scale = detector.detection_scale
+                if scale in DETECTION_SCALES:
+                    load.scale_index = DETECTION_SCALES.index(scale)
+
+    @property
+    def max_age(self):
+        """Frames older than this are not worth processing any more (seconds)"""
+        return 2 * self.target_latency_ms / 1000
+
+    def should_process(self, camera_index, seq):
+        """True if frame seq of camera_index is due under the current stride"""
+        load = self.cameras[camera_index]
+        return load.last_seq < 0 or seq - load.last_seq >= load.stride
+
+    def split_gap(self, camera_index, gap):
+        """Split frames skipped between two results into (shed, superseded)
+
+        shed: skipped on purpose because of the stride, superseded: overtaken by
+        a newer frame before processing got to them.
+        """
+        shed = min(self.cameras[camera_index].stride - 1, gap)
+        with self.lock:
+            self.cameras[camera_index].shed += shed
+        return shed, gap - shed
+
+    def order(self):
+        """Camera indices, active cameras first"""
+        now = time.time()
+        return sorted(range(len(self.cameras)), key=lambda i: not self.cameras[i].active(now))
+
+    def record(self, camera_index, seq, timestamp, started, finished, detections):
+        """Feed back a processed frame (times are time.time() values)"""
+        with self.lock:
+            load = self.cameras[camera_index]
+            cost = (finished - started) * 1000
+            load.cost_ms = cost if load.cost_ms is None else 0.8 * load.cost_ms + 0.2 * cost
+            latency = (finished - timestamp) * 1000
+            load.latency_ms = 0.8 * load.latency_ms + 0.2 * latency
+            if load.last_seq >= 0 and seq > load.last_seq:
+                interval = (timestamp - load.last_timestamp) / (seq - load.last_seq)
+                if interval > 0:
+                    load.interval_s = interval if load.interval_s is None else \
+                        0.9 * load.interval_s + 0.1 * interval
+            load.last_seq = seq
+            load.last_timestamp = timestamp
+            if detections:
+                load.last_active = finished
+
+            if finished - self.last_rebalance >= self.rebalance_interval:
+                self.last_rebalance = finished
+                self._rebalance(finished)
+
+    def _rebalance(self, now):
+        # Cameras that share one core: all of them, or each its own with workers
+        groups = [[load] for load in self.cameras] if self.parallel else [self.cameras]
+        for group in groups:
+            group = [load for load in group if load.cost_ms is not None]
+            if group:
+                self._balance_group(group, now)
+
+    def _balance_group(self, group, now):
+        """Adjust scales, then strides, of cameras that share one core"""
+        target = self.target_latency_ms
+        # Idle cameras give up resolution and frames first, most expensive first
+        shed_order = sorted(group, key=lambda load: (load.active(now), -load.cost_ms))
+
+        # Measured capture-to-result latency includes the queueing the costs do not show
+        latency_ms = max(load.latency_ms for load in group)
+        late = latency_ms > target
+
+        # 1. Resolution: one round over the group may cost at most the target latency
+        round_ms = sum(load.cost_ms for load in group)
+        if self.detectors:
+            if round_ms > target or late:
+                # Active cameras only lose resolution once no idle camera can anymore
+                reason = f"round {round_ms:.0f}ms > {target:.0f}ms" if round_ms > target \
+                    else f"latency {latency_ms:.0f}ms > {target:.0f}ms"
+                idle = [load for load in shed_order if not load.active(now)]
+                for load in idle + [load for load in shed_order if load not in idle]:
+                    if self._change_scale(load, +1, now, reason):
+                        break
+            elif round_ms < 0.4 * target and latency_ms < 0.5 * target:
+                # Headroom: give resolution back, active cameras first
+                for load in reversed(shed_order):
+                    if self._change_scale(load, -1, now, "headroom"):
+                        break
+
+        # 2. Frame rate: the group may not need more than max_utilization of its core
+        for load in group:
+            if load.active(now) and load.stride > 1:
+                load.stride = 1
+                load.reason = "active target"
+        # Over the latency target: shed one more frame step per rebalance even if
+        # the costs say the core keeps up (frames are waiting somewhere)
+        shed_for_latency = late
+        while sum(load.utilization() for load in group) > self.max_utilization or shed_for_latency:
+            candidates = [load for load in shed_order if load.stride < self.max_stride]
+            if not candidates:
+                break
+            candidate = min(candidates, key=lambda load: (load.active(now), load.stride))
+            candidate.stride += 1
+            if shed_for_latency:
+                candidate.reason = f"latency {latency_ms:.0f}ms > {target:.0f}ms"
+                shed_for_latency = False
+            else:
+                candidate.reason = "overload, idle camera shed first" if not candidate.active(now) \
+                    else "overload"
+        # Recover frame rate when there is room again (and the latency is well within the target)
+        for load in reversed(shed_order):
+            if load.stride > 1 and latency_ms < 0.8 * target:
+                load.stride -= 1
+                if sum(other.utilization() for other in group) > 0.8 * self.max_utilization:
+                    load.stride += 1
+                else:
+                    load.reason = "load dropped"
+
+    def _change_scale(self, load, step, now, reason):
+        """Move one camera a step coarser (+1) or finer (-1); False if not possible"""
+        index = load.scale_index + step
+        if not 0 <= index < len(DETECTION_SCALES) or now - load.last_scale_change < SCALE_DWELL_S:
+            return False
+        camera_index = self.cameras.index(load)
+        self.detectors[camera_index].detection_scale = DETECTION_SCALES[index]
+        # The estimate follows the pixel count until new measurements come in
+        ratio = (DETECTION_SCALES[index] / DETECTION_SCALES[load.scale_index]) ** 2
+        load.cost_ms *= ratio
+        load.scale_index = index
+        load.last_scale_change = now
+        load.reason = f"scale {DETECTION_SCALES[index]:g}: {reason}"
+        return True
+
+    def snapshot(self):
+        """Current decisions per camera as a JSON-friendly list"""
+        now = time.time()
+        with self.lock:
+            return [{
+                'camera': i,
+                'cost_ms': load.cost_ms or 0.0,
+                'fps_in': 1 / load.interval_s if load.interval_s else 0.0,
+                'latency_ms': load.latency_ms,
+                'stride': load.stride,
+                'scale': DETECTION_SCALES[load.scale_index] if self.detectors else None,
+                'active': load.active(now),
+                'shed': load.shed,
+                'reason': load.reason,
+            } for i, load in enumerate(self.cameras)]
+
+    def summary_line(self):
+        """Short text for the GUI performance label"""
+        parts = []
+        for camera in self.snapshot():
+            scale = f" scale={camera['scale']:g}" if camera['scale'] is not None else ""
+            active = " ACTIVE" if camera['active'] else ""
+            parts.append(f"Cam{camera['camera'] + 1} 1/{camera['stride']}{scale}{active}")
+        return f"Scheduler (target {self.target_latency_ms:.0f}ms): " + ", ".join(parts)
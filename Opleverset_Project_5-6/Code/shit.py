@@ -16,6 +16,8 @@ from PyQt6.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QHBo
 from PyQt6.QtCore import QTimer, Qt
 from PyQt6.QtGui import QImage, QPixmap
 import numpy as np
+from background import create_background_model
+from profiling import NULL_TIMER
 
 # function to open a camera by ID
 def open_camera(cam_id):
@@ -39,43 +41,54 @@ def detect_cameras():
     return camList
 
 # function to apply filters to the video frames with GPU acceleration
-def apply_filters(frame, fgbg, use_gpu=True):
+# timer: optional profiling.StageTimer, used by benchmark.py for per-stage timings
+def apply_filters(frame, fgbg, use_gpu=True, timer=NULL_TIMER):
     if use_gpu:
         try:
-            return apply_filters_gpu(frame, fgbg)
+            return apply_filters_gpu(frame, fgbg, timer)
         except Exception as e:
             print(f"GPU processing failed, falling back to CPU: {e}")
-            return apply_filters_cpu(frame, fgbg)
+            return apply_filters_cpu(frame, fgbg, timer)
     else:
-        return apply_filters_cpu(frame, fgbg)
+        return apply_filters_cpu(frame, fgbg, timer)
 
-def apply_filters_gpu(frame, fgbg):
+def apply_filters_gpu(frame, fgbg, timer=NULL_TIMER):
     gpu_frame = cv2.UMat(frame)
     gpu_mask = fgbg.apply(gpu_frame)
+    timer.mark('subtract')
     _, gpu_mask = cv2.threshold(gpu_mask, 254, 255, cv2.THRESH_BINARY)
+    timer.mark('threshold')
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
     gpu_mask = cv2.dilate(gpu_mask, kernel, iterations=3)
     mask = gpu_mask.get()
+    timer.mark('morphology')
     contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    timer.mark('contours')
     for contour in contours:
         area = cv2.contourArea(contour)
         if area > 300:
             x, y, w, h = cv2.boundingRect(contour)
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    timer.mark('drawing')
     
     return frame, mask
 
-def apply_filters_cpu(frame, fgbg):
+def apply_filters_cpu(frame, fgbg, timer=NULL_TIMER):
     mask = fgbg.apply(frame)
+    timer.mark('subtract')
     _, mask = cv2.threshold(mask, 254, 255, cv2.THRESH_BINARY)
+    timer.mark('threshold')
     mask = cv2.dilate(mask, np.ones((2,2), np.uint8), iterations=3)
+    timer.mark('morphology')
     
     contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    timer.mark('contours')
     for contour in contours:
         area = cv2.contourArea(contour)
         if area > 300:
             x, y, w, h = cv2.boundingRect(contour)
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    timer.mark('drawing')
     
     return frame, mask
 
@@ -91,7 +104,8 @@ class CameraWindow(QMainWindow):
         
         # Initialize camera variables
         self.caps = []
-        self.fgbg = cv2.createBackgroundSubtractorMOG2(history=80, varThreshold=100)
+        # One background model per camera, filled in by setup_cameras
+        self.fgbgs = []
         
         # Performance monitoring
         self.frame_count = 0
@@ -197,6 +211,8 @@ class CameraWindow(QMainWindow):
             cap = open_camera(cam_id)
             if cap:
                 self.caps.append(cap)
+                # MOG2 also takes the UMat frames of the GPU path
+                self.fgbgs.append(create_background_model('mog2', history=80, var_threshold=100))
     
     def cv2_to_qimage(self, cv_img):
         """Convert OpenCV image to QImage"""
@@ -230,7 +246,7 @@ class CameraWindow(QMainWindow):
             
             if ret1:
                 # Apply filters to frame 1 with GPU acceleration
-                processed_frame1, mask1 = apply_filters(frame1, self.fgbg, use_gpu=self.gpu_available)
+                processed_frame1, mask1 = apply_filters(frame1, self.fgbgs[0], use_gpu=self.gpu_available)
                 
                 # Convert to QImage and display
                 q_img1 = self.cv2_to_qimage(processed_frame1)
@@ -246,7 +262,7 @@ class CameraWindow(QMainWindow):
             
             if ret2:
                 # Apply filters to frame 2 with GPU acceleration
-                processed_frame2, mask2 = apply_filters(frame2, self.fgbg, use_gpu=self.gpu_available)
+                processed_frame2, mask2 = apply_filters(frame2, self.fgbgs[1], use_gpu=self.gpu_available)
                 
                 # Convert to QImage and display
                 q_img2 = self.cv2_to_qimage(processed_frame2)
@@ -0,0 +1,181 @@
+# Offline stereo calibration with cached rectification maps
+# Calibrates the stereo pair once from a folder of checkerboard image pairs and
+# stores intrinsics, extrinsics and the fixed-point remap tables in one .npz
+# file. At runtime StereoRectifier only loads that file and rectifies with
+# cv2.remap, so startup never repeats the calibration.
+#
+# Calibrate: python stereo_calibration.py calib_images/ --pattern 9x6 --square 0.025
+#   calib_images/ holds left/ and right/ subfolders with matching file names,
+#   or files named left_*.png / right_*.png
+
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+DEFAULT_CALIBRATION_FILE = 'stereo_calib.npz'
+
+
+def find_image_pairs(folder):
+    """Sorted (left, right) image paths from left/ + right/ or left_* + right_* files"""
+    left_dir, right_dir = os.path.join(folder, 'left'), os.path.join(folder, 'right')
+    if os.path.isdir(left_dir) and os.path.isdir(right_dir):
+        lefts = sorted(glob.glob(os.path.join(left_dir, '*')))
+        rights = sorted(glob.glob(os.path.join(right_dir, '*')))
+    else:
+        lefts = sorted(glob.glob(os.path.join(folder, 'left*')))
+        rights = sorted(glob.glob(os.path.join(folder, 'right*')))
+    if len(lefts) != len(rights):
+        raise ValueError(f"{len(lefts)} left images but {len(rights)} right images in {folder}")
+    return list(zip(lefts, rights))
+
+
+def calibrate_stereo(folder, pattern=(9, 6), square_size=0.025, alpha=0.0):
+    """Calibrate a stereo pair from checkerboard images, returns a dict of arrays
+
+    pattern is the number of inner corners (columns, rows), square_size in meters.
+    """
+    # 3D corner positions of the board in its own plane
+    board = np.zeros((pattern[0] * pattern[1], 3), np.float32)
+    board[:, :2] = np.mgrid[0:pattern[0], 0:pattern[1]].T.reshape(-1, 2) * square_size
+
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 1e-3)
+    object_points, left_points, right_points = [], [], []
+    image_size = None
+    for left_path, right_path in find_image_pairs(folder):
+        gray_left = cv2.imread(left_path, cv2.IMREAD_GRAYSCALE)
+        gray_right = cv2.imread(right_path, cv2.IMREAD_GRAYSCALE)
+        if gray_left is None or gray_right is None:
+            print(f"Skipping unreadable pair {left_path}, {right_path}")
+            continue
+        image_size = gray_left.shape[::-1]
+
+        found_left, corners_left = cv2.findChessboardCorners(gray_left, pattern)
+        found_right, corners_right = cv2.findChessboardCorners(gray_right, pattern)
+        if not (found_left and found_right):
+            print(f"No checkerboard in both images: {os.path.basename(left_path)}")
+            continue
+        corners_left = cv2.cornerSubPix(gray_left, corners_left, (11, 11), (-1, -1), criteria)
+        corners_right = cv2.cornerSubPix(gray_right, corners_right, (11, 11), (-1, -1), criteria)
+        object_points.append(board)
+        left_points.append(corners_left)
+        right_points.append(corners_right)
+
+    if len(object_points) < 3:
+        raise ValueError(f"Need at least 3 usable checkerboard pairs, found {len(object_points)}")
+    print(f"Using {len(object_points)} checkerboard pairs at {image_size[0]}x{image_size[1]}")
+
+    # Intrinsics per camera first, then the extrinsics with fixed intrinsics
+    rms_left, K1, D1, _, _ = cv2.calibrateCamera(object_points, left_points, image_size, None, None)
+    rms_right, K2, D2, _, _ = cv2.calibrateCamera(object_points, right_points, image_size, None, None)
+    rms, K1, D1, K2, D2, R, T, E, F = cv2.stereoCalibrate(
+        object_points, left_points, right_points, K1, D1, K2, D2, image_size,
+        criteria=criteria, flags=cv2.CALIB_FIX_INTRINSIC)
+    print(f"RMS reprojection error: left={rms_left:.3f}px right={rms_right:.3f}px stereo={rms:.3f}px")
+
+    R1, R2, P1, P2, Q, roi_left, roi_right = cv2.stereoRectify(
+        K1, D1, K2, D2, image_size, R, T, alpha=alpha)
+
+    calibration = {
+        'image_size': np.array(image_size, np.int32),
+        'K1': K1, 'D1': D1, 'K2': K2, 'D2': D2,
+        'R': R, 'T': T, 'E': E, 'F': F,
+        'R1': R1, 'R2': R2, 'P1': P1, 'P2': P2, 'Q': Q,
+        'rms': np.float64(rms),
+    }
+    calibration.update(compute_maps(calibration))
+    return calibration
+
+
+def compute_maps(calibration):
+    """Fixed-point (CV_16SC2) rectification maps for both cameras"""
+    image_size = tuple(int(v) for v in calibration['image_size'])
+    maps = {}
+    for side, K, D, R, P in (('left', 'K1', 'D1', 'R1', 'P1'), ('right', 'K2', 'D2', 'R2', 'P2')):
+        map1, map2 = cv2.initUndistortRectifyMap(
+            calibration[K], calibration[D], calibration[R], calibration[P], image_size, cv2.CV_16SC2)
+        maps[f'{side}_map1'] = map1
+        maps[f'{side}_map2'] = map2
+    return maps
+
+
+def save_calibration(calibration, path=DEFAULT_CALIBRATION_FILE):
+    # Uncompressed npz: a couple of MB, loads in milliseconds
+    np.savez(path, **calibration)
+
+
+class StereoRectifier:
+    """Rectifies stereo pairs with precomputed remap tables from a calibration file"""
+
+    def __init__(self, path=DEFAULT_CALIBRATION_FILE):
+        start = time.perf_counter()
+        with np.load(path) as data:
+            self.calibration = {key: data[key] for key in data.files}
+        # Older files without maps: compute once and keep them in memory
+        if 'left_map1' not in self.calibration:
+            self.calibration.update(compute_maps(self.calibration))
+        c = self.calibration
+        self.image_size = tuple(int(v) for v in c['image_size'])
+        self.left_maps = (c['left_map1'], c['left_map2'])
+        self.right_maps = (c['right_map1'], c['right_map2'])
+        self.Q = c['Q']
+        self.P1 = c['P1']
+        self.P2 = c['P2']
+        self.load_ms = (time.perf_counter() - start) * 1000
+
+    @property
+    def focal_length(self):
+        """Focal length of the rectified cameras in pixels"""
+        return float(self.P1[0, 0])
+
+    @property
+    def baseline(self):
+        """Distance between the camera centres in calibration units (meters)"""
+        return float(abs(self.P2[0, 3] / self.P2[0, 0]))
+
+    def rectify(self, left, right, interpolation=cv2.INTER_LINEAR):
+        """Rectified (left, right) images; frames must have the calibration size"""
+        if left.shape[1::-1] != self.image_size or right.shape[1::-1] != self.image_size:
+            raise ValueError(f"Frames are {left.shape[1::-1]}, calibration is for {self.image_size}")
+        left = cv2.remap(left, *self.left_maps, interpolation)
+        right = cv2.remap(right, *self.right_maps, interpolation)
+        return left, right
+
+    def rectify_point(self, side, points):
+        """Map raw pixel coordinates (N x 2) to rectified coordinates"""
+        c = self.calibration
+        K, D, R, P = (('K1', 'D1', 'R1', 'P1') if side == 'left' else ('K2', 'D2', 'R2', 'P2'))
+        points = np.asarray(points, np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, c[K], c[D], R=c[R], P=c[P]).reshape(-1, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline stereo calibration from checkerboard images")
+    parser.add_argument('folder', help="Folder with left/ and right/ subfolders or left_*/right_* files")
+    parser.add_argument('--pattern', default='9x6', help="Inner corners as COLSxROWS (default 9x6)")
+    parser.add_argument('--square', type=float, default=0.025, help="Square size in meters")
+    parser.add_argument('--alpha', type=float, default=0.0,
+                        help="stereoRectify alpha: 0 crops to valid pixels, 1 keeps all pixels")
+    parser.add_argument('--output', default=DEFAULT_CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    pattern = tuple(int(v) for v in args.pattern.lower().split('x'))
+    calibration = calibrate_stereo(args.folder, pattern, args.square, args.alpha)
+    save_calibration(calibration, args.output)
+
+    # Show what the runtime will pay
+    rectifier = StereoRectifier(args.output)
+    blank = np.zeros((rectifier.image_size[1], rectifier.image_size[0]), np.uint8)
+    start = time.perf_counter()
+    for _ in range(20):
+        rectifier.rectify(blank, blank)
+    rectify_ms = (time.perf_counter() - start) / 20 * 1000
+    print(f"Saved {args.output}: baseline={rectifier.baseline:.4f}m focal={rectifier.focal_length:.1f}px, "
+          f"load {rectifier.load_ms:.1f}ms, rectify {rectify_ms:.2f}ms per gray pair")
+
+
+if __name__ == "__main__":
+    main()
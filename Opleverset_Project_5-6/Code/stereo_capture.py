@@ -0,0 +1,200 @@
+# Timestamp-synchronized stereo pair capture
+# Both cameras capture concurrently in their own thread into a small per-camera
+# buffer. Pairs are formed by timestamp (sensor time for picamera2, recorded
+# timestamps for file sources): frames that have no partner within the
+# tolerance are dropped and counted, and the skew of every pair is recorded.
+#
+# Check two recordings: python stereo_capture.py --left images:left/ --right images:right/
+#   (file sources read their timestamps from timestamps.txt / <clip>.timestamps.txt)
+
+import argparse
+import collections
+import threading
+import time
+
+from frame_sources import create_source
+from metrics import LatencyHistogram
+
+SIDES = ('left', 'right')
+
+
+class PairedCapture:
+    """Captures two sources concurrently and pairs their frames by timestamp
+
+    tolerance: largest allowed |left - right| timestamp difference in seconds;
+    keep it below half a frame period so every frame has at most one partner.
+    None: 0.45 frame periods of the faster source, so free-running cameras
+    with any phase offset still pair (the skew statistics show the offset).
+    Live sources drop their oldest buffered frame when the consumer falls
+    behind, file sources wait instead so recordings pair deterministically.
+    warn_after: frames dropped without a single pair before a warning with the
+    drop counters is printed (at most every warn_interval seconds).
+    """
+
+    def __init__(self, left, right, tolerance=None, buffer_size=4, warn_after=30, warn_interval=5.0):
+        self.sources = {'left': left, 'right': right}
+        self.tolerance = tolerance
+        self.buffer_size = buffer_size
+        self.warn_after = warn_after
+        self.warn_interval = warn_interval
+        self.unpaired = 0  # Frames dropped since the last pair
+        self.last_warning = 0.0
+        self.buffers = {side: collections.deque() for side in SIDES}
+        self.finished = dict.fromkeys(SIDES, False)
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+        # Statistics
+        self.pairs = 0
+        self.dropped = {side: 0 for side in SIDES}     # No partner within tolerance
+        self.overflow = {side: 0 for side in SIDES}    # Buffer full (live sources)
+        self.captured = {side: 0 for side in SIDES}
+        self.skew = LatencyHistogram()                 # |left - right| in ms
+        self.skew_sum = 0.0                            # Signed, left - right in ms
+
+    def start(self):
+        for side in SIDES:
+            if not self.sources[side].open():
+                print(f"Failed to open {side} source {self.sources[side]}")
+                return False
+        if self.tolerance is None:
+            # File sources know their frame rate only once they are open
+            fps = max(source.fps or 30 for source in self.sources.values())
+            self.tolerance = 0.45 / fps
+        self.running = True
+        for side in SIDES:
+            thread = threading.Thread(target=self._capture, args=(side,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return True
+
+    def _capture(self, side):
+        source = self.sources[side]
+        buffer = self.buffers[side]
+        while self.running:
+            ret, frame = source.read()
+            if not ret:
+                break
+            with self.condition:
+                if not source.is_live:
+                    # Recordings: wait for the consumer instead of losing frames
+                    while self.running and len(buffer) >= self.buffer_size:
+                        self.condition.wait(0.1)
+                elif len(buffer) >= self.buffer_size:
+                    buffer.popleft()
+                    self.overflow[side] += 1
+                buffer.append((source.timestamp, frame))
+                self.captured[side] += 1
+                self.condition.notify_all()
+        with self.condition:
+            self.finished[side] = True
+            self.condition.notify_all()
+
+    def _pop_pair(self):
+        """Match the oldest frames of both buffers, drop the ones that cannot match
+
+        Timestamps only increase, so if the oldest left frame is more than the
+        tolerance older than the oldest right frame no later right frame can
+        match it either (and the other way around).
+        """
+        left, right = self.buffers['left'], self.buffers['right']
+        while left and right:
+            difference = left[0][0] - right[0][0]
+            if abs(difference) <= self.tolerance:
+                left_ts, left_frame = left.popleft()
+                right_ts, right_frame = right.popleft()
+                self.pairs += 1
+                self.unpaired = 0
+                self.skew.observe(abs(difference) * 1000)
+                self.skew_sum += difference * 1000
+                return left_frame, right_frame, left_ts, right_ts
+            side = 'left' if difference < 0 else 'right'
+            self.buffers[side].popleft()
+            self.dropped[side] += 1
+            self.unpaired += 1
+        self._warn_unpaired()
+        return None
+
+    def _warn_unpaired(self):
+        """Rate-limited warning while frames keep being dropped without any pair"""
+        now = time.perf_counter()
+        if self.unpaired < self.warn_after or now - self.last_warning < self.warn_interval:
+            return
+        self.last_warning = now
+        print(f"Stereo pairing: no pair in the last {self.unpaired} dropped frames "
+              f"(dropped L/R={self.dropped['left']}/{self.dropped['right']}, "
+              f"tolerance {self.tolerance * 1000:.1f}ms); the camera phase offset may exceed the tolerance")
+
+    def get_pair(self, timeout=1.0):
+        """Next (left, right, left_ts, right_ts), None on timeout or end of input"""
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            while True:
+                pair = self._pop_pair()
+                if pair is not None:
+                    self.condition.notify_all()  # Room in the buffers again
+                    return pair
+                # A finished source with an empty buffer will never complete a pair
+                if any(self.finished[side] and not self.buffers[side] for side in SIDES):
+                    return None
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def stats(self):
+        """Pairing and skew statistics as a dict"""
+        with self.condition:
+            skew = self.skew.summary()
+            skew['mean_signed'] = self.skew_sum / self.pairs if self.pairs else 0.0
+            return {
+                'pairs': self.pairs,
+                'captured': dict(self.captured),
+                'dropped': dict(self.dropped),
+                'overflow': dict(self.overflow),
+                'skew_ms': skew,
+            }
+
+    def summary_line(self):
+        s = self.stats()
+        skew = s['skew_ms']
+        return (f"pairs={s['pairs']} dropped L/R={s['dropped']['left']}/{s['dropped']['right']} "
+                f"skew p50={skew['p50']:.2f}ms p95={skew['p95']:.2f}ms max={skew['max']:.2f}ms")
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        for source in self.sources.values():
+            source.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pair two frame sources by timestamp and report skew")
+    parser.add_argument('--left', default='picam:0', help="Left frame source spec")
+    parser.add_argument('--right', default='picam:1', help="Right frame source spec")
+    parser.add_argument('--tolerance', type=float,
+                        help="Pairing tolerance in ms (default: 0.45 frame periods, e.g. 15ms at 30 fps; "
+                             "free-running cameras can be up to half a frame apart)")
+    parser.add_argument('--frames', type=int, default=300, help="Stop after this many pairs")
+    parser.add_argument('--fast', action='store_true', help="Read file sources as fast as possible")
+    args = parser.parse_args()
+
+    capture = PairedCapture(create_source(args.left, realtime=not args.fast),
+                            create_source(args.right, realtime=not args.fast),
+                            tolerance=args.tolerance / 1000 if args.tolerance else None)
+    if not capture.start():
+        return
+    pairs = 0
+    while pairs < args.frames and capture.get_pair(timeout=2.0) is not None:
+        pairs += 1
+    capture.stop()
+    print(capture.summary_line())
+    print(capture.stats())
+
+
+if __name__ == "__main__":
+    main()
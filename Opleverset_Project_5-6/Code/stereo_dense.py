@@ -0,0 +1,288 @@
+# Dense stereo depth: semi-global matching on strips, coarse to fine, with reuse
+# For the cases where a full depth map is needed. Three things make it cheaper
+# than running StereoBM(numDisparities=80) on every full frame:
+#   - coarse to fine: SGM first runs on a half-resolution pair, every strip of
+#     the full-resolution pass then only searches the disparity range the
+#     coarse level found in it (plus a margin) instead of the whole range
+#   - strips: the frame is cut into horizontal strips (with a few rows of
+#     overlap for the aggregation paths) that run in a thread pool; OpenCV
+#     releases the GIL, so the strips use all cores
+#   - temporal reuse: strips whose pixels did not change since their disparity
+#     was computed keep the previous disparity (the static sky and horizon)
+#
+# Benchmark against StereoBM: python stereo_dense.py --frames 60
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Disparity value for pixels without a valid match
+INVALID = -1.0
+
+
+def _round16(value):
+    """numDisparities has to be a positive multiple of 16"""
+    return max(16, int(np.ceil(value / 16.0)) * 16)
+
+
+def sgm(left, right, min_disparity, num_disparities, block_size):
+    """Single-threaded SGBM disparity in pixels (float32, INVALID where unmatched)"""
+    matcher = cv2.StereoSGBM_create(
+        minDisparity=min_disparity,
+        numDisparities=num_disparities,
+        blockSize=block_size,
+        P1=8 * block_size * block_size,
+        P2=32 * block_size * block_size,
+        uniquenessRatio=10,
+        speckleWindowSize=0,
+        mode=cv2.STEREO_SGBM_MODE_SGBM,
+    )
+    raw = matcher.compute(left, right)
+    disparity = raw.astype(np.float32) * (1.0 / 16)
+    disparity[raw < min_disparity * 16] = INVALID
+    return disparity
+
+
+class DenseStereo:
+    """Strip-parallel, coarse-to-fine SGM with temporal reuse of static strips
+
+    Inputs are rectified grayscale frames. max_disparity bounds the search at
+    full resolution; margin (px) widens the range found on the coarse level.
+    A strip counts as changed when more than change_fraction of its pixels
+    differ by more than change_threshold grey levels from the frames its
+    disparity was computed on; every strip is recomputed at least every
+    refresh_interval frames.
+    """
+
+    def __init__(self, max_disparity=80, block_size=5, num_strips=8, threads=None, margin=4,
+                 overlap=8, change_threshold=12, change_fraction=0.002, refresh_interval=30,
+                 temporal=True, pyramid=True):
+        self.max_disparity = _round16(max_disparity)
+        self.block_size = block_size
+        self.num_strips = num_strips
+        self.margin = margin
+        self.overlap = overlap
+        self.change_threshold = change_threshold
+        self.change_fraction = change_fraction
+        self.refresh_interval = refresh_interval
+        self.temporal = temporal
+        self.pyramid = pyramid
+        self.pool = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1)
+
+        # Reference frames and disparity of the last computation, per row
+        self.reference = None
+        self.disparity = None
+        self.strip_age = None
+        self.frame_index = 0
+        self.last_stats = {}
+
+    def _strips(self, height):
+        """(y0, y1) rows of every strip"""
+        bounds = np.linspace(0, height, self.num_strips + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _changed(self, left, right, y0, y1):
+        """True if the strip differs from the frames its disparity was computed on"""
+        limit = self.change_fraction * (y1 - y0) * left.shape[1]
+        for current, reference in ((left, self.reference[0]), (right, self.reference[1])):
+            diff = cv2.absdiff(current[y0:y1], reference[y0:y1])
+            if cv2.countNonZero(cv2.threshold(diff, self.change_threshold, 255, cv2.THRESH_BINARY)[1]) > limit:
+                return True
+        return False
+
+    def _strip_range(self, coarse, y0, y1):
+        """(min_disparity, num_disparities) for a full-resolution strip from the coarse level"""
+        if coarse is None:
+            return 0, self.max_disparity
+        values = coarse[y0 // 2:(y1 + 1) // 2]
+        values = values[values >= 0]
+        if values.size < 16:
+            return 0, self.max_disparity
+        low, high = np.percentile(values, (1, 99)) * 2
+        min_disparity = int(max(0, np.floor(low) - self.margin))
+        max_disparity = min(self.max_disparity, int(np.ceil(high) + self.margin))
+        return min_disparity, _round16(max(1, max_disparity - min_disparity))
+
+    def _compute_strip(self, left, right, y0, y1, min_disparity, num_disparities):
+        # Extra rows above and below so the vertical aggregation paths see context
+        top = max(0, y0 - self.overlap)
+        bottom = min(left.shape[0], y1 + self.overlap)
+        disparity = sgm(left[top:bottom], right[top:bottom], min_disparity, num_disparities, self.block_size)
+        return disparity[y0 - top:y1 - top]
+
+    def compute(self, left, right):
+        """Disparity map in pixels (float32, INVALID where unmatched)"""
+        start = time.perf_counter()
+        height, width = left.shape[:2]
+        first = self.disparity is None or self.disparity.shape != (height, width)
+        if first:
+            self.disparity = np.full((height, width), INVALID, np.float32)
+            self.reference = (left.copy(), right.copy())
+            self.strip_age = [self.refresh_interval] * self.num_strips
+
+        strips = self._strips(height)
+        todo = []
+        for i, (y0, y1) in enumerate(strips):
+            self.strip_age[i] += 1
+            if (first or not self.temporal or self.strip_age[i] >= self.refresh_interval
+                    or self._changed(left, right, y0, y1)):
+                todo.append(i)
+        check_ms = (time.perf_counter() - start) * 1000
+
+        # Coarse level: half-resolution SGM over the whole range, only when needed
+        coarse = None
+        coarse_start = time.perf_counter()
+        if self.pyramid and todo:
+            small_left, small_right = cv2.pyrDown(left), cv2.pyrDown(right)
+            coarse = sgm(small_left, small_right, 0, _round16(self.max_disparity / 2), self.block_size)
+        coarse_ms = (time.perf_counter() - coarse_start) * 1000
+
+        fine_start = time.perf_counter()
+        ranges = {i: self._strip_range(coarse, *strips[i]) for i in todo}
+        futures = {i: self.pool.submit(self._compute_strip, left, right, *strips[i], *ranges[i]) for i in todo}
+        searched = 0
+        for i, future in futures.items():
+            y0, y1 = strips[i]
+            self.disparity[y0:y1] = future.result()
+            self.reference[0][y0:y1] = left[y0:y1]
+            self.reference[1][y0:y1] = right[y0:y1]
+            self.strip_age[i] = 0
+            searched += (y1 - y0) * width * ranges[i][1]
+        fine_ms = (time.perf_counter() - fine_start) * 1000
+
+        self.frame_index += 1
+        self.last_stats = {
+            'total_ms': (time.perf_counter() - start) * 1000,
+            'check_ms': check_ms,
+            'coarse_ms': coarse_ms,
+            'fine_ms': fine_ms,
+            'strips_computed': len(todo),
+            'strips_reused': len(strips) - len(todo),
+            'mean_range': float(np.mean([r[1] for r in ranges.values()])) if ranges else 0.0,
+            'searched': searched,  # pixel x disparity candidates evaluated at full resolution
+        }
+        return self.disparity
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class StereoScene:
+    """Textured synthetic stereo pair with known disparity
+
+    A background whose disparity grows towards the bottom (ground plane) and a
+    square target at a larger disparity that moves sideways; the rest of the
+    scene is static, like a fixed camera rig.
+    """
+
+    def __init__(self, width=640, height=480, seed=0, noise=1.0):
+        rng = np.random.default_rng(seed)
+        texture = rng.integers(0, 255, (height // 4, (width + 128) // 4), dtype=np.uint8)
+        self.texture = cv2.GaussianBlur(cv2.resize(texture, (width + 128, height),
+                                                   interpolation=cv2.INTER_LINEAR), (3, 3), 0)
+        self.width = width
+        self.height = height
+        self.noise = noise
+        self.rng = rng
+        self.background = np.repeat(np.linspace(8, 40, height, dtype=np.float32)[:, None], width, axis=1)
+        self.frame_index = 0
+
+    def next(self):
+        """(left, right, ground truth disparity) of the next frame"""
+        w, h = self.width, self.height
+        truth = self.background.copy()
+        size = h // 4
+        x = int((w - size) / 2 + (w / 3) * np.sin(self.frame_index / 15.0))
+        y = h // 3
+        truth[y:y + size, x:x + size] = 60.0
+        self.frame_index += 1
+
+        left = self.texture[:, :w].copy()
+        # The target carries its own texture, shifted with it
+        left[y:y + size, x:x + size] = 255 - self.texture[y:y + size, 64:64 + size]
+        # Right view: the left pixel at x + d appears at x
+        xs, ys = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        right = cv2.remap(left, xs + truth, ys, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        # The remap samples the disparity at the right pixel; for the target edges
+        # that is close enough for an error statistic away from the borders
+        if self.noise:
+            left = cv2.add(left, self.rng.normal(0, self.noise, left.shape).astype(np.int16), dtype=cv2.CV_8U)
+            right = cv2.add(right, self.rng.normal(0, self.noise, right.shape).astype(np.int16), dtype=cv2.CV_8U)
+        return left, right, truth
+
+
+def _errors(disparity, truth, border):
+    """(mean abs error, bad pixel rate > 1px, density) over the area with full search range"""
+    region = (slice(None), slice(border, None))
+    d, t = disparity[region], truth[region]
+    valid = d >= 0
+    if not valid.any():
+        return float('nan'), float('nan'), 0.0
+    error = np.abs(d[valid] - t[valid])
+    return float(error.mean()), float((error > 1).mean()), float(valid.mean())
+
+
+def run_benchmark(num_frames=60, width=640, height=480, threads=None, strips=8):
+    """StereoBM (the current depth view) against the strip SGM variants"""
+    scene = StereoScene(width, height)
+    frames = [scene.next() for _ in range(num_frames)]
+    border = 96  # Left columns without the full disparity range in every engine
+
+    stereo_bm = cv2.StereoBM_create(numDisparities=16 * 5, blockSize=15)
+
+    def bm(left, right):
+        raw = stereo_bm.compute(left, right)
+        disparity = raw.astype(np.float32) / 16
+        disparity[raw < 0] = INVALID
+        return disparity
+
+    engines = [('StereoBM 80 (current)', None, bm)]
+    for name, kwargs in (('SGM full range', dict(pyramid=False, temporal=False, num_strips=1)),
+                         ('SGM strips', dict(pyramid=False, temporal=False)),
+                         ('SGM strips+pyramid', dict(temporal=False)),
+                         ('SGM strips+pyramid+reuse', dict())):
+        engine = DenseStereo(threads=threads, **dict(dict(num_strips=strips), **kwargs))
+        engines.append((name, engine, engine.compute))
+
+    print(f"{width}x{height}, {num_frames} frames, {threads or os.cpu_count()} threads")
+    print(f"{'engine':<26} {'ms/frame':>8} {'Mdisp/s':>8} {'reused':>7} {'range':>6} "
+          f"{'error':>6} {'>1px':>6} {'density':>8}")
+    for name, engine, compute in engines:
+        times, errors, reused, ranges = [], [], [], []
+        for left, right, truth in frames:
+            start = time.perf_counter()
+            disparity = compute(left, right)
+            times.append((time.perf_counter() - start) * 1000)
+            errors.append(_errors(disparity, truth, border))
+            if engine is not None:
+                reused.append(engine.last_stats['strips_reused'] / engine.num_strips)
+                ranges.append(engine.last_stats['mean_range'] or np.nan)
+        ms = np.mean(times[1:])
+        # Disparities per second: dense output pixels per second
+        mdisp = width * height / (ms / 1000) / 1e6
+        mean_error, bad, density = np.nanmean(np.array(errors[1:]), axis=0)
+        reuse = f"{np.mean(reused) * 100:.0f}%" if reused else "-"
+        mean_range = f"{np.nanmean(ranges):.0f}" if ranges and not np.all(np.isnan(ranges)) else "80"
+        print(f"{name:<26} {ms:>8.1f} {mdisp:>8.1f} {reuse:>7} {mean_range:>6} "
+              f"{mean_error:>6.2f} {bad * 100:>5.1f}% {density * 100:>7.0f}%")
+        if engine is not None:
+            engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark strip-parallel coarse-to-fine SGM against StereoBM")
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--threads', type=int, help="Thread pool size (default: all cores)")
+    parser.add_argument('--strips', type=int, default=8)
+    args = parser.parse_args()
+    run_benchmark(args.frames, args.width, args.height, args.threads, args.strips)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 import cv2
 import numpy as np
+import os
 import threading
+import time
 from picamera2 import Picamera2
 
+from detection import MotionDetector
+from frame_sources import PicameraSource
+from stereo_capture import PairedCapture
+from stereo_calibration import DEFAULT_CALIBRATION_FILE, StereoRectifier
+from stereo_roi import RoiStereoMatcher, draw_distances
+from stereo_dense import DenseStereo
+from stereo_triangulate import DetectionTriangulator, draw_points
+
 class StereoCameraThread(threading.Thread):
     def __init__(self, cam_index):
         super().__init__()
@@ -46,26 +56,55 @@ class StereoCameraThread(threading.Thread):
             print(f"Error with camera {self.cam_index}: {e}")
 
 class StereoDepthProcessor(threading.Thread):
-    """Process stereo frames for depth estimation"""
-    def __init__(self, left_idx=0, right_idx=1):
+    """Process stereo frames for depth estimation
+
+    roi_only: skip the full-frame disparity map and only match the motion
+    detections of the left camera, giving a distance per detection.
+    triangulate: detect in both cameras and triangulate the paired detections
+    into x/y/z positions (needs a calibration).
+    dense_sgm: full-frame disparity with the strip-parallel coarse-to-fine SGM
+    of stereo_dense.py instead of StereoBM.
+    """
+    def __init__(self, left_idx=0, right_idx=1, calibration_file=None, roi_only=False,
+                 triangulate=False, dense_sgm=False):
         super().__init__()
         self.left_idx = left_idx
         self.right_idx = right_idx
         self.daemon = True
+        self.roi_only = roi_only
+        self.triangulate = triangulate
+        self.dense = DenseStereo(max_disparity=16 * 5) if dense_sgm else None
+
+        # Precomputed rectification maps from stereo_calibration.py
+        self.rectifier = None
+        if calibration_file:
+            self.rectifier = StereoRectifier(calibration_file)
+            print(f"Loaded calibration {calibration_file} in {self.rectifier.load_ms:.1f}ms "
+                  f"(baseline {self.rectifier.baseline:.3f}m)")
+        else:
+            print("No stereo calibration, disparity is computed on unrectified frames")
+
+        # Same detector as process_frame_optimized in camera_window.py
+        self.detector = MotionDetector() if roi_only else None
+        self.matcher = RoiStereoMatcher(self.rectifier, max_disparity=16 * 5) if roi_only else None
+        
+        # One detector per camera, the detections are triangulated without image matching
+        self.triangulator = None
+        if triangulate and self.rectifier is not None:
+            self.detectors = (MotionDetector(), MotionDetector())
+            self.triangulator = DetectionTriangulator(self.rectifier)
         
     def run(self):
         try:
-            # Initialize both cameras
-            picam_left = Picamera2(self.left_idx)
-            picam_right = Picamera2(self.right_idx)
+            if self.triangulate and self.triangulator is None:
+                print("Triangulation needs a stereo calibration (run stereo_calibration.py first)")
+                return
             
-            # Configure both cameras
-            for picam in [picam_left, picam_right]:
-                config = picam.create_preview_configuration(
-                    main={"format": "RGB888", "size": (640, 480)}
-                )
-                picam.configure(config)
-                picam.start()
+            # Both cameras capture concurrently, frames are paired by sensor timestamp
+            capture = PairedCapture(PicameraSource(self.left_idx, 640, 480),
+                                    PicameraSource(self.right_idx, 640, 480))
+            if not capture.start():
+                return
             
             # Stereo matcher
             stereo = cv2.StereoBM_create(numDisparities=16*5, blockSize=15)
@@ -73,21 +112,63 @@ class StereoDepthProcessor(threading.Thread):
             print(f"Stereo depth estimation started")
             
             while True:
-                # Capture frames from both cameras
-                frame_left = picam_left.capture_array()
-                frame_right = picam_right.capture_array()
+                # Next synchronized pair (already BGR)
+                pair = capture.get_pair()
+                if pair is None:
+                    # At most once per get_pair timeout (1s)
+                    print(f"No stereo pair within 1s: {capture.summary_line()}")
+                    continue
+                frame_left, frame_right, left_ts, right_ts = pair
                 
-                # Convert RGB to BGR
-                frame_left = cv2.cvtColor(frame_left, cv2.COLOR_RGB2BGR)
-                frame_right = cv2.cvtColor(frame_right, cv2.COLOR_RGB2BGR)
+                if self.triangulator is not None:
+                    # Detect in both views, pair the detections and triangulate them
+                    result_frame, _ = self.detectors[0].process(frame_left)
+                    self.detectors[1].process(frame_right)
+                    left_dets = self.detectors[0].last_detections
+                    points = self.triangulator.process(left_dets, self.detectors[1].last_detections,
+                                                       (left_ts + right_ts) / 2)
+                    draw_points(result_frame, left_dets, points)
+                    cv2.putText(result_frame, f"Triangulation: {self.triangulator.last_us:.0f}us, "
+                               f"{len(points)} targets", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+                    cv2.imshow("Left Camera", result_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                    continue
                 
+                if self.roi_only:
+                    # Detect in the left view, then match only inside the boxes
+                    result_frame, _ = self.detector.process(frame_left)
+                    distances = self.matcher.match(frame_left, frame_right, self.detector.last_detections)
+                    draw_distances(result_frame, distances)
+                    cv2.putText(result_frame, f"Stereo ROI: {self.matcher.last_ms:.1f}ms", (10, 60),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+                    cv2.imshow("Left Camera", result_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                    continue
+
                 # Convert to grayscale for disparity calculation
                 gray_left = cv2.cvtColor(frame_left, cv2.COLOR_BGR2GRAY)
                 gray_right = cv2.cvtColor(frame_right, cv2.COLOR_BGR2GRAY)
+
+                # Rectify with the cached fixed-point maps so epipolar lines are rows
+                if self.rectifier is not None:
+                    start = time.perf_counter()
+                    gray_left, gray_right = self.rectifier.rectify(gray_left, gray_right)
+                    rectify_ms = (time.perf_counter() - start) * 1000
+                    cv2.putText(frame_left, f"Rectify: {rectify_ms:.1f}ms", (10, 30),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
                 
                 # Compute disparity
-                disparity = stereo.compute(gray_left, gray_right)
-                disparity = np.clip(disparity / 16.0, 0, 255).astype(np.uint8)
+                if self.dense is not None:
+                    disparity = np.clip(self.dense.compute(gray_left, gray_right), 0, 255).astype(np.uint8)
+                    stats = self.dense.last_stats
+                    cv2.putText(frame_left, f"SGM: {stats['total_ms']:.1f}ms, "
+                               f"{stats['strips_reused']} strips reused", (10, 60),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+                else:
+                    disparity = stereo.compute(gray_left, gray_right)
+                    disparity = np.clip(disparity / 16.0, 0, 255).astype(np.uint8)
                 
                 # Apply colormap to disparity
                 disparity_colored = cv2.applyColorMap(disparity, cv2.COLORMAP_JET)
@@ -99,8 +180,10 @@ class StereoDepthProcessor(threading.Thread):
                 if cv2.waitKey(30) & 0xFF == ord('q'):
                     break
             
-            picam_left.stop()
-            picam_right.stop()
+            capture.stop()
+            if self.dense is not None:
+                self.dense.close()
+            print(f"Stereo capture: {capture.summary_line()}")
             cv2.destroyAllWindows()
             
         except Exception as e:
@@ -117,8 +200,11 @@ def main():
         print("\nOptions:")
         print("1. Show both camera feeds separately")
         print("2. Show stereo depth estimation")
+        print("3. Show drone distance at motion detections (ROI stereo)")
+        print("4. Show drone x/y/z from the detections of both cameras (triangulation)")
+        print("5. Show stereo depth estimation (multi-threaded SGM)")
         
-        choice = input("Select option (1 or 2): ").strip()
+        choice = input("Select option (1, 2, 3, 4 or 5): ").strip()
         
         if choice == "1":
             # Start threads for each camera
@@ -131,9 +217,12 @@ def main():
             for thread in threads:
                 thread.join()
         
-        elif choice == "2":
+        elif choice in ("2", "3", "4", "5"):
             # Stereo depth processing
-            processor = StereoDepthProcessor(0, 1)
+            # Use the calibration from stereo_calibration.py when it is there
+            calibration_file = DEFAULT_CALIBRATION_FILE if os.path.exists(DEFAULT_CALIBRATION_FILE) else None
+            processor = StereoDepthProcessor(0, 1, calibration_file, roi_only=choice == "3",
+                                             triangulate=choice == "4", dense_sgm=choice == "5")
             processor.run()
         else:
             print("Invalid option")
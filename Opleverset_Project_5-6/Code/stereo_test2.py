@@ -1,32 +1,22 @@
 import cv2
 import numpy as np
-from picamera2 import Picamera2
-import time
 
-# Initialize cameras
-picam_left = Picamera2(0)
-picam_right = Picamera2(1)
+from frame_sources import PicameraSource
+from stereo_capture import PairedCapture
 
-# Configure cameras
-config = {"format": "RGB888", "size": (1280, 720)}
-picam_left.configure(picam_left.create_preview_configuration(main=config))
-picam_right.configure(picam_right.create_preview_configuration(main=config))
-
-# Start cameras
-picam_left.start()
-time.sleep(0.5)
-picam_right.start()
+# Both cameras capture concurrently, frames are paired by sensor timestamp
+capture = PairedCapture(PicameraSource(0, 1280, 720), PicameraSource(1, 1280, 720))
+if not capture.start():
+    raise SystemExit("Failed to start cameras")
 
 print("Cameras started. Press 'q' to quit")
 
 while True:
-    # Capture frames
-    frame_left = picam_left.capture_array()
-    frame_right = picam_right.capture_array()
-    
-    # Convert RGB to BGR
-    frame_left = cv2.cvtColor(frame_left, cv2.COLOR_RGB2BGR)
-    frame_right = cv2.cvtColor(frame_right, cv2.COLOR_RGB2BGR)
+    # Next synchronized pair (already BGR)
+    pair = capture.get_pair()
+    if pair is None:
+        continue
+    frame_left, frame_right, _, _ = pair
     
     # Rotate 180 degrees
     frame_left = cv2.flip(frame_left, -1)
@@ -34,11 +24,13 @@ while True:
     
     # Show side by side
     combined = np.hstack([frame_left, frame_right])
+    cv2.putText(combined, capture.summary_line(), (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     cv2.imshow("Cameras", combined)
     
     if cv2.waitKey(30) & 0xFF == ord('q'):
         break
 
-picam_left.stop()
-picam_right.stop()
+capture.stop()
+print(capture.summary_line())
 cv2.destroyAllWindows()
\ No newline at end of file
@@ -0,0 +1,363 @@
+# Multi-object tracking on top of the motion detections
+# Every target gets a constant-velocity Kalman filter (state cx, cy, vx, vy in
+# pixels and pixels per frame) and a stable ID. Detections are assigned to
+# tracks by Mahalanobis distance, with the Hungarian method when scipy is
+# installed and greedy nearest-first otherwise. All track state lives in
+# parallel numpy arrays, so predict/update are a few array operations no matter
+# how many tracks there are.
+#
+# TrackGuidedDetector uses the tracks to skip full-frame work: while the tracks
+# are confident only their predicted regions are searched, the whole frame is
+# scanned every full_scan_interval frames or as soon as a track is missed.
+
+import cv2
+import numpy as np
+
+from capture_formats import luma, to_bgr
+from detection import DETECTION_DTYPE, detect_in_roi
+from profiling import StageTimer
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# One row per track, as returned by Tracker.tracks()
+TRACK_DTYPE = np.dtype([
+    ('id', np.int32), ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+    ('vx', np.float32), ('vy', np.float32), ('hits', np.int32), ('misses', np.int32),
+    ('confirmed', np.bool_),
+])
+
+# 99% gate of the chi-square distribution with 2 degrees of freedom
+GATE_CHI2 = 9.21
+
+# Constant-velocity model, one time step = one frame
+F = np.array([[1, 0, 1, 0],
+              [0, 1, 0, 1],
+              [0, 0, 1, 0],
+              [0, 0, 0, 1]], np.float32)
+
+
+def assign(cost, max_cost):
+    """(rows, cols) of the cheapest one-to-one assignment with cost <= max_cost"""
+    if cost.size == 0:
+        return np.empty(0, np.intp), np.empty(0, np.intp)
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(np.minimum(cost, max_cost * 10))
+    else:
+        # Greedy: take pairs cheapest first, each row and column once
+        order = np.argsort(cost, axis=None)
+        order = order[cost.flat[order] <= max_cost]
+        rows, cols = [], []
+        used_rows, used_cols = set(), set()
+        for row, col in zip(*np.unravel_index(order, cost.shape)):
+            if row not in used_rows and col not in used_cols:
+                used_rows.add(row)
+                used_cols.add(col)
+                rows.append(row)
+                cols.append(col)
+        rows, cols = np.array(rows, np.intp), np.array(cols, np.intp)
+    keep = cost[rows, cols] <= max_cost
+    return rows[keep], cols[keep]
+
+
+class Tracker:
+    """Constant-velocity Kalman tracks with stable IDs in compact arrays
+
+    process_noise: acceleration noise (px/frame^2), measurement_noise: std of a
+    detection centre (px). A track is confirmed after min_hits updates and
+    removed after more than max_misses frames without a detection.
+    """
+
+    def __init__(self, process_noise=1.0, measurement_noise=2.0, min_hits=3, max_misses=5,
+                 capacity=64):
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        q = process_noise ** 2
+        # Discrete white-noise acceleration model
+        self.Q = q * np.array([[0.25, 0, 0.5, 0],
+                               [0, 0.25, 0, 0.5],
+                               [0.5, 0, 1, 0],
+                               [0, 0.5, 0, 1]], np.float32)
+        self.R = np.eye(2, dtype=np.float32) * measurement_noise ** 2
+        self.next_id = 1
+        self.count = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """(Re)allocate the track arrays, keeping the active tracks"""
+        n = self.count
+        old = getattr(self, 'state', None)
+        arrays = {
+            'state': np.zeros((capacity, 4), np.float32),       # cx, cy, vx, vy
+            'cov': np.zeros((capacity, 4, 4), np.float32),
+            'size': np.zeros((capacity, 2), np.float32),        # w, h (smoothed)
+            'ids': np.zeros(capacity, np.int32),
+            'hits': np.zeros(capacity, np.int32),
+            'misses': np.zeros(capacity, np.int32),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def confirmed(self):
+        """Boolean mask over the active tracks"""
+        return self.hits[:self.count] >= self.min_hits
+
+    def predict(self):
+        """Advance all tracks by one frame"""
+        n = self.count
+        self.state[:n] = self.state[:n] @ F.T
+        self.cov[:n] = F @ self.cov[:n] @ F.T + self.Q
+
+    def predicted_boxes(self, margin=1.0):
+        """Search windows (x, y, w, h) around the predicted positions as an int array
+
+        The window is the track size grown by margin times the size plus the
+        3-sigma position uncertainty on every side.
+        """
+        n = self.count
+        sigma = np.sqrt(np.maximum(self.cov[:n, [0, 1], [0, 1]], 0))
+        half = self.size[:n] * (0.5 + margin) + 3 * sigma
+        top_left = self.state[:n, :2] - half
+        return np.column_stack([top_left, 2 * half]).astype(np.int32)
+
+    def update(self, detections):
+        """Associate a DETECTION_DTYPE array with the tracks, correct, spawn and prune"""
+        n = self.count
+        centres = np.column_stack([detections['cx'], detections['cy']]).astype(np.float32)
+        track_rows, det_cols = np.empty(0, np.intp), np.empty(0, np.intp)
+        if n and len(detections):
+            # Squared Mahalanobis distance of every detection to every predicted track
+            S = self.cov[:n, :2, :2] + self.R
+            S_inv = np.linalg.inv(S)
+            v = centres[None, :, :] - self.state[:n, None, :2]
+            cost = np.einsum('nmi,nij,nmj->nm', v, S_inv, v)
+            track_rows, det_cols = assign(cost, GATE_CHI2)
+
+        self.correct(track_rows, detections[det_cols])
+        missed = np.ones(n, bool)
+        missed[track_rows] = False
+        self.misses[:n][missed] += 1
+
+        unmatched = np.ones(len(detections), bool)
+        unmatched[det_cols] = False
+        self.spawn(detections[unmatched])
+        self.prune()
+
+    def correct(self, indices, detections):
+        """Kalman update of the tracks at indices with one detection each"""
+        if len(indices) == 0:
+            return
+        z = np.column_stack([detections['cx'], detections['cy']]).astype(np.float32)
+        P = self.cov[indices]
+        S = P[:, :2, :2] + self.R
+        K = P[:, :, :2] @ np.linalg.inv(S)                  # (k, 4, 2)
+        innovation = z - self.state[indices, :2]
+        self.state[indices] += np.einsum('kij,kj->ki', K, innovation)
+        self.cov[indices] = P - K @ P[:, :2, :]
+        sizes = np.column_stack([detections['w'], detections['h']]).astype(np.float32)
+        self.size[indices] = 0.7 * self.size[indices] + 0.3 * sizes
+        self.hits[indices] += 1
+        self.misses[indices] = 0
+
+    def mark_missed(self, indices):
+        self.misses[indices] += 1
+
+    def spawn(self, detections):
+        """Start a tentative track per detection"""
+        k = len(detections)
+        if k == 0:
+            return
+        if self.count + k > len(self.ids):
+            self._allocate(max(2 * len(self.ids), self.count + k))
+        new = slice(self.count, self.count + k)
+        self.state[new] = 0
+        self.state[new, 0] = detections['cx']
+        self.state[new, 1] = detections['cy']
+        self.cov[new] = np.diag([self.R[0, 0], self.R[1, 1], 100.0, 100.0]).astype(np.float32)
+        self.size[new, 0] = detections['w']
+        self.size[new, 1] = detections['h']
+        self.ids[new] = np.arange(self.next_id, self.next_id + k)
+        self.hits[new] = 1
+        self.misses[new] = 0
+        self.next_id += k
+        self.count += k
+
+    def prune(self):
+        """Remove tracks that were missed too often, keeping the arrays packed"""
+        n = self.count
+        keep = self.misses[:n] <= self.max_misses
+        # Tentative tracks that are missed right away are noise
+        keep &= (self.hits[:n] >= self.min_hits) | (self.misses[:n] == 0)
+        if keep.all():
+            return
+        k = int(keep.sum())
+        for name in ('state', 'cov', 'size', 'ids', 'hits', 'misses'):
+            array = getattr(self, name)
+            array[:k] = array[:n][keep]
+        self.count = k
+
+    def tracks(self):
+        """Active tracks as a TRACK_DTYPE array"""
+        n = self.count
+        result = np.empty(n, TRACK_DTYPE)
+        result['id'] = self.ids[:n]
+        result['w'] = self.size[:n, 0]
+        result['h'] = self.size[:n, 1]
+        result['x'] = self.state[:n, 0] - self.size[:n, 0] / 2
+        result['y'] = self.state[:n, 1] - self.size[:n, 1] / 2
+        result['vx'] = self.state[:n, 2]
+        result['vy'] = self.state[:n, 3]
+        result['hits'] = self.hits[:n]
+        result['misses'] = self.misses[:n]
+        result['confirmed'] = self.confirmed
+        return result
+
+
+class TrackGuidedDetector:
+    """MotionDetector plus Tracker that only searches predicted ROIs while tracking
+
+    Same interface as MotionDetector (process, last_detections, last_stats).
+    The background model is only updated on full scans.
+    """
+
+    def __init__(self, detector, tracker=None, full_scan_interval=10, roi_margin=1.0, min_contrast=12):
+        self.detector = detector
+        self.tracker = tracker or Tracker()
+        self.full_scan_interval = full_scan_interval
+        self.roi_margin = roi_margin
+        self.min_contrast = min_contrast
+        self.frames_since_scan = full_scan_interval
+        self.lost_track = False
+        self.last_detections = np.empty(0, DETECTION_DTYPE)
+        self.last_tracks = np.empty(0, TRACK_DTYPE)
+        self.last_stats = {}
+
+    @property
+    def fgbg(self):
+        return self.detector.fgbg
+
+    @property
+    def detection_scale(self):
+        return self.detector.detection_scale
+
+    @detection_scale.setter
+    def detection_scale(self, scale):
+        self.detector.detection_scale = scale
+
+    def tradeoff(self, width, height):
+        return self.detector.tradeoff(width, height)
+
+    def _needs_scan(self):
+        return (self.frames_since_scan >= self.full_scan_interval or self.lost_track
+                or not self.tracker.confirmed.any())
+
+    def _search_tracks(self, frame):
+        """Detections inside the predicted window of every track (track index per row)"""
+        found_indices, found, seen = [], [], set()
+        for index, box in enumerate(self.tracker.predicted_boxes(self.roi_margin).tolist()):
+            result = detect_in_roi(frame, box, min_contrast=self.min_contrast)
+            # Overlapping windows can find the same blob, it goes to the oldest track
+            if result is not None and result[:4] not in seen:
+                seen.add(result[:4])
+                found_indices.append(index)
+                found.append(result)
+        detections = np.empty(len(found), DETECTION_DTYPE)
+        if found:
+            boxes = np.array(found, np.float32)
+            detections['x'], detections['y'] = boxes[:, 0], boxes[:, 1]
+            detections['w'], detections['h'] = boxes[:, 2], boxes[:, 3]
+            detections['area'] = boxes[:, 4]
+            detections['cx'] = boxes[:, 0] + boxes[:, 2] / 2
+            detections['cy'] = boxes[:, 1] + boxes[:, 3] / 2
+        return np.array(found_indices, np.intp), detections
+
+    def process(self, frame, out=None, out_mask=None, frame_format='bgr', annotate=True):
+        """Track-guided processing, returns (result_frame, mask) like MotionDetector"""
+        timer = StageTimer()
+        tracker = self.tracker
+        tracker.predict()
+        timer.mark('track_predict')
+
+        if self._needs_scan():
+            mode = 'scan'
+            result_frame, mask = self.detector.process(frame, out, out_mask, frame_format, annotate)
+            detections = self.detector.last_detections
+            timer.mark('detect')
+            tracker.update(detections)
+            self.frames_since_scan = 0
+            self.lost_track = False
+        else:
+            mode = 'track'
+            image = luma(frame, frame_format) if frame_format != 'bgr' else frame
+            indices, detections = self._search_tracks(image)
+            timer.mark('roi_search')
+            # A confirmed track that is not where it should be: scan the whole frame next
+            missed = np.ones(len(tracker), bool)
+            missed[indices] = False
+            self.lost_track = bool((missed & tracker.confirmed).any())
+            tracker.correct(indices, detections)
+            tracker.mark_missed(np.flatnonzero(missed))
+            tracker.prune()
+            self.frames_since_scan += 1
+
+            if not annotate:
+                result_frame = None
+            elif frame_format != 'bgr':
+                result_frame = to_bgr(frame, frame_format, out)
+            elif out is not None:
+                np.copyto(out, frame)
+                result_frame = out
+            else:
+                result_frame = frame.copy()
+            mask = out_mask if out_mask is not None else np.empty(image.shape[:2], np.uint8)
+            mask[:] = 0
+            for x, y, w, h in detections[['x', 'y', 'w', 'h']].tolist():
+                cv2.rectangle(mask, (x, y), (x + w, y + h), 255, -1)
+                if result_frame is not None:
+                    cv2.rectangle(result_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        timer.mark('track_update')
+
+        tracks = tracker.tracks()
+        if result_frame is not None:
+            for track_id, x, y, w, h in tracks[tracks['confirmed']][['id', 'x', 'y', 'w', 'h']].tolist():
+                cv2.putText(result_frame, f'ID {track_id}', (x, y + h + 15),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 200, 255), 1)
+        timer.mark('track_drawing')
+
+        if mode == 'scan':
+            stats = dict(self.detector.last_stats)
+            stats['roi_search_ms'] = 0.0
+            # Stages of the full scan itself instead of one 'detect' block
+            stages = dict(stats['stages'])
+            stages.update((name, ms) for name, ms in timer.stages.items() if name != 'detect')
+        else:
+            stages = timer.stages
+            # New targets are only found by the scans, at the scale of the wrapped detector
+            scale = self.detector.scale_for(image.shape[1])
+            stats = {
+                'scale': scale, 'resize_ms': 0.0, 'detect_ms': 0.0, 'candidates_ms': 0.0,
+                'refine_ms': 0.0, 'roi_search_ms': stages['roi_search'], 'candidates': len(tracker),
+                'detections': len(detections), 'min_target_px': self.detector.min_target_size(scale),
+            }
+            if result_frame is not None:
+                cv2.putText(result_frame, f'Tracking: {timer.total():.1f}ms ({len(tracks)} tracks)',
+                            (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+        stats.update({
+            'mode': mode,
+            'tracks': len(tracks),
+            'confirmed_tracks': int(tracks['confirmed'].sum()),
+            'total_ms': timer.total(),
+            'stages': stages,
+        })
+        self.last_detections = detections
+        self.last_tracks = tracks
+        self.last_stats = stats
+        return result_frame, mask
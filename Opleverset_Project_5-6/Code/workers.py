@@ -0,0 +1,318 @@
+# Per-camera processing workers
+# Every camera gets its own worker (a process, or a thread since OpenCV releases
+# the GIL) that owns the MotionDetector and therefore the background subtractor
+# of that camera. Frames and results live in shared-memory FrameRings; only
+# slot indices and sequence numbers travel over the queues. Results are put back
+# in order per camera, so the cameras no longer share one core.
+#
+# Scaling benchmark: python workers.py --cameras 2 --mode process
+
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from capture_formats import frame_size
+from detection import create_detector
+from frame_ring import FrameRing
+from frame_sources import SyntheticSource
+
+
+def make_result_ring(frame_ring, num_slots=4):
+    """Ring for annotated (BGR) frames and masks matching the frames of frame_ring"""
+    width, height = frame_size(frame_ring.frame(0), frame_ring.frame_format)
+    return FrameRing(num_slots, [
+        ('frame', (height, width, 3), np.uint8),
+        ('mask', (height, width), np.uint8),
+    ])
+
+
+def process_latest(detector, frames, results, last_seq, max_age=0.0, annotate=True):
+    """Process the newest frame in frames into a slot of results
+
+    Returns (status, result_slot, seq, timestamp, started, finished, detections)
+    with status 'ok', 'none' (no new frame), 'stale' (older than max_age) or 'torn'
+    (overwritten while processing). timestamp is the capture time, started/finished
+    the processing times, all time.time() values so they compare across processes.
+    detections is the number of detections in the frame. annotate=False only
+    writes the mask, the frame plane of the result slot is left as it was.
+    """
+    slot, seq = frames.latest()
+    if seq <= last_seq:
+        return 'none', -1, seq, 0.0, 0.0, 0.0, 0
+    started = time.time()
+    frames.pin(slot)
+    try:
+        timestamp = frames.timestamp(slot)
+        if not frames.valid(slot, seq):
+            return 'torn', -1, seq, timestamp, started, started, 0
+
+        # Skip old frames to reduce latency
+        if max_age and started - timestamp > max_age:
+            return 'stale', -1, seq, timestamp, started, started, 0
+
+        out_slot = results.begin_write()
+        detector.process(frames.frame(slot),
+                         out=results.plane(out_slot, 'frame') if annotate else None,
+                         out_mask=results.plane(out_slot, 'mask'),
+                         frame_format=frames.frame_format, annotate=annotate)
+        finished = time.time()
+        if not frames.valid(slot, seq):
+            results.abort_write(out_slot)
+            return 'torn', -1, seq, timestamp, started, finished, 0
+        results.end_write(out_slot, timestamp, seq)
+        return 'ok', out_slot, seq, timestamp, started, finished, len(detector.last_detections)
+    finally:
+        frames.unpin()
+
+
+def _open_ring(ring):
+    return FrameRing.attach(ring) if isinstance(ring, tuple) else ring
+
+
+def camera_worker(camera_index, in_queue, out_queue, detector_kwargs, max_age, annotate_interval=0.0):
+    """Worker loop: process the newest frame of one camera on every notification
+
+    A result is only annotated if the last annotated one is annotate_interval
+    seconds old, the others carry just the mask.
+    """
+    # One OpenCV thread per worker, the parallelism comes from the workers
+    cv2.setNumThreads(1)
+    detector = create_detector(**(detector_kwargs or {}))
+    frames = results = None
+    last_seq = -1
+    last_annotated = 0.0
+    while True:
+        msg = in_queue.get()
+        if msg is None:
+            break
+        if msg[0] == 'attach':
+            frames, results = _open_ring(msg[1]), _open_ring(msg[2])
+            continue
+        if frames is None:
+            continue
+
+        annotate = time.time() - last_annotated >= annotate_interval
+        result = process_latest(detector, frames, results, last_seq, max_age, annotate)
+        if result[0] == 'none':
+            continue
+        last_seq = result[2]
+        if result[0] == 'ok' and annotate:
+            last_annotated = result[4]
+        out_queue.put((camera_index,) + result + (annotate,))
+
+    for ring in (frames, results):
+        if ring is not None and not ring.owner:
+            ring.close()
+
+
+class CameraWorkerPool:
+    """One processing worker per camera with per-camera result ordering"""
+
+    def __init__(self, num_cameras, mode='process', detector_kwargs=None, max_age=0.1, metrics=None,
+                 scheduler=None, annotate_interval=0.0):
+        if mode not in ('process', 'thread'):
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.num_cameras = num_cameras
+        self.mode = mode
+        self.detector_kwargs = detector_kwargs
+        self.max_age = max_age
+        self.metrics = metrics
+        # Minimum time between annotated results per camera (see camera_worker)
+        self.annotate_interval = annotate_interval
+        # LoadScheduler that decides which notifications are sent (optional)
+        self.scheduler = scheduler
+
+        self.workers = []
+        self.in_queues = []
+        self.out_queue = None
+
+        # Per-camera ordering and drop counters
+        self.last_emitted = [-1] * num_cameras
+        self.superseded = [0] * num_cameras
+        self.skipped = [0] * num_cameras
+
+    def start(self):
+        if self.mode == 'process':
+            # spawn: never fork a process that already runs Qt threads
+            ctx = multiprocessing.get_context('spawn')
+            make_queue, make_worker = ctx.Queue, ctx.Process
+        else:
+            make_queue, make_worker = queue.Queue, threading.Thread
+
+        self.out_queue = make_queue()
+        for camera_index in range(self.num_cameras):
+            # One pending notification is enough, the worker always takes the newest frame
+            in_queue = make_queue(maxsize=1)
+            worker = make_worker(
+                target=camera_worker,
+                args=(camera_index, in_queue, self.out_queue, self.detector_kwargs, self.max_age,
+                      self.annotate_interval),
+                daemon=True,
+            )
+            worker.start()
+            self.in_queues.append(in_queue)
+            self.workers.append(worker)
+
+    def attach(self, camera_index, frames, results):
+        """Hand the frame ring and result ring of a camera to its worker"""
+        if self.mode == 'process':
+            msg = ('attach', frames.spec(), results.spec())
+        else:
+            msg = ('attach', frames, results)
+        self.in_queues[camera_index].put(msg)
+
+    def notify(self, camera_index):
+        """Tell the worker a new frame was published in its ring"""
+        try:
+            self.in_queues[camera_index].put_nowait(('frame',))
+        except queue.Full:
+            pass  # Worker is already due to look at the ring
+
+    def get_result(self, timeout=0.1):
+        """Next processed result or None
+
+        Results are (camera_index, result_slot, seq, timestamp, started, finished,
+        detections, annotated).
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = max(0.0, deadline - time.time())
+            try:
+                camera_index, status, out_slot, seq, timestamp, started, finished, detections, annotated = \
+                    self.out_queue.get(timeout=remaining)
+            except queue.Empty:
+                return None
+
+            # Never go back in time for a camera
+            last = self.last_emitted[camera_index]
+            if seq <= last:
+                continue
+            if last >= 0:
+                if self.scheduler:
+                    shed, superseded = self.scheduler.split_gap(camera_index, seq - last - 1)
+                else:
+                    shed, superseded = 0, seq - last - 1
+                self.superseded[camera_index] += superseded
+                if self.metrics:
+                    self.metrics.drop(camera_index, 'superseded', superseded)
+                    self.metrics.drop(camera_index, 'shed', shed)
+            self.last_emitted[camera_index] = seq
+            if status != 'ok':
+                self.skipped[camera_index] += 1
+                if self.metrics:
+                    self.metrics.drop(camera_index, status)
+                continue
+            return camera_index, out_slot, seq, timestamp, started, finished, detections, annotated
+
+    def queue_size_total(self):
+        """Pending notifications (approximate for processes)"""
+        total = 0
+        for in_queue in self.in_queues:
+            try:
+                total += in_queue.qsize()
+            except NotImplementedError:  # macOS multiprocessing queues
+                pass
+        return total
+
+    def stop(self):
+        for in_queue in self.in_queues:
+            try:
+                in_queue.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+        for worker in self.workers:
+            worker.join(timeout=2.0)
+            if self.mode == 'process' and worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.in_queues = []
+
+
+def _run_pool(num_cameras, frames, mode, num_frames):
+    """Push num_frames frames per camera through a pool, returns processed frames/s
+
+    Closed loop: every camera has one frame in flight, a new one is published as
+    soon as the previous result is back, so nothing is superseded.
+    """
+    pool = CameraWorkerPool(num_cameras, mode=mode, max_age=0)
+    pool.start()
+    height, width = frames[0].shape[:2]
+    rings = []
+    for camera_index in range(num_cameras):
+        frame_ring = FrameRing(3, [('frame', (height, width, 3), np.uint8)])
+        result_ring = make_result_ring(frame_ring)
+        pool.attach(camera_index, frame_ring, result_ring)
+        rings.append((frame_ring, result_ring))
+
+    def publish(camera_index, i):
+        frame_ring = rings[camera_index][0]
+        slot = frame_ring.begin_write()
+        np.copyto(frame_ring.frame(slot), frames[i % len(frames)])
+        frame_ring.end_write(slot, time.time())
+        pool.notify(camera_index)
+
+    # Warm up: first frames include worker start-up and subtractor allocation
+    for camera_index in range(num_cameras):
+        publish(camera_index, 0)
+    for _ in range(num_cameras):
+        if pool.get_result(timeout=30) is None:
+            break
+
+    sent = [1] * num_cameras
+    received = 0
+    total = num_cameras * num_frames
+    for camera_index in range(num_cameras):
+        publish(camera_index, sent[camera_index])
+        sent[camera_index] += 1
+    start = time.perf_counter()
+    while received < total:
+        result = pool.get_result(timeout=30)
+        if result is None:
+            break
+        received += 1
+        camera_index = result[0]
+        if sent[camera_index] <= num_frames:
+            publish(camera_index, sent[camera_index])
+            sent[camera_index] += 1
+    elapsed = time.perf_counter() - start
+
+    pool.stop()
+    for frame_ring, result_ring in rings:
+        frame_ring.close()
+        result_ring.close()
+    return received / elapsed
+
+
+def benchmark_scaling(num_cameras=2, mode='process', num_frames=200, width=1280, height=720):
+    """Compare throughput of one camera against num_cameras and print the scaling factor"""
+    source = SyntheticSource(width, height, realtime=False)
+    source.open()
+    frames = [source.read()[1] for _ in range(30)]
+
+    single = _run_pool(1, frames, mode, num_frames)
+    multi = _run_pool(num_cameras, frames, mode, num_frames)
+    scaling = multi / single
+
+    print(f"Mode: {mode}, {width}x{height}")
+    print(f"1 camera:  {single:.1f} frames/s")
+    print(f"{num_cameras} cameras: {multi:.1f} frames/s total ({multi / num_cameras:.1f} per camera)")
+    print(f"Scaling factor: {scaling:.2f}x (ideal {num_cameras}x)")
+    return {'single_fps': single, 'multi_fps': multi, 'scaling': scaling}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-camera worker scaling benchmark")
+    parser.add_argument('--cameras', type=int, default=2)
+    parser.add_argument('--mode', choices=['process', 'thread'], default='process')
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+    benchmark_scaling(args.cameras, args.mode, args.frames)
+
+
+if __name__ == "__main__":
+    main()